@@ -3,20 +3,96 @@
 import numpy as np
 import json
 
+from .feature_table import DRACO_EXTENSION
+
+# componentType of the numpy types of the binary properties
+COMPONENT_TYPES = {
+    np.dtype(np.int8): 'BYTE',
+    np.dtype(np.uint8): 'UNSIGNED_BYTE',
+    np.dtype(np.int16): 'SHORT',
+    np.dtype(np.uint16): 'UNSIGNED_SHORT',
+    np.dtype(np.int32): 'INT',
+    np.dtype(np.uint32): 'UNSIGNED_INT',
+    np.dtype(np.float32): 'FLOAT',
+    np.dtype(np.float64): 'DOUBLE',
+}
+
+
+def _component_dtype(component_type):
+    return next(dtype for dtype, name in COMPONENT_TYPES.items() if name == component_type).newbyteorder('<')
+
 
 class BatchTable(object):
     """
-    Only the JSON header has been implemented for now. According to the batch
+    The JSON header holds the properties given as lists. According to the batch
     table documentation, the binary body is useful for storing long arrays of
-    data (better performances)
+    data (better performances): the properties given as numpy arrays are stored
+    in the body, each one aligned on 8 bytes. With the 3DTILES_draco_point_compression extension,
+    the binary properties are compressed in the draco buffer of the feature table instead.
     """
 
     def __init__(self):
         self.header = {}
+        self.body = []
+        # the values of the properties compressed with draco
+        self.draco_values = {}
 
     def add_property_from_array(self, propertyName, array):
         self.header[propertyName] = array
 
+    def add_binary_property_from_array(self, propertyName, array):
+        """
+        Store a scalar property in the binary body. The type of array must be in COMPONENT_TYPES.
+        """
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        self.header[propertyName] = {
+            'byteOffset': sum(len(arr) for arr in self.body),
+            'componentType': COMPONENT_TYPES[array.dtype.newbyteorder('=')],
+            'type': 'SCALAR',
+        }
+        data = array.view(np.uint8).ravel()
+        self.body.append(np.concatenate((data, np.zeros(-len(data) % 8, dtype=np.uint8))))
+
+    def get_binary_property(self, propertyName, length):
+        """
+        Returns the values of a property stored in the binary body, for length features
+        """
+        if propertyName in self.draco_values:
+            return self.draco_values[propertyName]
+        prop = self.header[propertyName]
+        return np.frombuffer(self.body_to_array().data, dtype=_component_dtype(prop['componentType']),
+                             count=length, offset=prop['byteOffset'])
+
+    def get_binary_property_names(self):
+        return [name for name, prop in self.header.items()
+                if name != 'extensions' and isinstance(prop, dict) and 'componentType' in prop]
+
+    def get_draco_properties(self):
+        """
+        Returns the draco attribute ids of the properties compressed with draco
+        """
+        return self.header.get('extensions', {}).get(DRACO_EXTENSION, {}).get('properties', {})
+
+    def compress(self, properties, draco_attributes):
+        """
+        Declare the binary properties compressed in the draco buffer of the feature table: properties gives
+        their draco attribute ids, and draco_attributes the values of the draco attributes by id.
+        """
+        for name in properties:
+            # the byte offsets of the compressed properties are ignored
+            self.header[name]['byteOffset'] = 0
+        self.header.setdefault('extensions', {})[DRACO_EXTENSION] = {'properties': properties}
+        self.body = []
+        self.decompress(draco_attributes)
+
+    def decompress(self, draco_attributes):
+        """
+        Set the values of the properties compressed with draco, from the draco attributes of the feature table
+        """
+        for name, attribute_id in self.get_draco_properties().items():
+            dtype = _component_dtype(self.header[name]['componentType'])
+            self.draco_values[name] = draco_attributes[attribute_id].astype(dtype).ravel()
+
     # returns batch table as binary
     def to_array(self):
         # convert dict to json string
@@ -24,4 +100,33 @@ class BatchTable(object):
         # header must be 4-byte aligned (refer to batch table documentation)
         bt_json += ' ' * (4 - len(bt_json) % 4)
         # returns an array of binaries representing the batch table
-        return np.fromstring(bt_json, dtype=np.uint8)
+        return np.frombuffer(bt_json.encode('utf-8'), dtype=np.uint8)
+
+    def body_to_array(self):
+        if not self.body:
+            return np.array([], dtype=np.uint8)
+        if len(self.body) == 1:
+            return self.body[0]
+        return np.concatenate(self.body)
+
+    @staticmethod
+    def from_array(th, array):
+        """
+        Parameters
+        ----------
+        th : TileContentHeader
+
+        array : numpy.array
+
+        Returns
+        -------
+        bt : BatchTable
+        """
+
+        bt = BatchTable()
+        bt_json_arr = array[0:th.bt_json_byte_length]
+        bt.header = json.loads(bt_json_arr.tobytes().decode('utf-8'))
+        bt_bin_arr = array[th.bt_json_byte_length:th.bt_json_byte_length + th.bt_bin_byte_length]
+        if len(bt_bin_arr):
+            bt.body = [bt_bin_arr]
+        return bt
@@ -3,6 +3,7 @@ import py3dtiles.convert as convert
 import py3dtiles.info as info
 import py3dtiles.merger as merger
 import py3dtiles.export as export
+import py3dtiles.worker as worker
 import traceback
 
 
@@ -31,6 +32,7 @@ def main():
     info.init_parser(sub_parsers, str2bool)
     merger.init_parser(sub_parsers, str2bool)
     export.init_parser(sub_parsers, str2bool)
+    worker.init_parser(sub_parsers, str2bool)
 
     args = parser.parse_args()
 
@@ -43,6 +45,8 @@ def main():
             merger.main(args)
         elif args.command == 'export':
             export.main(args)
+        elif args.command == 'worker':
+            worker.main(args)
         else:
             parser.print_help()
     except Exception:
@@ -1,5 +1,5 @@
 import argparse
-import concurrent.futures
+import bisect
 import json
 import multiprocessing
 import os
@@ -7,7 +7,9 @@ import pickle
 import shutil
 import struct
 import sys
+import tempfile
 import time
+import uuid
 from collections import namedtuple
 from pathlib import Path, PurePath
 
@@ -18,21 +20,30 @@ from pyproj import CRS, Transformer
 
 from py3dtiles import TileContentReader
 from py3dtiles.constants import MIN_POINT_SIZE
-from py3dtiles.points.node import Node
+from py3dtiles.feature_table import DRACO_COMPONENT_TYPES, DRACO_EXTENSION
+from py3dtiles.points.checkpoint import load_checkpoint, save_checkpoint
+from py3dtiles.points.memory_governor import MemoryGovernor
+from py3dtiles.points.node import DEFAULT_SPLIT_POLICY, Node, TilesetSplitPolicy
+from py3dtiles.points.pending_regions import PendingRegions
+from py3dtiles.points.point_attributes import EXTRA_ATTRIBUTES, make_point_dtype, read_point_attributes
+from py3dtiles.points.scheduler import Scheduler
 from py3dtiles.points.shared_node_store import SharedNodeStore
+from py3dtiles.points.shared_points import inline_points, make_segment_prefix, point_size, set_segment_prefix, \
+    start_resource_tracker
+from py3dtiles.points.task_spill import TaskSpill
 from py3dtiles.points.task import las_reader, xyz_reader, node_process, pnts_writer
 from py3dtiles.points.transformations import rotation_matrix, angle_between_vectors, vector_product, inverse_matrix, \
     scale_matrix, translation_matrix
-from py3dtiles.points.utils import CommandType, ResponseType, compute_spacing, name_to_filename
+from py3dtiles.points.utils import CommandType, ResponseType, compute_spacing, name_to_filename, point_to_node_name
 from py3dtiles.utils import SrsInMissingException
 
 TOTAL_MEMORY_MB = int(psutil.virtual_memory().total / (1024 * 1024))
-IPC_URI = "ipc:///tmp/py3dtiles1"
 
 OctreeMetadata = namedtuple('OctreeMetadata', ['aabb', 'spacing', 'scale'])
 
 
-def write_tileset(out_folder, octree_metadata, offset, scale, rotation_matrix, include_rgb):
+def write_tileset(out_folder, octree_metadata, offset, scale, rotation_matrix, include_rgb, tile_index,
+                  split_policy=DEFAULT_SPLIT_POLICY, quantize=False, draco=False, point_dtype=None):
     # compute tile transform matrix
     if rotation_matrix is None:
         transform = np.identity(4)
@@ -47,14 +58,10 @@ def write_tileset(out_folder, octree_metadata, offset, scale, rotation_matrix, i
     inv_aabb_size = (1.0 / np.maximum(MIN_POINT_SIZE, octree_metadata.aabb[1] - octree_metadata.aabb[0])).astype(np.float32)
     for child in range(8):
         ondisk_tile = name_to_filename(out_folder, str(child).encode('ascii'), '.pnts')
-        if os.path.exists(ondisk_tile):
-            tile_content = TileContentReader.read_file(ondisk_tile)
-            fth = tile_content.body.feature_table.header
-            xyz = tile_content.body.feature_table.body.positions_arr.view(np.float32).reshape((fth.points_length, 3))
-            if include_rgb:
-                rgb = tile_content.body.feature_table.body.colors_arr.reshape((fth.points_length, 3))
-            else:
-                rgb = np.zeros(xyz.shape, dtype=np.uint8)
+        if str(child).encode('ascii') in tile_index:
+            tile_content = TileContentReader.read_file(ondisk_tile, mmap=True)
+            xyz = tile_content.body.feature_table.get_positions()
+            _, rgb = read_point_attributes(tile_content)
 
             root_node.grid.insert(
                 octree_metadata.aabb[0].astype(np.float32),
@@ -62,11 +69,16 @@ def write_tileset(out_folder, octree_metadata, offset, scale, rotation_matrix, i
                 xyz.copy(),
                 rgb)
 
-    pnts_writer.node_to_pnts(''.encode('ascii'), root_node, out_folder, include_rgb)
+    count, _ = pnts_writer.node_to_pnts(''.encode('ascii'), root_node, out_folder, include_rgb, quantize, draco,
+                                        point_dtype)
+    if count:
+        xyz = root_node.grid.xyz[:count]
+        tile_index[b''] = (count, np.array([np.amin(xyz, axis=0), np.amax(xyz, axis=0)]))
 
-    executor = concurrent.futures.ProcessPoolExecutor()
-    root_tileset = Node.to_tileset(executor, ''.encode('ascii'), octree_metadata.aabb, octree_metadata.spacing, out_folder, scale)
-    executor.shutdown()
+    # the viewers must decode the compressed tiles
+    extensions = [DRACO_EXTENSION] if draco else []
+    root_tileset = Node.to_tileset(''.encode('ascii'), octree_metadata.aabb, octree_metadata.spacing, out_folder, scale,
+                                   tile_index, split_policy, extensions)
 
     root_tileset['transform'] = transform.T.reshape(16).tolist()
     root_tileset['refine'] = 'REPLACE'
@@ -81,12 +93,30 @@ def write_tileset(out_folder, octree_metadata, offset, scale, rotation_matrix, i
             octree_metadata.aabb[1] - octree_metadata.aabb[0]) / scale[0],
         'root': root_tileset,
     }
+    if extensions:
+        tileset['extensionsUsed'] = tileset['extensionsRequired'] = extensions
 
     tileset_path = Path(out_folder) / "tileset.json"
     with tileset_path.open('w') as f:
         f.write(json.dumps(tileset))
 
 
+def sort_portions(portions, portion_aabbs, aabb):
+    """
+    Sort the portions along the octree by the center of their bounds, so the portions read one after
+    the other fill the same subtrees, that can be written early. The portions of a file have the same bounds,
+    they stay in order. The portions of unknown bounds are read last.
+
+    Returns the sorted portions and their bounds
+    """
+    keys = [
+        b'8' if portion_aabb is None else point_to_node_name((portion_aabb[0] + portion_aabb[1]) * 0.5, aabb, 10)
+        for portion_aabb in portion_aabbs
+    ]
+    order = sorted(range(len(portions)), key=keys.__getitem__)
+    return [portions[i] for i in order], [portion_aabbs[i] for i in order]
+
+
 def make_rotation_matrix(z1, z2):
     v0 = z1 / np.linalg.norm(z1)
     v1 = z2 / np.linalg.norm(z2)
@@ -96,30 +126,75 @@ def make_rotation_matrix(z1, z2):
         vector_product(v0, v1))
 
 
+def make_ipc_uri():
+    """
+    Returns a new ipc endpoint, so several conversions can run at the same time on a host.
+    """
+    return 'ipc://' + os.path.join(tempfile.gettempdir(), f'py3dtiles-{os.getpid()}-{uuid.uuid4().hex}')
+
+
+def connect_uri(bind_uri):
+    """
+    Returns the uri to connect to a socket bound on bind_uri, from the same host.
+    """
+    for wildcard in ('://*:', '://0.0.0.0:'):
+        bind_uri = bind_uri.replace(wildcard, '://127.0.0.1:')
+    return bind_uri
+
+
 # Worker
-def zmq_process(*args):
+def zmq_process(uri, *args):
     process = Worker(*args)
-    process.run()
+    process.run(uri)
+
+
+def remote_zmq_process(uri):
+    """
+    Join the conversion managed by the process listening on uri.
+    The worker parameters are sent by the manager.
+    """
+    context = zmq.Context()
+    skt = context.socket(zmq.DEALER)
+    skt.connect(uri)
+    skt.send_multipart([ResponseType.REGISTER.value])
+    message = skt.recv_multipart()
+    context.destroy()
+
+    if message[1] != CommandType.CONFIGURE.value:
+        # the conversion is already over
+        return
+
+    process = Worker(*pickle.loads(message[2]))
+    # activity files are only gathered on the host of the manager
+    process.activity_graph = False
+    process.run(uri)
 
 
 class Worker:
     """
     This class waits from jobs commands from the Zmq socket.
     """
-    def __init__(self, activity_graph, transformer, octree_metadata, folder, write_rgb, verbosity):
+    def __init__(self, activity_graph, transformer, octree_metadata, folder, write_rgb, quantize, draco, point_dtype,
+                 verbosity, shared_memory, segment_prefix=None):
         self.activity_graph = activity_graph
         self.transformer = transformer
         self.octree_metadata = octree_metadata
         self.folder = folder
         self.write_rgb = write_rgb
+        self.quantize = quantize
+        self.draco = draco
+        self.point_dtype = point_dtype
         self.verbosity = verbosity
+        self.shared_memory = shared_memory
+        self.segment_prefix = segment_prefix
 
         # Socket to receive messages on
         self.context = zmq.Context()
         self.skt = self.context.socket(zmq.DEALER)
 
-    def run(self):
-        self.skt.connect(IPC_URI)
+    def run(self, uri):
+        self.skt.connect(uri)
+        set_segment_prefix(self.segment_prefix)
 
         startup_time = time.time()
         idle_time = 0
@@ -168,6 +243,8 @@ class Worker:
                 print(f'{after}, 0', file=activity)
                 print(f'{after}, {command_type}', file=activity)
 
+        las_reader.close()
+
         if self.activity_graph:
             activity.close()
 
@@ -190,18 +267,22 @@ class Worker:
             parameters['portion'],
             self.skt,
             self.transformer,
-            self.verbosity
+            self.verbosity,
+            self.shared_memory,
+            self.point_dtype
         )
 
     def execute_write_pnts(self, content):
-        pnts_writer.run(self.skt, content[2], content[1], self.folder, self.write_rgb)
+        pnts_writer.run(self.skt, content[2], content[1], self.folder, self.write_rgb, self.quantize, self.draco,
+                        self.point_dtype)
 
     def execute_process_jobs(self, content):
         node_process.run(
             content[1:],
             self.octree_metadata,
             self.skt,
-            self.verbosity
+            self.verbosity,
+            self.shared_memory
         )
 
 
@@ -211,20 +292,25 @@ class ZmqManager:
     This class sends messages to the workers.
     We can also request general status.
     """
-    def __init__(self, number_of_jobs: int, process_args: tuple):
+    def __init__(self, number_of_jobs: int, process_args: tuple, uri: str):
         """
         For the process_args argument, see the init method of Worker
         to get the list of needed parameters.
+
+        number_of_jobs workers are started locally, other workers can join
+        from other hosts with remote_zmq_process if uri is a tcp endpoint.
         """
         self.context = zmq.Context()
 
         self.number_of_jobs = number_of_jobs
+        self.process_args = process_args
+        self.uri = uri
 
         self.socket = self.context.socket(zmq.ROUTER)
-        self.socket.bind(IPC_URI)
+        self.socket.bind(uri)
 
         self.processes = [
-            multiprocessing.Process(target=zmq_process, args=process_args)
+            multiprocessing.Process(target=zmq_process, args=(connect_uri(uri),) + process_args)
             for _ in range(number_of_jobs)
         ]
         [p.start() for p in self.processes]
@@ -237,9 +323,14 @@ class ZmqManager:
         self.time_waiting_an_idle_process = 0
 
     def send_to_process(self, message):
+        """
+        Send message to an idle worker and return its id
+        """
         if not self.idle_clients:
             raise ValueError("idle_clients is empty")
-        self.socket.send_multipart([self.idle_clients.pop(), pickle.dumps(time.time())] + message)
+        client_id = self.idle_clients.pop()
+        self.socket.send_multipart([client_id, pickle.dumps(time.time())] + message)
+        return client_id
 
     def send_to_all_process(self, message):
         if not self.idle_clients:
@@ -251,16 +342,27 @@ class ZmqManager:
     def can_queue_more_jobs(self):
         return len(self.idle_clients) != 0
 
+    def register_client(self, client_id):
+        """
+        Configure a worker started by remote_zmq_process.
+        """
+        if self.killing_processes:
+            self.socket.send_multipart([client_id, pickle.dumps(time.time()), CommandType.SHUTDOWN.value])
+        else:
+            self.socket.send_multipart([
+                client_id, pickle.dumps(time.time()), CommandType.CONFIGURE.value, pickle.dumps(self.process_args)])
+            self.number_of_jobs += 1
+
     def add_idle_client(self, client_id):
         if client_id in self.idle_clients:
             raise ValueError(f"The client id {client_id} is already in idle_clients")
         self.idle_clients.append(client_id)
 
     def are_all_processes_idle(self):
-        return len(self.idle_clients) == self.number_of_jobs
+        return self.number_of_jobs > 0 and len(self.idle_clients) == self.number_of_jobs
 
     def are_all_processes_killed(self):
-        return self.number_processes_killed == self.number_of_jobs
+        return self.killing_processes and self.number_processes_killed == self.number_of_jobs
 
     def kill_all_processes(self):
         self.send_to_all_process([CommandType.SHUTDOWN.value])
@@ -270,27 +372,11 @@ class ZmqManager:
         for p in self.processes:
             p.terminate()
 
-
-def is_ancestor(node_name, ancestor):
-    """
-    Example, the tile 22 is ancestor of 22458
-    Particular case, the tile 22 is ancestor of 22
-    """
-    return len(ancestor) <= len(node_name) and node_name[0:len(ancestor)] == ancestor
-
-
-def is_ancestor_in_list(node_name, ancestors):
-    for ancestor in ancestors:
-        if not ancestor or is_ancestor(node_name, ancestor):
-            return True
-    return False
-
-
-def can_pnts_be_written(node_name, finished_node, input_nodes, active_nodes):
-    return (
-        is_ancestor(node_name, finished_node)
-        and not is_ancestor_in_list(node_name, active_nodes)
-        and not is_ancestor_in_list(node_name, input_nodes))
+    def close(self):
+        self.context.destroy()
+        ipc_path = self.uri[len('ipc://'):]
+        if self.uri.startswith('ipc://') and os.path.exists(ipc_path):
+            os.remove(ipc_path)
 
 
 class State:
@@ -299,9 +385,15 @@ class State:
         self.max_point_in_progress = 60_000_000
         self.points_in_progress = 0
         self.points_in_pnts = 0
+        # the point counts of the portions may be estimations, the readers report the points they actually read
+        self.points_read = 0
+        # client id -> (point count, aabb) of the portion it's reading
+        self.reading_portions = {}
 
         # pointcloud_file_portions is a list of tuple (filename, (start offset, end offset))
-        self.point_cloud_file_parts = pointcloud_file_portions
+        # portions are popped from the end of the list: reverse it so each file is read
+        # from start to end, and the readers can keep streaming the same file
+        self.point_cloud_file_parts = list(reversed(pointcloud_file_portions))
         self.max_reading_jobs = max_reading_jobs
         self.number_of_reading_jobs = 0
         self.number_of_writing_jobs = 0
@@ -310,6 +402,7 @@ class State:
         # each entry is a tile identified by its name (a string of numbers)
         # so for each entry, it is a list of tasks
         # a task is a tuple (list of points, point_count)
+        # the point count includes the points of the tasks spilled in task_spill
         # points is a dictionary {xyz: list of coordinates, color: the associated color}
         self.node_to_process = {}
         # when a node is sent to a process, the item moves to processing_nodes
@@ -320,10 +413,39 @@ class State:
         # since the content is at this stage, stored in the node_store,
         # just keep the name of the node.
         # This list will be filled until the writing could be started.
+        # It's sorted, so the descendants of a node (the names starting with its name) are contiguous.
         self.waiting_writing_nodes = []
         # when the node is writing, its name is moved from waiting_writing_nodes to pnts_to_writing
         # the data to write are stored in a node object.
         self.pnts_to_writing = []
+        # the tiles already written in the output folder, name -> (point count, aabb of the points)
+        self.written_tiles = {}
+        # number of points of the tasks held in memory
+        self.points_in_memory = 0
+        self.task_spill = None
+        # chooses the next nodes of node_to_process to send to the workers
+        self.scheduler = Scheduler()
+        # name -> number of entries in node_to_process and processing_nodes (0, 1 or 2),
+        # to find if an ancestor of a node isn't processed yet in O(depth)
+        self.active_nodes = {}
+        # the regions where points may still arrive, see track_regions
+        self.pending_regions = None
+        # (filename, portion) -> aabb of the portions not read yet
+        self.portion_aabbs = {}
+        # aabbs of the portions whose points are sent to the root node, and being processed by the root node
+        self.root_regions = []
+        self.processing_root_regions = []
+        # True when a region is released, the waiting nodes may then be written
+        self.regions_released = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # shared memory segments don't outlive the conversion, pickle their content instead
+        state['node_to_process'] = {
+            name: ([inline_points(task) for task in tasks], point_count)
+            for name, (tasks, point_count) in self.node_to_process.items()
+        }
+        return state
 
     def is_reading_finish(self):
         return not self.point_cloud_file_parts and self.number_of_reading_jobs == 0
@@ -334,10 +456,155 @@ class State:
 
         if node_name not in self.node_to_process:
             self.node_to_process[node_name] = ([task], point_count)
+            self._activate(node_name)
         else:
             tasks, count = self.node_to_process[node_name]
             tasks.append(task)
             self.node_to_process[node_name] = (tasks, count + point_count)
+        self.points_in_memory += point_count
+        self.scheduler.push(node_name, point_count)
+
+    def pop_tasks_to_process(self, node_name):
+        """
+        Remove the tasks of a node, and return them with their point count, including the spilled tasks
+        """
+        tasks, point_count = self.node_to_process.pop(node_name)
+        self._deactivate(node_name)
+        if self.task_spill is None:
+            self.points_in_memory -= point_count
+            return tasks, point_count
+        self.points_in_memory -= point_count - self.task_spill.point_count(node_name)
+        return self.task_spill.load(node_name) + tasks, point_count
+
+    def start_processing(self, node_name, task_count, point_count, now):
+        self.processing_nodes[node_name] = (task_count, point_count, now)
+        self._activate(node_name)
+        self.remove_waiting_writing_node(node_name)
+        if not node_name:
+            self.processing_root_regions += self.root_regions
+            self.root_regions = []
+
+    def end_processing(self, node_name):
+        """
+        Returns the (task count, point count, start time) of the node sent to a worker
+        """
+        self._deactivate(node_name)
+        if not node_name:
+            self._release_regions(self.processing_root_regions)
+            self.processing_root_regions = []
+        return self.processing_nodes.pop(node_name)
+
+    def track_regions(self, root_aabb, portion_aabbs):
+        """
+        Record the bounds of the portions to read (in the octree coordinates, None if unknown),
+        so the nodes out of the portions not read yet can be written while reading.
+
+        The points of the portions are sent to the root node, so the root node isn't an active ancestor
+        of the nodes anymore: the regions of its points are tracked instead.
+        """
+        self.pending_regions = PendingRegions(root_aabb)
+        for part, aabb in zip(reversed(self.point_cloud_file_parts), portion_aabbs):
+            self.portion_aabbs[part] = aabb
+            self.pending_regions.add(aabb)
+
+    def start_reading(self, client_id, filename, portion):
+        self.reading_portions[client_id] = (portion[1] - portion[0], self.portion_aabbs.pop((filename, portion), None))
+
+    def end_reading(self, client_id):
+        """
+        Returns the point count of the portion read by client_id, as estimated by the reader init
+        """
+        point_count, aabb = self.reading_portions.pop(client_id)
+        self._release_regions([aabb])
+        return point_count
+
+    def add_root_region(self, client_id):
+        """
+        Record the region of the points sent to the root node by the reader client_id
+        """
+        if self.pending_regions is not None:
+            aabb = self.reading_portions[client_id][1]
+            self.pending_regions.add(aabb)
+            self.root_regions.append(aabb)
+
+    def _release_regions(self, aabbs):
+        if self.pending_regions is not None:
+            released = [self.pending_regions.remove(aabb) for aabb in aabbs]
+            self.regions_released = self.regions_released or any(released)
+
+    def _activate(self, node_name):
+        self.active_nodes[node_name] = self.active_nodes.get(node_name, 0) + 1
+
+    def _deactivate(self, node_name):
+        count = self.active_nodes.pop(node_name) - 1
+        if count:
+            self.active_nodes[node_name] = count
+
+    def is_ancestor_active(self, node_name):
+        """
+        Returns True if the node or one of its ancestors is waiting to be processed or processed.
+        The ancestors of the tile 22458 are the tiles 2245, 224, 22, 2 and the root.
+        """
+        # the points of the root node are tracked in pending_regions instead
+        first = 0 if self.pending_regions is None else 1
+        return any(node_name[:length] in self.active_nodes for length in range(first, len(node_name) + 1))
+
+    def is_settled(self, node_name):
+        """
+        Returns True if no point can be added to the node anymore
+        """
+        if self.is_ancestor_active(node_name):
+            return False
+        return self.pending_regions is None or self.pending_regions.is_node_settled(node_name)
+
+    def add_waiting_writing_node(self, node_name):
+        bisect.insort(self.waiting_writing_nodes, node_name)
+
+    def remove_waiting_writing_node(self, node_name):
+        idx = bisect.bisect_left(self.waiting_writing_nodes, node_name)
+        if idx < len(self.waiting_writing_nodes) and self.waiting_writing_nodes[idx] == node_name:
+            del self.waiting_writing_nodes[idx]
+
+    def pop_writable_nodes(self, finished_node):
+        """
+        Remove and return the nodes waiting to be written that can be written now that finished_node is processed:
+        finished_node and its descendants, unless they can still receive points.
+        """
+        if self.is_ancestor_active(finished_node):
+            return []
+
+        start = bisect.bisect_left(self.waiting_writing_nodes, finished_node)
+        end = start
+        while end < len(self.waiting_writing_nodes) and self.waiting_writing_nodes[end].startswith(finished_node):
+            end += 1
+
+        writable = []
+        remaining = []
+        for name in self.waiting_writing_nodes[start:end]:
+            (writable if self.is_settled(name) else remaining).append(name)
+        self.waiting_writing_nodes[start:end] = remaining
+        if self.pending_regions is not None:
+            for name in writable:
+                self.pending_regions.forget(name)
+        return writable
+
+    def spill_tasks(self, max_points_in_memory):
+        """
+        Write the tasks of the nodes with the most points in memory to disk,
+        until at most max_points_in_memory points are held in memory
+        """
+        candidates = sorted([
+            (point_count - self.task_spill.point_count(name), name)
+            for name, (tasks, point_count) in self.node_to_process.items()
+            if tasks
+        ], reverse=True)
+        for points_to_spill, name in candidates:
+            if self.points_in_memory <= max_points_in_memory:
+                break
+            tasks, point_count = self.node_to_process[name]
+            self.task_spill.spill(name, tasks, points_to_spill)
+            self.node_to_process[name] = ([], point_count)
+            self.points_in_memory -= points_to_spill
 
     def can_add_reading_jobs(self):
         return (
@@ -365,18 +632,52 @@ class State:
             ''))
 
 
+def remove_unrecorded_tiles(out_folder, written_tiles):
+    """
+    Delete the tiles (and tilesets) written after the checkpoint of a resumed conversion.
+    """
+    recorded = {os.path.normpath(name_to_filename(out_folder, name, '.pnts')) for name in written_tiles}
+    working_dir = os.path.normpath(os.path.join(out_folder, 'tmp'))
+    for root, dirs, files in os.walk(out_folder):
+        if os.path.normpath(root) == working_dir:
+            dirs.clear()
+            continue
+        for filename in files:
+            path = os.path.normpath(os.path.join(root, filename))
+            if filename.endswith('.pnts') and path not in recorded:
+                os.remove(path)
+            elif filename.startswith('tileset') and filename.endswith('.json'):
+                os.remove(path)
+
+
 def convert(files,
             outfolder='./3dtiles',
             overwrite=False,
             jobs=multiprocessing.cpu_count(),
             cache_size=int(TOTAL_MEMORY_MB / 10),
+            max_memory=None,
+            spill_threshold=None,
             srs_out=None,
             srs_in=None,
             fraction=100,
             benchmark=None,
             rgb=True,
+            quantize=False,
+            draco=False,
+            normals=False,
+            extra_attributes=None,
             graph=False,
             color_scale=None,
+            delimiter=None,
+            columns=None,
+            aabb=None,
+            tileset_max_size=100000,
+            tileset_max_depth=None,
+            tileset_max_tiles=None,
+            zmq_uri=None,
+            shared_memory=True,
+            checkpoint_interval=None,
+            resume=False,
             verbose=False):
     """convert
 
@@ -390,8 +691,20 @@ def convert(files,
     :type overwrite: bool
     :param jobs: The number of parallel jobs to start. Default to the number of cpu.
     :type jobs: int
+    :param zmq_uri: The zmq endpoint the workers connect to. Default to a new ipc endpoint
+        for each conversion. With a tcp endpoint (e.g. tcp://*:5555),
+        workers from other hosts can join the conversion with 'py3dtiles worker'.
+        The input files and the output folder must then be reachable with the same paths by every host.
+    :type zmq_uri: str
     :param cache_size: Cache size in MB. Default to available memory / 10.
     :type cache_size: int
+    :param max_memory: Memory budget in MB of the conversion (the main process and its local workers).
+        Above it, no new portion is read and the node cache is emptied. The cache size is at most
+        a quarter of this budget.
+    :type max_memory: int
+    :param spill_threshold: Size in MB of the points waiting to be processed above which they're written
+        on disk, until they're processed. Default to a quarter of max_memory if set, no limit otherwise.
+    :type spill_threshold: float
     :param srs_out: SRS to convert the output with (numeric part of the EPSG code)
     :type srs_out: int or str
     :param srs_in: Override input SRS (numeric part of the EPSG code)
@@ -402,10 +715,51 @@ def convert(files,
     :type benchmark: str
     :param rgb: Export rgb attributes.
     :type rgb: bool
+    :param quantize: Write the positions of the points quantized on 16 bits in the bounding box of each tile,
+        instead of float32.
+    :type quantize: bool
+    :param draco: Compress the points with the 3DTILES_draco_point_compression extension (requires DracoPy):
+        their positions, colors, normals (NORMAL instead of NORMAL_OCT16P) and extra attributes.
+        The positions are quantized by draco, quantize is ignored. gps_time can't be compressed.
+    :type draco: bool
+    :param normals: Export the normals of the points, oct-encoded (NORMAL_OCT16P). They're read from the extra
+        bytes of the las files (normal_x, normal_y and normal_z, or nx, ny and nz).
+    :type normals: bool
+    :param extra_attributes: The attributes of the points exported in the batch table of the tiles, among
+        intensity, classification, return_number and gps_time.
+    :type extra_attributes: list of str
     :param graph: Produce debug graphes (requires pygal).
     :type graph: bool
     :param color_scale: Force color scale
     :type color_scale: float
+    :param delimiter: The delimiter of the values in text files. Default to ',' or ';' if the first line
+        contains one, whitespaces otherwise.
+    :type delimiter: str
+    :param columns: The layout of the lines of text files, one letter per value: x, y, z, i (intensity),
+        r, g, b, or _ to ignore a value (e.g. 'xyz_rgb'). Default to xyz, xyzi, xyzrgb or xyzirgb
+        depending on the number of values.
+    :type columns: str
+    :param aabb: The bounding box ((xmin, ymin, zmin), (xmax, ymax, zmax)) of all the text files, in their srs.
+        If set, the text files are split in portions from their sizes instead of being scanned before the
+        conversion starts, and the point count is only known at the end.
+    :type aabb: list of float
+    :param tileset_max_size: The maximum size in bytes of the json of a subtree of the tileset,
+        above it the subtree is written in an external tileset.
+    :type tileset_max_size: int
+    :param tileset_max_depth: If set, the subtrees deeper than tileset_max_depth levels are written in external tilesets.
+    :type tileset_max_depth: int
+    :param tileset_max_tiles: If set, the subtrees with more than tileset_max_tiles tiles are written in external
+        tilesets.
+    :type tileset_max_tiles: int
+    :param shared_memory: Transfer the points between processes with shared memory segments
+        instead of copying them through the manager process.
+    :type shared_memory: bool
+    :param checkpoint_interval: If set, save the conversion state every checkpoint_interval seconds,
+        so an interrupted conversion can be resumed with the resume parameter.
+    :type checkpoint_interval: float
+    :param resume: Resume an interrupted conversion from the last checkpoint saved in outfolder.
+        The other parameters must be the same as the ones of the interrupted conversion.
+    :type resume: bool
 
     :raises SrsInMissingException: if py3dtiles couldn't find srs informations in input files and srs_in is not specified
     """
@@ -413,6 +767,16 @@ def convert(files,
     # allow str directly if only one input
     files = [files] if isinstance(files, str) else files
 
+    if draco:
+        # fail before starting the workers if DracoPy is missing
+        import DracoPy  # noqa: F401
+
+    point_dtype = make_point_dtype(normals, extra_attributes or ())
+    if draco:
+        lossy = [name for name in point_dtype.names if point_dtype[name].base not in DRACO_COMPONENT_TYPES]
+        if lossy:
+            raise ValueError(f"The extra attributes {lossy} can't be compressed with draco without loss")
+
     # read all input files headers and determine the aabb/spacing
     extensions = set()
     for file in files:
@@ -421,8 +785,38 @@ def convert(files,
         raise ValueError("All files should have the same extension, currently there are", extensions)
     extension = extensions.pop()
 
-    init_reader_fn = las_reader.init if extension in ('.las', '.laz') else xyz_reader.init
-    infos = init_reader_fn(files, color_scale=color_scale, srs_in=srs_in, srs_out=srs_out)
+    out_folder_path = Path(outfolder)
+    working_dir = out_folder_path / "tmp"
+
+    # the parameters that must not change between an interrupted conversion and its resumption
+    parameters = {
+        'files': files,
+        'srs_out': srs_out,
+        'srs_in': srs_in,
+        'fraction': fraction,
+        'rgb': rgb,
+        'quantize': quantize,
+        'draco': draco,
+        'normals': normals,
+        'extra_attributes': extra_attributes,
+        'color_scale': color_scale,
+        'delimiter': delimiter,
+        'columns': columns,
+        'aabb': aabb,
+    }
+
+    if resume:
+        checkpoint = load_checkpoint(working_dir)
+        if checkpoint['parameters'] != parameters:
+            raise ValueError("The parameters differ from the ones of the conversion to resume: "
+                             f"{checkpoint['parameters']}")
+        infos = checkpoint['infos']
+    else:
+        if extension in ('.las', '.laz'):
+            infos = las_reader.init(files, color_scale=color_scale, srs_in=srs_in, srs_out=srs_out)
+        else:
+            infos = xyz_reader.init(files, color_scale=color_scale, srs_in=srs_in, srs_out=srs_out,
+                                    jobs=jobs, delimiter=delimiter, columns=columns, aabb=aabb)
 
     avg_min = infos['avg_min']
     rotation_matrix = None
@@ -489,20 +883,30 @@ def convert(files,
 
     octree_metadata = OctreeMetadata(aabb=root_aabb, spacing=root_spacing, scale=root_scale[0])
 
-    # create folder
-    out_folder_path = Path(outfolder)
-    if out_folder_path.is_dir():
-        if overwrite:
-            shutil.rmtree(out_folder_path, ignore_errors=True)
-        else:
-            print(f"Error, folder '{outfolder}' already exists")
-            sys.exit(1)
+    if resume:
+        state = checkpoint['state']
+        node_store = SharedNodeStore.from_checkpoint(str(working_dir), checkpoint['node_store'])
+        remove_unrecorded_tiles(outfolder, state.written_tiles)
+    else:
+        # create folder
+        if out_folder_path.is_dir():
+            if overwrite:
+                shutil.rmtree(out_folder_path, ignore_errors=True)
+            else:
+                print(f"Error, folder '{outfolder}' already exists")
+                sys.exit(1)
 
-    out_folder_path.mkdir()
-    working_dir = out_folder_path / "tmp"
-    working_dir.mkdir(parents=True)
+        out_folder_path.mkdir()
+        working_dir.mkdir(parents=True)
 
-    node_store = SharedNodeStore(str(working_dir))
+        portions, portion_aabbs = sort_portions(infos['portions'], infos['portion_aabbs'], infos['aabb'])
+        state = State(portions, max(1, jobs // 2))
+        if not transformer:
+            # without reprojection, the portion bounds are easily converted in the octree coordinates
+            state.track_regions(root_aabb, [
+                None if aabb is None else (aabb - avg_min) * root_scale for aabb in portion_aabbs
+            ])
+        node_store = SharedNodeStore(str(working_dir))
 
     if verbose >= 1:
         print('Summary:')
@@ -520,213 +924,280 @@ def convert(files,
     if graph:
         progression_log = open('progression.csv', 'w')
 
-    state = State(infos['portions'], max(1, jobs // 2))
+    if zmq_uri is None:
+        zmq_uri = make_ipc_uri()
+    distributed = zmq_uri.startswith('tcp://')
+    # remote workers can't access the shared memory of this host
+    shared_memory = shared_memory and not distributed
+    # names the segments of the conversion, to measure them
+    segment_prefix = None
+    if shared_memory:
+        start_resource_tracker()
+        segment_prefix = make_segment_prefix()
 
     # zmq setup
-    zmq_manager = ZmqManager(jobs, (graph, transformer, octree_metadata, outfolder, rgb, verbose))
-
-    while not zmq_manager.are_all_processes_killed():
-        now = time.time() - startup
-        at_least_one_job_ended = False
-
-        all_processes_busy = not zmq_manager.can_queue_more_jobs()
-        while all_processes_busy or zmq_manager.socket.poll(timeout=0, flags=zmq.POLLIN):
-            # Blocking read but it's fine because either all our child processes are busy
-            # or we know that there's something to read (zmq.POLLIN)
-            start = time.time()
-            message = zmq_manager.socket.recv_multipart()
-
-            client_id = message[0]
-            result = message[1:]
-            return_type = result[0]
-
-            if return_type == ResponseType.IDLE.value:
-                zmq_manager.add_idle_client(client_id)
-
-                if all_processes_busy:
-                    zmq_manager.time_waiting_an_idle_process += time.time() - start
-                all_processes_busy = False
-
-            elif return_type == ResponseType.HALTED.value:
-                zmq_manager.number_processes_killed += 1
-                all_processes_busy = False
-
-            elif return_type == ResponseType.READ.value:
-                state.number_of_reading_jobs -= 1
-                at_least_one_job_ended = True
-
-            elif return_type == ResponseType.PROCESSED.value:
-                content = pickle.loads(result[-1])
-                state.processed_points += content['total']
-                state.points_in_progress -= content['total']
-
-                del state.processing_nodes[content['name']]
-
-                if content['name']:
-                    node_store.put(content['name'], content['save'])
-                    state.waiting_writing_nodes.append(content['name'])
-
-                    if state.is_reading_finish():
-                        # if all nodes aren't processed yet,
-                        # we should check if linked ancestors are processed
-                        if state.processing_nodes or state.node_to_process:
-                            finished_node = content['name']
-                            if can_pnts_be_written(
-                                finished_node, finished_node,
-                                state.node_to_process, state.processing_nodes
-                            ):
-                                state.waiting_writing_nodes.pop(-1)
-                                state.pnts_to_writing.append(finished_node)
-
-                                for i in range(len(state.waiting_writing_nodes) - 1, -1, -1):
-                                    candidate = state.waiting_writing_nodes[i]
-
-                                    if can_pnts_be_written(
-                                        candidate, finished_node,
-                                        state.node_to_process, state.processing_nodes
-                                    ):
-                                        state.waiting_writing_nodes.pop(i)
-                                        state.pnts_to_writing.append(candidate)
-
-                        else:
+    zmq_manager = ZmqManager(
+        jobs,
+        (graph, transformer, octree_metadata, os.path.abspath(outfolder), rgb, quantize, draco, point_dtype,
+         verbose, shared_memory, segment_prefix),
+        zmq_uri)
+
+    try:
+        governor = None
+        if max_memory:
+            governor = MemoryGovernor(max_memory, segment_prefix)
+            cache_size = min(cache_size, max_memory // 4)
+            if spill_threshold is None:
+                spill_threshold = max_memory // 4
+        # the normals and the extra attributes widen the points
+        bytes_per_point = point_size(point_dtype)
+
+        spill_folder = str(working_dir / 'spill')
+        if state.task_spill is None:
+            state.task_spill = TaskSpill(spill_folder)
+        # the output folder of a resumed conversion may have moved since the checkpoint
+        state.task_spill.folder = spill_folder
+        # a checkpoint may reference the spilled tasks until the next one is saved
+        state.task_spill.keep_consumed_segments = bool(checkpoint_interval)
+
+        last_checkpoint = time.time()
+        checkpoint_requested = False
+
+        while not zmq_manager.are_all_processes_killed():
+            now = time.time() - startup
+            at_least_one_job_ended = False
+
+            if checkpoint_interval and time.time() - last_checkpoint > checkpoint_interval:
+                # stop submitting new jobs until every worker is idle,
+                # so the state doesn't depend on work in progress
+                checkpoint_requested = True
+
+            all_processes_busy = not zmq_manager.can_queue_more_jobs()
+            while all_processes_busy or zmq_manager.socket.poll(timeout=0, flags=zmq.POLLIN):
+                # Blocking read but it's fine because either all our child processes are busy
+                # or we know that there's something to read (zmq.POLLIN)
+                start = time.time()
+                message = zmq_manager.socket.recv_multipart()
+
+                client_id = message[0]
+                result = message[1:]
+                return_type = result[0]
+
+                if return_type == ResponseType.IDLE.value:
+                    zmq_manager.add_idle_client(client_id)
+
+                    if all_processes_busy:
+                        zmq_manager.time_waiting_an_idle_process += time.time() - start
+                    all_processes_busy = False
+
+                elif return_type == ResponseType.REGISTER.value:
+                    zmq_manager.register_client(client_id)
+                    state.max_reading_jobs = max(1, zmq_manager.number_of_jobs // 2)
+
+                elif return_type == ResponseType.HALTED.value:
+                    zmq_manager.number_processes_killed += 1
+                    all_processes_busy = False
+
+                elif return_type == ResponseType.READ.value:
+                    state.number_of_reading_jobs -= 1
+                    point_count = struct.unpack('>I', result[1])[0]
+                    state.points_read += point_count
+                    state.points_in_progress += point_count - state.end_reading(client_id)
+                    at_least_one_job_ended = True
+
+                elif return_type == ResponseType.PROCESSED.value:
+                    content = pickle.loads(result[-1])
+                    state.processed_points += content['total']
+                    state.points_in_progress -= content['total']
+
+                    state.scheduler.record(state.end_processing(content['name'])[1], content['duration'])
+                    state.scheduler.release(content['name'])
+
+                    if content['name']:
+                        node_store.put(content['name'], content['save'])
+                        state.add_waiting_writing_node(content['name'])
+
+                        if state.is_reading_finish() and not (state.processing_nodes or state.node_to_process):
                             for c in state.waiting_writing_nodes:
                                 state.pnts_to_writing.append(c)
                             state.waiting_writing_nodes.clear()
-
-                at_least_one_job_ended = True
-
-            elif return_type == ResponseType.PNTS_WRITTEN.value:
-                state.points_in_pnts += struct.unpack('>I', result[1])[0]
-                state.number_of_writing_jobs -= 1
-
-            elif return_type == ResponseType.NEW_TASK.value:
-                count = struct.unpack('>I', result[3])[0]
-                state.add_tasks_to_process(result[1], result[2], count)
-
-            else:
-                raise NotImplementedError(f"The command {return_type} is not implemented")
-
-        while state.pnts_to_writing and zmq_manager.can_queue_more_jobs():
-            node_name = state.pnts_to_writing.pop()
-            data = node_store.get(node_name)
-            if not data:
-                raise ValueError(f'{node_name} has no data')
-
-            zmq_manager.send_to_process([CommandType.WRITE_PNTS.value, node_name, data])
-            node_store.remove(node_name)
-            state.number_of_writing_jobs += 1
-
-        if zmq_manager.can_queue_more_jobs():
-            potentials = sorted(
-                # a key (=task) can be in node_to_process and processing_nodes if the node isn't completely processed
-                [(k, v) for k, v in state.node_to_process.items() if k not in state.processing_nodes],
-                key=lambda f: -len(f[0]))
-
-            while zmq_manager.can_queue_more_jobs() and potentials:
-                target_count = 100_000
-                job_list = []
-                count = 0
-                idx = len(potentials) - 1
-                while count < target_count and idx >= 0:
-                    name, (tasks, point_count) = potentials[idx]
-                    count += point_count
-                    job_list += [
-                        name,
-                        node_store.get(name),
-                        struct.pack('>I', len(tasks)),
-                    ] + tasks
-                    del potentials[idx]
-
-                    del state.node_to_process[name]
-                    state.processing_nodes[name] = (len(tasks), point_count, now)
-
-                    if name in state.waiting_writing_nodes:
-                        state.waiting_writing_nodes.pop(state.waiting_writing_nodes.index(name))
-                    idx -= 1
-
-                if job_list:
+                        elif state.is_reading_finish() or state.pending_regions is not None:
+                            # if all nodes aren't processed yet,
+                            # we should check if linked ancestors are processed
+                            state.pnts_to_writing += state.pop_writable_nodes(content['name'])
+
+                    at_least_one_job_ended = True
+
+                elif return_type == ResponseType.PNTS_WRITTEN.value:
+                    state.points_in_pnts += struct.unpack('>I', result[1])[0]
+                    state.written_tiles.update(pickle.loads(result[3]))
+                    state.number_of_writing_jobs -= 1
+
+                elif return_type == ResponseType.NEW_TASK.value:
+                    count = struct.unpack('>I', result[3])[0]
+                    state.add_tasks_to_process(result[1], result[2], count)
+                    if not result[1]:
+                        state.add_root_region(client_id)
+
+                else:
+                    raise NotImplementedError(f"The command {return_type} is not implemented")
+
+            if checkpoint_requested and zmq_manager.are_all_processes_idle():
+                if verbose >= 1:
+                    print('Saving checkpoint')
+                save_checkpoint(working_dir, {
+                    'parameters': parameters,
+                    'infos': infos,
+                    'state': state,
+                    'node_store': node_store.checkpoint(),
+                })
+                node_store.commit_checkpoint()
+                state.task_spill.commit_checkpoint()
+                last_checkpoint = time.time()
+                checkpoint_requested = False
+
+            if state.regions_released:
+                # the nodes out of the regions not read or processed yet won't change anymore
+                state.pnts_to_writing += state.pop_writable_nodes(b'')
+                state.regions_released = False
+
+            while not checkpoint_requested and state.pnts_to_writing and zmq_manager.can_queue_more_jobs():
+                node_name = state.pnts_to_writing.pop()
+                data = node_store.get(node_name)
+                if not data:
+                    raise ValueError(f'{node_name} has no data')
+
+                zmq_manager.send_to_process([CommandType.WRITE_PNTS.value, node_name, data])
+                node_store.remove(node_name)
+                state.number_of_writing_jobs += 1
+
+            if not checkpoint_requested and zmq_manager.can_queue_more_jobs():
+                memory_is_tight = governor is not None and not governor.can_read()
+                while zmq_manager.can_queue_more_jobs() and state.scheduler:
+                    target_count = state.scheduler.batch_size(
+                        zmq_manager.number_of_jobs, state.is_reading_finish(), memory_is_tight)
+                    job_list = []
+                    count = 0
+                    while count < target_count:
+                        # a node can be in node_to_process and processing_nodes if the node isn't completely processed
+                        name = state.scheduler.pop(state.processing_nodes)
+                        if name is None:
+                            break
+                        tasks, point_count = state.pop_tasks_to_process(name)
+                        count += point_count
+                        job_list += [
+                            name,
+                            node_store.get(name),
+                            struct.pack('>I', len(tasks)),
+                        ] + tasks
+
+                        state.start_processing(name, len(tasks), point_count, now)
+
+                    if not job_list:
+                        break
                     zmq_manager.send_to_process([CommandType.PROCESS_JOBS.value] + job_list)
 
-        while state.can_add_reading_jobs() and zmq_manager.can_queue_more_jobs():
-            if verbose >= 1:
-                print(f'Submit next portion {state.point_cloud_file_parts[-1]}')
-            file, portion = state.point_cloud_file_parts.pop()
-            state.points_in_progress += portion[1] - portion[0]
-
-            zmq_manager.send_to_process([CommandType.READ_FILE.value, pickle.dumps({
-                'filename': file,
-                'offset_scale': (
-                    -avg_min,
-                    root_scale,
-                    rotation_matrix[:3, :3].T if rotation_matrix is not None else None,
-                    infos['color_scale'].get(file) if infos['color_scale'] is not None else None,
-                ),
-                'portion': portion,
-            })])
-
-            state.number_of_reading_jobs += 1
-
-        # if at this point we have no work in progress => we're done
-        if zmq_manager.are_all_processes_idle() and not zmq_manager.killing_processes:
-            zmq_manager.kill_all_processes()
-
-        if at_least_one_job_ended:
-            if verbose >= 3:
-                print('{:^16}|{:^8}|{:^8}'.format('Name', 'Points', 'Seconds'))
-                for name, v in state.processing_nodes.items():
-                    print('{:^16}|{:^8}|{:^8}'.format(
-                        '{} ({})'.format(name.decode('ascii'), v[0]),
-                        v[1],
-                        round(now - v[2], 1)))
-                print('')
-                print('Pending:')
-                print('  - root: {} / {}'.format(
-                    len(state.point_cloud_file_parts),
-                    initial_portion_count))
-                print('  - other: {} files for {} nodes'.format(
-                    sum([len(f[0]) for f in state.node_to_process.values()]),
-                    len(state.node_to_process)))
-                print('')
-            elif verbose >= 2:
-                state.print_debug()
-            if verbose >= 1:
-                print('{} % points in {} sec [{} tasks, {} nodes, {} wip]'.format(
-                    round(100 * state.processed_points / infos['point_count'], 2),
-                    round(now, 1),
-                    jobs - len(zmq_manager.idle_clients),
-                    len(state.processing_nodes),
-                    state.points_in_progress))
-            elif verbose >= 0:
-                percent = round(100 * state.processed_points / infos['point_count'], 2)
-                time_left = (100 - percent) * now / (percent + 0.001)
-                print('\r{:>6} % in {} sec [est. time left: {} sec]'.format(percent, round(now), round(time_left)), end='', flush=True)
-
-            if graph:
-                percent = round(100 * state.processed_points / infos['point_count'], 3)
-                print('{}, {}'.format(time.time() - startup, percent), file=progression_log)
-
-        node_store.control_memory_usage(cache_size, verbose)
-
-    if state.points_in_pnts != infos['point_count']:
-        raise ValueError("!!! Invalid point count in the written .pnts"
-                         + f"(expected: {infos['point_count']}, was: {state.points_in_pnts})")
-    if verbose >= 1:
-        print('Writing 3dtiles {}'.format(infos['avg_min']))
-
-    write_tileset(outfolder, octree_metadata, avg_min, root_scale, rotation_matrix, rgb)
-    shutil.rmtree(working_dir)
-
-    if verbose >= 1:
-        print('Done')
-
-    if benchmark:
-        print('{},{},{},{}'.format(
-            benchmark,
-            ','.join([os.path.basename(f) for f in files]),
-            state.points_in_pnts,
-            round(time.time() - startup, 1)))
-
-    zmq_manager.terminate_all_processes()
+            # read only if there's enough memory, unless nothing else could free memory
+            can_read = governor is None or governor.can_read() or zmq_manager.are_all_processes_idle()
+            while (not checkpoint_requested and can_read and state.can_add_reading_jobs()
+                   and zmq_manager.can_queue_more_jobs()):
+                if verbose >= 1:
+                    print(f'Submit next portion {state.point_cloud_file_parts[-1]}')
+                file, portion = state.point_cloud_file_parts.pop()
+                state.points_in_progress += portion[1] - portion[0]
+
+                client_id = zmq_manager.send_to_process([CommandType.READ_FILE.value, pickle.dumps({
+                    'filename': os.path.abspath(file),
+                    'offset_scale': (
+                        -avg_min,
+                        root_scale,
+                        rotation_matrix[:3, :3].T if rotation_matrix is not None else None,
+                        infos['color_scale'].get(file) if infos['color_scale'] is not None else None,
+                    ),
+                    'portion': portion,
+                })])
+                state.start_reading(client_id, file, portion)
+
+                state.number_of_reading_jobs += 1
+
+            # if at this point we have no work in progress => we're done
+            if zmq_manager.are_all_processes_idle() and not zmq_manager.killing_processes and not checkpoint_requested:
+                zmq_manager.kill_all_processes()
+
+            if at_least_one_job_ended:
+                if verbose >= 3:
+                    print('{:^16}|{:^8}|{:^8}'.format('Name', 'Points', 'Seconds'))
+                    for name, v in state.processing_nodes.items():
+                        print('{:^16}|{:^8}|{:^8}'.format(
+                            '{} ({})'.format(name.decode('ascii'), v[0]),
+                            v[1],
+                            round(now - v[2], 1)))
+                    print('')
+                    print('Pending:')
+                    print('  - root: {} / {}'.format(
+                        len(state.point_cloud_file_parts),
+                        initial_portion_count))
+                    print('  - other: {} files for {} nodes'.format(
+                        sum([len(f[0]) for f in state.node_to_process.values()]),
+                        len(state.node_to_process)))
+                    print('')
+                elif verbose >= 2:
+                    state.print_debug()
+                if verbose >= 1:
+                    print('{} % points in {} sec [{} tasks, {} nodes, {} wip]'.format(
+                        round(100 * state.processed_points / infos['point_count'], 2),
+                        round(now, 1),
+                        zmq_manager.number_of_jobs - len(zmq_manager.idle_clients),
+                        len(state.processing_nodes),
+                        state.points_in_progress))
+                elif verbose >= 0:
+                    percent = round(100 * state.processed_points / infos['point_count'], 2)
+                    time_left = (100 - percent) * now / (percent + 0.001)
+                    print('\r{:>6} % in {} sec [est. time left: {} sec]'.format(percent, round(now), round(time_left)), end='', flush=True)
+
+                if graph:
+                    percent = round(100 * state.processed_points / infos['point_count'], 3)
+                    print('{}, {}'.format(time.time() - startup, percent), file=progression_log)
+
+            node_store.control_memory_usage(cache_size, verbose)
+
+            if governor is not None and governor.excess() and node_store.data:
+                cache = node_store.memory_size['content'] + node_store.memory_size['container']
+                if verbose >= 2:
+                    print(f'Memory usage {governor.usage // (1024 * 1024)} MB over the budget, shrink the node cache')
+                node_store.remove_oldest_nodes(min(1, governor.excess() / cache))
+
+            if spill_threshold and state.points_in_memory * bytes_per_point > spill_threshold * 1024 * 1024:
+                if verbose >= 2:
+                    print(f'{state.points_in_memory} points waiting in memory, spill tasks to disk')
+                # spill more than needed, to not spill again at the next iteration
+                state.spill_tasks(spill_threshold * 1024 * 1024 / 2 / bytes_per_point)
+
+        if state.points_in_pnts != state.points_read:
+            raise ValueError("!!! Invalid point count in the written .pnts"
+                             + f"(expected: {state.points_read}, was: {state.points_in_pnts})")
+        if verbose >= 1:
+            print('Writing 3dtiles {}'.format(infos['avg_min']))
+
+        write_tileset(outfolder, octree_metadata, avg_min, root_scale, rotation_matrix, rgb, state.written_tiles,
+                      TilesetSplitPolicy(tileset_max_size, tileset_max_depth, tileset_max_tiles), quantize, draco,
+                      point_dtype)
+        node_store.close()
+        shutil.rmtree(working_dir)
+
+        if verbose >= 1:
+            print('Done')
+
+        if benchmark:
+            print('{},{},{},{}'.format(
+                benchmark,
+                ','.join([os.path.basename(f) for f in files]),
+                state.points_in_pnts,
+                round(time.time() - startup, 1)))
+    finally:
+        # the workers and the ipc endpoint must not outlive the conversion, even if it fails
+        zmq_manager.terminate_all_processes()
+        zmq_manager.close()
 
     if verbose >= 1:
         print('destroy', round(zmq_manager.time_waiting_an_idle_process, 2))
@@ -770,8 +1241,6 @@ def convert(files,
 
         dateline.render_to_file('activity.svg')
 
-    zmq_manager.context.destroy()
-
 
 def init_parser(subparser, str2bool):
 
@@ -803,6 +1272,16 @@ def init_parser(subparser, str2bool):
         help='Cache size in MB. Default to available memory / 10.',
         default=int(TOTAL_MEMORY_MB / 10),
         type=int)
+    parser.add_argument(
+        '--max_memory',
+        help='Memory budget in MB of the conversion (the main process and its local workers). '
+             'Above it, no new portion is read and the node cache is emptied',
+        type=int)
+    parser.add_argument(
+        '--spill_threshold',
+        help='Size in MB of the points waiting to be processed above which they are written on disk. '
+             'Default to a quarter of --max_memory if set, no limit otherwise',
+        type=float)
     parser.add_argument(
         '--srs_out', help='SRS to convert the output with (numeric part of the EPSG code)', type=str)
     parser.add_argument(
@@ -817,12 +1296,69 @@ def init_parser(subparser, str2bool):
     parser.add_argument(
         '--rgb',
         help='Export rgb attributes', type=str2bool, default=True)
+    parser.add_argument(
+        '--quantize',
+        help='Write the positions quantized on 16 bits in the bounding box of each tile', type=str2bool, default=False)
+    parser.add_argument(
+        '--draco',
+        help='Compress the positions, colors, normals and extra attributes with the 3DTILES_draco_point_compression '
+             'extension (requires DracoPy)', type=str2bool, default=False)
+    parser.add_argument(
+        '--normals',
+        help='Export the normals of the points, read from the extra bytes of the las files',
+        type=str2bool, default=False)
+    parser.add_argument(
+        '--extra_attributes',
+        help='The attributes of the points exported in the batch table of the tiles',
+        nargs='+', choices=list(EXTRA_ATTRIBUTES))
     parser.add_argument(
         '--graph',
         help='Produce debug graphes (requires pygal)', type=str2bool, default=False)
     parser.add_argument(
         '--color_scale',
         help='Force color scale', type=float)
+    parser.add_argument(
+        '--delimiter',
+        help="The delimiter of the values in text files. Default to ',' or ';' if the first line contains one, "
+             'whitespaces otherwise')
+    parser.add_argument(
+        '--columns',
+        help='The layout of the lines of text files, one letter per value: x, y, z, i (intensity), r, g, b, '
+             'or _ to ignore a value (e.g. xyz_rgb). Default to xyz, xyzi, xyzrgb or xyzirgb depending on the '
+             'number of values')
+    parser.add_argument(
+        '--aabb',
+        help='The bounding box of all the text files, in their srs. The files are then not scanned before '
+             'the conversion starts, and the point count is only known at the end',
+        nargs=6, type=float, metavar=('XMIN', 'YMIN', 'ZMIN', 'XMAX', 'YMAX', 'ZMAX'))
+    parser.add_argument(
+        '--tileset_max_size',
+        help='The maximum size in bytes of the json of a subtree of the tileset, '
+             'above it the subtree is written in an external tileset',
+        default=100000, type=int)
+    parser.add_argument(
+        '--tileset_max_depth',
+        help='Write the subtrees deeper than this number of levels in external tilesets', type=int)
+    parser.add_argument(
+        '--tileset_max_tiles',
+        help='Write the subtrees with more tiles than this number in external tilesets', type=int)
+    parser.add_argument(
+        '--zmq_uri',
+        help='The zmq endpoint the workers connect to. Use a tcp endpoint (e.g. tcp://*:5555) to let '
+             'workers from other hosts join the conversion with "py3dtiles worker". '
+             'Default to a new ipc endpoint for each conversion')
+    parser.add_argument(
+        '--shared_memory',
+        help='Transfer the points between processes with shared memory segments', type=str2bool, default=True)
+    parser.add_argument(
+        '--checkpoint_interval',
+        help='Save the conversion state every N seconds, so an interrupted conversion can be resumed with --resume',
+        type=float)
+    parser.add_argument(
+        '--resume',
+        help='Resume an interrupted conversion from the last checkpoint saved in the output folder. '
+             'The other options must be the same as the ones of the interrupted conversion.',
+        type=str2bool, default=False)
 
 
 def main(args):
@@ -832,13 +1368,29 @@ def main(args):
                        overwrite=args.overwrite,
                        jobs=args.jobs,
                        cache_size=args.cache_size,
+                       max_memory=args.max_memory,
+                       spill_threshold=args.spill_threshold,
                        srs_out=args.srs_out,
                        srs_in=args.srs_in,
                        fraction=args.fraction,
                        benchmark=args.benchmark,
                        rgb=args.rgb,
+                       quantize=args.quantize,
+                       draco=args.draco,
+                       normals=args.normals,
+                       extra_attributes=args.extra_attributes,
                        graph=args.graph,
                        color_scale=args.color_scale,
+                       delimiter=args.delimiter,
+                       columns=args.columns,
+                       aabb=args.aabb,
+                       tileset_max_size=args.tileset_max_size,
+                       tileset_max_depth=args.tileset_max_depth,
+                       tileset_max_tiles=args.tileset_max_tiles,
+                       zmq_uri=args.zmq_uri,
+                       shared_memory=args.shared_memory,
+                       checkpoint_interval=args.checkpoint_interval,
+                       resume=args.resume,
                        verbose=args.verbose)
     except SrsInMissingException:
         print('No SRS information in input files, you should specify it with --srs_in')
@@ -4,6 +4,14 @@ import json
 from enum import Enum
 import numpy as np
 
+# the quantized positions are stored on 16 bits in the quantized volume
+QUANTIZED_MAX = 65535
+DRACO_EXTENSION = '3DTILES_draco_point_compression'
+# the draco quantization of the positions, as precise as POSITION_QUANTIZED
+DRACO_QUANTIZATION_BITS = 16
+# the types of the values draco compresses without loss
+DRACO_COMPONENT_TYPES = (np.dtype(np.uint8), np.dtype(np.uint16), np.dtype(np.uint32), np.dtype(np.float32))
+
 
 class Feature(object):
 
@@ -80,6 +88,30 @@ class Feature(object):
         return f
 
 
+def oct_encode(normals):
+    """
+    Oct-encode unit vectors on 2 bytes (NORMAL_OCT16P)
+    """
+    normals = np.asarray(normals, dtype=np.float64).reshape((-1, 3))
+    p = normals[:, :2] / np.maximum(np.abs(normals).sum(axis=1), 1e-12)[:, np.newaxis]
+    # the lower hemisphere is folded on the corners of the square
+    lower = normals[:, 2] < 0
+    p[lower] = (1 - np.abs(p[lower][:, ::-1])) * np.where(p[lower] >= 0, 1, -1)
+    return np.round((np.clip(p, -1, 1) * 0.5 + 0.5) * 255).astype(np.uint8)
+
+
+def oct_decode(encoded):
+    """
+    Decode unit vectors encoded by oct_encode
+    """
+    p = np.asarray(encoded, dtype=np.float64).reshape((-1, 2)) / 255 * 2 - 1
+    z = 1 - np.abs(p).sum(axis=1)
+    lower = z < 0
+    p[lower] = (1 - np.abs(p[lower][:, ::-1])) * np.where(p[lower] >= 0, 1, -1)
+    normals = np.column_stack((p, z))
+    return (normals / np.linalg.norm(normals, axis=1)[:, np.newaxis]).astype(np.float32)
+
+
 class SemanticPoint(Enum):
 
     NONE = 0
@@ -112,6 +144,12 @@ class FeatureTableHeader(object):
         # global semantics
         self.points_length = 0
         self.rtc = None
+        self.quantized_volume_offset = None
+        self.quantized_volume_scale = None
+
+        # the 3DTILES_draco_point_compression extension: the draco attribute id of the compressed
+        # semantics ('properties'), and the place of the draco buffer ('byteOffset' and 'byteLength')
+        self.draco = None
 
     def to_array(self):
         jsond = self.to_json()
@@ -136,16 +174,28 @@ class FeatureTableHeader(object):
             jsond['POSITION'] = offset
         elif self.positions == SemanticPoint.POSITION_QUANTIZED:
             jsond['POSITION_QUANTIZED'] = offset
+            jsond['QUANTIZED_VOLUME_OFFSET'] = self.quantized_volume_offset
+            jsond['QUANTIZED_VOLUME_SCALE'] = self.quantized_volume_scale
 
         # colors
         offset = {'byteOffset': self.colors_offset}
         if self.colors == SemanticPoint.RGB:
             jsond['RGB'] = offset
 
+        # normals
+        offset = {'byteOffset': self.normal_offset}
+        if self.normal == SemanticPoint.NORMAL:
+            jsond['NORMAL'] = offset
+        elif self.normal == SemanticPoint.NORMAL_OCT16P:
+            jsond['NORMAL_OCT16P'] = offset
+
+        if self.draco is not None:
+            jsond['extensions'] = {DRACO_EXTENSION: self.draco}
+
         return jsond
 
     @staticmethod
-    def from_dtype(positions_dtype, colors_dtype, npoints):
+    def from_dtype(positions_dtype, colors_dtype, npoints, normal_dtype=None):
         """
         Parameters
         ----------
@@ -155,6 +205,9 @@ class FeatureTableHeader(object):
         colors_dtype : numpy.dtype
             Numpy description of a colors.
 
+        normal_dtype : numpy.dtype
+            Numpy description of a normal: 3 float32 (NORMAL) or 2 uint8 (NORMAL_OCT16P).
+
         Returns
         -------
         fth : FeatureTableHeader
@@ -203,6 +256,22 @@ class FeatureTableHeader(object):
             fth.colors = SemanticPoint.NONE
             fth.colors_dtype = None
 
+        # search normals
+        if normal_dtype is not None:
+            if len(normal_dtype.names) == 3 and normal_dtype[0] == np.float32:
+                fth.normal = SemanticPoint.NORMAL
+                fth.normal_dtype = np.dtype([('X', np.float32),
+                                             ('Y', np.float32),
+                                             ('Z', np.float32)])
+            elif len(normal_dtype.names) == 2 and normal_dtype[0] == np.uint8:
+                fth.normal = SemanticPoint.NORMAL_OCT16P
+                fth.normal_dtype = np.dtype([('X', np.uint8),
+                                             ('Y', np.uint8)])
+
+            fth.normal_offset = fth.positions_offset + npoints * fth.positions_dtype.itemsize
+            if fth.colors_dtype is not None:
+                fth.normal_offset += npoints * fth.colors_dtype.itemsize
+
         return fth
 
     @staticmethod
@@ -235,6 +304,8 @@ class FeatureTableHeader(object):
             fth.positions_dtype = np.dtype([('X', np.uint16),
                                             ('Y', np.uint16),
                                             ('Z', np.uint16)])
+            fth.quantized_volume_offset = jsond['QUANTIZED_VOLUME_OFFSET']
+            fth.quantized_volume_scale = jsond['QUANTIZED_VOLUME_SCALE']
         else:
             fth.positions = SemanticPoint.NONE
             fth.positions_offset = 0
@@ -252,6 +323,19 @@ class FeatureTableHeader(object):
             fth.colors_offset = 0
             fth.colors_dtype = None
 
+        # search normals
+        if "NORMAL" in jsond:
+            fth.normal = SemanticPoint.NORMAL
+            fth.normal_offset = jsond['NORMAL']['byteOffset']
+            fth.normal_dtype = np.dtype([('X', np.float32),
+                                         ('Y', np.float32),
+                                         ('Z', np.float32)])
+        elif "NORMAL_OCT16P" in jsond:
+            fth.normal = SemanticPoint.NORMAL_OCT16P
+            fth.normal_offset = jsond['NORMAL_OCT16P']['byteOffset']
+            fth.normal_dtype = np.dtype([('X', np.uint8),
+                                         ('Y', np.uint8)])
+
         # points length
         if "POINTS_LENGTH" in jsond:
             fth.points_length = jsond["POINTS_LENGTH"]
@@ -262,6 +346,9 @@ class FeatureTableHeader(object):
         else:
             fth.rtc = None
 
+        # compressed semantics
+        fth.draco = jsond.get('extensions', {}).get(DRACO_EXTENSION)
+
         return fth
 
 
@@ -274,30 +361,37 @@ class FeatureTableBody(object):
         self.colors_arr = []
         self.colors_itemsize = 0
 
+        self.normal_arr = []
+        self.normal_itemsize = 0
+
+        # the draco buffer of the compressed semantics, and its decoded attributes (draco id -> values)
+        self.draco_arr = []
+        self.draco_attributes = {}
+
     def to_array(self):
-        arr = self.positions_arr
-        if len(self.colors_arr):
-            arr = np.concatenate((self.positions_arr, self.colors_arr))
-        return arr
+        if len(self.draco_arr):
+            return self.draco_arr
+        arrays = [arr for arr in [self.positions_arr, self.colors_arr, self.normal_arr] if len(arr)]
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.concatenate(arrays)
 
     @staticmethod
     def from_features(fth, features):
 
         b = FeatureTableBody()
 
-        # extract positions
+        # the values of all the features are converted at once
         b.positions_itemsize = fth.positions_dtype.itemsize
-        b.positions_arr = np.array([], dtype=np.uint8)
+        b.positions_arr = np.array(
+            [(f.positions['X'], f.positions['Y'], f.positions['Z']) for f in features],
+            dtype=fth.positions_dtype).view(np.uint8)
 
         if fth.colors_dtype is not None:
             b.colors_itemsize = fth.colors_dtype.itemsize
-            b.colors_arr = np.array([], dtype=np.uint8)
-
-        for f in features:
-            fpos, fcol = f.to_array()
-            b.positions_arr = np.concatenate((b.positions_arr, fpos))
-            if fth.colors_dtype is not None:
-                b.colors_arr = np.concatenate((b.colors_arr, fcol))
+            b.colors_arr = np.array(
+                [tuple(f.colors[name] for name in fth.colors_dtype.names) for f in features],
+                dtype=fth.colors_dtype).view(np.uint8)
 
         return b
 
@@ -319,19 +413,44 @@ class FeatureTableBody(object):
 
         npoints = fth.points_length
 
+        # decompress the compressed semantics
+        decoded = {}
+        if fth.draco is not None:
+            draco_offset = fth.draco['byteOffset']
+            b.draco_arr = array[draco_offset:draco_offset + fth.draco['byteLength']]
+            b.draco_attributes = _draco_decode(b.draco_arr)
+            decoded = {semantic: b.draco_attributes[attribute_id]
+                       for semantic, attribute_id in fth.draco['properties'].items()}
+
         # extract positions
         pos_size = fth.positions_dtype.itemsize
         pos_offset = fth.positions_offset
-        b.positions_arr = array[pos_offset:pos_offset + npoints * pos_size]
+        if fth.positions.name in decoded:
+            b.positions_arr = decoded[fth.positions.name].astype(fth.positions_dtype['X']).view(np.uint8).ravel()
+        else:
+            b.positions_arr = array[pos_offset:pos_offset + npoints * pos_size]
         b.positions_itemsize = pos_size
 
         # extract colors
         if fth.colors != SemanticPoint.NONE:
             col_size = fth.colors_dtype.itemsize
             col_offset = fth.colors_offset
-            b.colors_arr = array[col_offset:col_offset + col_size * npoints]
+            if fth.colors.name in decoded:
+                b.colors_arr = decoded[fth.colors.name].astype(np.uint8).ravel()
+            else:
+                b.colors_arr = array[col_offset:col_offset + col_size * npoints]
             b.colors_itemsize = col_size
 
+        # extract normals
+        if fth.normal != SemanticPoint.NONE:
+            nor_size = fth.normal_dtype.itemsize
+            nor_offset = fth.normal_offset
+            if fth.normal.name in decoded:
+                b.normal_arr = decoded[fth.normal.name].astype(fth.normal_dtype['X']).view(np.uint8).ravel()
+            else:
+                b.normal_arr = array[nor_offset:nor_offset + nor_size * npoints]
+            b.normal_itemsize = nor_size
+
         return b
 
     def positions(self, n):
@@ -345,6 +464,27 @@ class FeatureTableBody(object):
         return []
 
 
+def _draco_decode(data):
+    """
+    Returns the attributes compressed in data, by draco attribute id
+    """
+    import DracoPy
+
+    point_cloud = DracoPy.decode(data.tobytes())
+    return {attribute['unique_id']: np.asarray(attribute['data']) for attribute in point_cloud.attributes}
+
+
+def _to_columns(array, dtype):
+    """
+    Returns a (n, len(dtype.names)) contiguous array of the type of the fields of dtype,
+    from a structured array with these fields or from a (n, len(dtype.names)) array
+    """
+    array = np.asarray(array)
+    if array.dtype.names is not None:
+        array = np.stack([array[name] for name in dtype.names], axis=-1)
+    return np.ascontiguousarray(array, dtype=dtype[0]).reshape((-1, len(dtype.names)))
+
+
 class FeatureTable(object):
 
     def __init__(self):
@@ -415,6 +555,138 @@ class FeatureTable(object):
 
         return ft
 
+    @staticmethod
+    def from_numpy(positions, colors=None, normals=None, rtc=None):
+        """
+        Parameters
+        ----------
+        positions : numpy.array
+            (n, 3) array, or structured array with the X, Y and Z fields. The positions are stored as float32.
+
+        colors : numpy.array
+            (n, 3) array, or structured array with the Red, Green and Blue fields. The colors are stored as uint8.
+
+        normals : numpy.array
+            (n, 3) array of float32 (NORMAL), (n, 2) array of oct-encoded uint8 (NORMAL_OCT16P), or
+            structured array with the X, Y (and Z) fields.
+
+        rtc : list
+            The RTC_CENTER of the positions.
+
+        Returns
+        -------
+        ft : FeatureTable
+        """
+
+        pdt = np.dtype([('X', np.float32), ('Y', np.float32), ('Z', np.float32)])
+        positions = _to_columns(positions, pdt)
+        arrays = [positions]
+
+        cdt = None
+        if colors is not None:
+            cdt = np.dtype([('Red', np.uint8), ('Green', np.uint8), ('Blue', np.uint8)])
+            arrays.append(_to_columns(colors, cdt))
+
+        ndt = None
+        if normals is not None:
+            normals = np.asarray(normals)
+            if (len(normals.dtype.names) if normals.dtype.names else normals.shape[-1]) == 2:
+                ndt = np.dtype([('X', np.uint8), ('Y', np.uint8)])
+            else:
+                ndt = pdt
+            arrays.append(_to_columns(normals, ndt))
+
+        if any(len(array) != len(positions) for array in arrays):
+            raise ValueError('The positions, colors and normals must have the same length')
+
+        fth = FeatureTableHeader.from_dtype(pdt, cdt, len(positions), ndt)
+        fth.rtc = None if rtc is None else [float(c) for c in rtc]
+        # the arrays are only copied once, the body arrays are views on the concatenation
+        ftb = FeatureTableBody.from_array(fth, np.concatenate([array.view(np.uint8).ravel() for array in arrays]))
+
+        ft = FeatureTable()
+        ft.header = fth
+        ft.body = ftb
+
+        return ft
+
+    def get_positions(self):
+        """
+        Returns the positions of the points in a (n, 3) array of float32, the quantized positions are decoded
+        """
+        n = self.header.points_length
+        if self.header.positions == SemanticPoint.POSITION_QUANTIZED:
+            quantized = self.body.positions_arr.view(np.uint16).reshape((n, 3))
+            scale = np.array(self.header.quantized_volume_scale) / QUANTIZED_MAX
+            return (quantized * scale + self.header.quantized_volume_offset).astype(np.float32)
+        return self.body.positions_arr.view(np.float32).reshape((n, 3))
+
+    def get_normals(self):
+        """
+        Returns the normals of the points in a (n, 3) array of float32, or None if the points have no normals.
+        The oct-encoded normals are decoded.
+        """
+        n = self.header.points_length
+        if self.header.normal == SemanticPoint.NORMAL_OCT16P:
+            return oct_decode(self.body.normal_arr.reshape((n, 2)))
+        if self.header.normal == SemanticPoint.NORMAL:
+            return self.body.normal_arr.view(np.float32).reshape((n, 3))
+        return None
+
+    def compress(self, quantization_bits=DRACO_QUANTIZATION_BITS, batch_table=None):
+        """
+        Compress the positions, the colors, the normals and the binary properties of batch_table with the
+        3DTILES_draco_point_compression extension, draco changes the order of the points.
+        The quantized positions are decoded, draco quantizes them again, and the oct-encoded normals are
+        decoded (NORMAL_OCT16P isn't allowed with draco). Requires DracoPy.
+        """
+        import DracoPy
+
+        n = self.header.points_length
+        positions = self.get_positions()
+        self.header.positions = SemanticPoint.POSITION
+        self.header.positions_dtype = np.dtype([('X', np.float32), ('Y', np.float32), ('Z', np.float32)])
+        self.header.quantized_volume_offset = self.header.quantized_volume_scale = None
+        self.body.positions_arr = positions.view(np.uint8).ravel()
+        self.body.positions_itemsize = self.header.positions_dtype.itemsize
+
+        # the other attributes are stored as generic draco attributes, whose ids come first
+        generic_attributes = {}
+        properties = {}
+        if self.header.normal != SemanticPoint.NONE:
+            normals = self.get_normals()
+            self.header.normal = SemanticPoint.NORMAL
+            self.header.normal_dtype = np.dtype([('X', np.float32), ('Y', np.float32), ('Z', np.float32)])
+            self.body.normal_arr = normals.view(np.uint8).ravel()
+            self.body.normal_itemsize = self.header.normal_dtype.itemsize
+            properties['NORMAL'] = len(generic_attributes)
+            generic_attributes[properties['NORMAL']] = normals
+
+        batch_properties = {}
+        if batch_table is not None:
+            for name in batch_table.get_binary_property_names():
+                values = batch_table.get_binary_property(name, n)
+                if values.dtype not in DRACO_COMPONENT_TYPES:
+                    raise ValueError('The {} values of {} can\'t be compressed with draco'.format(values.dtype, name))
+                batch_properties[name] = len(generic_attributes)
+                generic_attributes[batch_properties[name]] = values.reshape((n, 1))
+
+        # DracoPy numbers the positions and the colors after the generic attributes
+        properties['POSITION'] = len(generic_attributes)
+        colors = None
+        if self.header.colors == SemanticPoint.RGB:
+            properties['RGB'] = properties['POSITION'] + 1
+            colors = self.body.colors_arr.reshape((n, 3))
+
+        data = DracoPy.encode(positions, quantization_bits=quantization_bits, colors=colors,
+                              generic_attributes=generic_attributes or None)
+        self.body.draco_arr = np.frombuffer(data, dtype=np.uint8)
+        # the byte offsets of the compressed semantics are ignored
+        self.header.positions_offset = self.header.colors_offset = self.header.normal_offset = 0
+        self.header.draco = {'properties': properties, 'byteOffset': 0, 'byteLength': len(data)}
+        if batch_properties:
+            batch_table.compress(batch_properties, generic_attributes)
+
     def feature(self, n):
         pos = self.body.positions(n)
         col = self.body.colors(n)
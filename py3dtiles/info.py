@@ -1,6 +1,11 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
 from py3dtiles import TileContentReader
+from py3dtiles.tileset_index import load_tileset_index
 
 
 def print_pnts_info(tile):
@@ -52,8 +57,25 @@ def print_b3dm_info(tile):
     print(gltfh)
 
 
+def print_tileset_info(folder, bounds):
+    index = load_tileset_index(folder, bounds)
+    print("Tileset")
+    print("-------")
+    print("Tiles: ", len(index))
+    print("Points: ", sum(tile.point_count for tile in index.values()))
+    print("Byte length: ", sum(tile.byte_length for tile in index.values()))
+    aabbs = [tile.aabb for tile in index.values() if tile.aabb is not None]
+    if aabbs:
+        print("Bounds: ", np.amin([aabb[0] for aabb in aabbs], axis=0).tolist(),
+              np.amax([aabb[1] for aabb in aabbs], axis=0).tolist())
+
+
 def main(args):
-    tile = TileContentReader.read_file(args.filename)
+    if os.path.isdir(args.filename):
+        print_tileset_info(args.filename, args.bounds)
+        return
+
+    tile = TileContentReader.read_file(args.filename, mmap=True)
     magic = tile.header.magic_value
 
     if magic == "pnts":
@@ -66,6 +88,11 @@ def main(args):
 
 def init_parser(subparser, str2bool):
     # arg parse
-    parser = subparser.add_parser('info', help='Extract informations from a 3DTiles file')
+    parser = subparser.add_parser('info', help='Extract informations from a 3DTiles file or a tileset folder')
 
-    parser.add_argument('filename', type=str)
+    parser.add_argument('filename', type=str, help='A .pnts or .b3dm file, or a tileset folder')
+    parser.add_argument(
+        '--bounds',
+        help='Compute the bounds of the points of the tiles of a tileset folder',
+        default=False,
+        type=str2bool)
@@ -7,16 +7,18 @@ from py3dtiles.points.utils import split_aabb
 from py3dtiles.points.transformations import inverse_matrix
 from py3dtiles.points.task.pnts_writer import points_to_pnts
 from py3dtiles.feature_table import SemanticPoint
+from py3dtiles.tileset_index import read_tile_metadata
 
 
-def _get_root_tile(tileset, filename):
-    folder = os.path.dirname(filename)
-
-    pnts_filename = os.path.join(
-        folder,
+def _get_root_tile_filename(tileset, filename):
+    return os.path.join(
+        os.path.dirname(filename),
         tileset['root']['content']['uri'])
 
-    return TileContentReader.read_file(pnts_filename)
+
+def _get_root_tile(tileset, filename):
+    # the points of the tile are only read if they're used
+    return TileContentReader.read_file(_get_root_tile_filename(tileset, filename), mmap=True)
 
 
 def _get_root_transform(tileset):
@@ -35,8 +37,7 @@ def _get_root_transform(tileset):
 def _get_tile_points(tile, tile_transform, out_transform):
     fth = tile.body.feature_table.header
 
-    xyz = tile.body.feature_table.body.positions_arr.view(
-        np.float32).reshape((fth.points_length, 3))
+    xyz = tile.body.feature_table.get_positions()
     if fth.colors == SemanticPoint.RGB:
         # rgb = np.array([255, 0, 0] * fth.points_length).reshape((fth.points_length, 3))
         rgb = tile.body.feature_table.body.colors_arr.reshape(
@@ -67,8 +68,8 @@ def init(files):
         with open(filename, 'r') as f:
             tileset = json.load(f)
 
-            tile = _get_root_tile(tileset, filename)
-            fth = tile.body.feature_table.header
+            # only the headers of the tile are read
+            point_count = read_tile_metadata(_get_root_tile_filename(tileset, filename)).point_count
 
             # apply transformation
             transform = _get_root_transform(tileset)
@@ -82,9 +83,10 @@ def init(files):
                 aabb[0] = np.minimum(aabb[0], bbox[0])
                 aabb[1] = np.maximum(aabb[1], bbox[1])
 
-            total_point_count += fth.points_length
+            total_point_count += point_count
 
             tileset['id'] = idx
+            tileset['point_count'] = point_count
             tileset['filename'] = filename
             tileset['center'] = ((bbox[0] + bbox[1]) * 0.5)
             tilesets += [tileset]
@@ -199,10 +201,7 @@ def build_tileset_quadtree(out_folder, aabb, tilesets, base_transform, inv_base_
         rgb = np.zeros((0, 3), dtype=np.uint8)
 
         max_point_count = 50000
-        point_count = 0
-        for tileset in insides:
-            root_tile = _get_root_tile(tileset, tileset['filename'])
-            point_count += root_tile.body.feature_table.header.points_length
+        point_count = sum(tileset['point_count'] for tileset in insides)
 
         ratio = min(0.5, max_point_count / point_count)
 
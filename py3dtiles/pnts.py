@@ -4,6 +4,14 @@ import numpy as np
 
 from .tile_content import TileContent, TileContentHeader, TileContentBody, TileContentType
 from .feature_table import FeatureTable
+from .batch_table import BatchTable
+
+
+def _pad(array, offset, value):
+    """
+    Pad array with value, so it ends on a 8 bytes boundary. offset is its position in the tile.
+    """
+    return np.concatenate((array, np.full(-(offset + len(array)) % 8, value, dtype=np.uint8)))
 
 
 class Pnts(TileContent):
@@ -36,6 +44,27 @@ class Pnts(TileContent):
 
         return t
 
+    @staticmethod
+    def from_numpy(positions, colors=None, normals=None, rtc=None):
+        """
+        Build a tile from numpy arrays of the positions, colors and normals of the points,
+        see FeatureTable.from_numpy
+
+        Returns
+        -------
+        tile : TileContent
+        """
+
+        tb = PntsBody()
+        tb.feature_table = FeatureTable.from_numpy(positions, colors, normals, rtc)
+
+        t = TileContent()
+        t.body = tb
+        t.header = PntsHeader()
+        t.header.sync(tb)
+
+        return t
+
     @staticmethod
     def from_array(array):
         """
@@ -56,7 +85,8 @@ class Pnts(TileContent):
             raise RuntimeError("Invalid byte length in header")
 
         # build tile body
-        b_len = h.ft_json_byte_length + h.ft_bin_byte_length
+        b_len = (h.ft_json_byte_length + h.ft_bin_byte_length
+                 + h.bt_json_byte_length + h.bt_bin_byte_length)
         b_arr = array[PntsHeader.BYTELENGTH:PntsHeader.BYTELENGTH + b_len]
         b = PntsBody.from_array(h, b_arr)
 
@@ -99,14 +129,15 @@ class PntsHeader(TileContentHeader):
         """
 
         # extract array
-        fth_arr = body.feature_table.header.to_array()
-        ftb_arr = body.feature_table.body.to_array()
+        fth_arr, ftb_arr, bth_arr, btb_arr = body.to_arrays()
 
-        # sync the tile header with feature table contents
-        self.tile_byte_length = (len(fth_arr) + len(ftb_arr)
+        # sync the tile header with feature table and batch table contents
+        self.tile_byte_length = (len(fth_arr) + len(ftb_arr) + len(bth_arr) + len(btb_arr)
                                  + PntsHeader.BYTELENGTH)
         self.ft_json_byte_length = len(fth_arr)
         self.ft_bin_byte_length = len(ftb_arr)
+        self.bt_json_byte_length = len(bth_arr)
+        self.bt_bin_byte_length = len(btb_arr)
 
     @staticmethod
     def from_array(array):
@@ -141,10 +172,27 @@ class PntsHeader(TileContentHeader):
 class PntsBody(TileContentBody):
     def __init__(self):
         self.feature_table = FeatureTable()
-        # TODO : self.batch_table = BatchTable()
+        self.batch_table = None
+
+    def to_arrays(self):
+        """
+        Returns the json and binary arrays of the feature table and of the batch table.
+        With a batch table, they're padded so the binary bodies start on a 8 bytes boundary in the tile.
+        """
+        fth_arr = self.feature_table.header.to_array()
+        ftb_arr = self.feature_table.body.to_array()
+        if self.batch_table is None:
+            empty = np.array([], dtype=np.uint8)
+            return fth_arr, ftb_arr, empty, empty
+
+        offset = PntsHeader.BYTELENGTH + len(fth_arr)
+        ftb_arr = _pad(ftb_arr, offset, 0)
+        offset += len(ftb_arr)
+        bth_arr = _pad(self.batch_table.to_array(), offset, ord(' '))
+        return fth_arr, ftb_arr, bth_arr, self.batch_table.body_to_array()
 
     def to_array(self):
-        return self.feature_table.to_array()
+        return np.concatenate(self.to_arrays())
 
     @staticmethod
     def from_array(th, array):
@@ -166,13 +214,16 @@ class PntsBody(TileContentBody):
         ft = FeatureTable.from_array(th, ft_arr)
 
         # build batch table
-        # bt_len = th.bt_json_byte_length + th.bt_bin_byte_length
-        # bt_arr = array[ft_len:ft_len+ba_len]
-        # bt = BatchTable.from_array(th, bt_arr)
-
-        # build tile body with feature table
+        bt = None
+        if th.bt_json_byte_length:
+            bt_len = th.bt_json_byte_length + th.bt_bin_byte_length
+            bt_arr = array[ft_len:ft_len + bt_len]
+            bt = BatchTable.from_array(th, bt_arr)
+            bt.decompress(ft.body.draco_attributes)
+
+        # build tile body with feature table and batch table
         b = PntsBody()
         b.feature_table = ft
-        # b.batch_table = bt
+        b.batch_table = bt
 
         return b
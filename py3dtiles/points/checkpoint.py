@@ -0,0 +1,28 @@
+import os
+import pickle
+from pathlib import Path
+
+CHECKPOINT_FILENAME = 'checkpoint.pickle'
+
+
+def save_checkpoint(working_dir, checkpoint):
+    """
+    Atomically write checkpoint (a picklable dict) in working_dir.
+
+    The previous checkpoint stays valid until the new one is completely written.
+    """
+    path = Path(working_dir) / CHECKPOINT_FILENAME
+    tmp_path = path.with_suffix('.tmp')
+    with tmp_path.open('wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(working_dir):
+    path = Path(working_dir) / CHECKPOINT_FILENAME
+    if not path.exists():
+        raise FileNotFoundError(f'No checkpoint to resume from in {working_dir}')
+    with path.open('rb') as f:
+        return pickle.load(f)
@@ -30,3 +30,135 @@ def xyz_to_key(xyz, cell_count, aabb_min, inv_aabb_size, shift):
     a[:, 1] <<= shift
     a[:, 2] <<= (2 * shift)
     return np.sum(a, axis=1).astype(np.int32)
+
+
+# the coordinates of a voxel are packed in an int64 key, with VOXEL_BITS bits per axis
+VOXEL_BITS = 21
+VOXEL_MAX = (1 << VOXEL_BITS) - 1
+EMPTY_SLOT = -1
+
+
+@njit(cache=True, nogil=True)
+def _voxel_coordinate(value):
+    # voxels are relative to the aabb min, but points may be slightly out of their aabb
+    return min(max(np.int64(np.floor(value)) + (1 << (VOXEL_BITS - 1)), 0), VOXEL_MAX)
+
+
+@njit(cache=True, nogil=True)
+def _find_slot(voxel_keys, x, y, z):
+    """
+    Returns the slot of the voxel (x, y, z) in the open addressing table voxel_keys,
+    or the empty slot where it should be added.
+    """
+    key = (x << (2 * VOXEL_BITS)) | (y << VOXEL_BITS) | z
+    mask = voxel_keys.shape[0] - 1
+    slot = ((x * 73856093) ^ (y * 19349663) ^ (z * 83492791)) & mask
+    while voxel_keys[slot] != EMPTY_SLOT and voxel_keys[slot] != key:
+        slot = (slot + 1) & mask
+    return slot, key
+
+
+@njit(cache=True, nogil=True)
+def _voxel_of(point, aabb_min, inv_voxel_size):
+    return (
+        _voxel_coordinate((point[0] - aabb_min[0]) * inv_voxel_size),
+        _voxel_coordinate((point[1] - aabb_min[1]) * inv_voxel_size),
+        _voxel_coordinate((point[2] - aabb_min[2]) * inv_voxel_size))
+
+
+@njit(cache=True, nogil=True)
+def _first_neighbour(value):
+    # the first of the 2 voxels nearest to value on an axis
+    first = np.floor(value)
+    return first - 1 if value - first < 0.5 else first
+
+
+@njit(cache=True, nogil=True)
+def _add_to_table(voxel_keys, voxel_heads, voxel_next, xyz, index, aabb_min, inv_voxel_size):
+    x, y, z = _voxel_of(xyz[index], aabb_min, inv_voxel_size)
+    slot, key = _find_slot(voxel_keys, x, y, z)
+    if voxel_keys[slot] == EMPTY_SLOT:
+        voxel_keys[slot] = key
+        voxel_heads[slot] = -1
+        is_new = True
+    else:
+        is_new = False
+    voxel_next[index] = voxel_heads[slot]
+    voxel_heads[slot] = index
+    return is_new
+
+
+@njit(cache=True, nogil=True)
+def make_voxels(xyz, count, aabb_min, inv_voxel_size):
+    """
+    Index the count first points of xyz in a hash of voxels.
+
+    Returns the tuple (voxel_keys, voxel_heads, voxel_next, sizes) used by the other functions:
+    voxel_keys and voxel_heads are an open addressing table mapping a voxel to the index in xyz of
+    the last point added in this voxel, voxel_next chains the points of the same voxel (-1 ends the chain)
+    and sizes is [number of voxels, number of points].
+    """
+    capacity = 64
+    while capacity < 2 * count:
+        capacity *= 2
+    voxel_keys = np.full(capacity, EMPTY_SLOT, dtype=np.int64)
+    voxel_heads = np.empty(capacity, dtype=np.int64)
+    voxel_next = np.empty(xyz.shape[0], dtype=np.int64)
+    used = 0
+    for i in range(count):
+        if _add_to_table(voxel_keys, voxel_heads, voxel_next, xyz, i, aabb_min, inv_voxel_size):
+            used += 1
+    return voxel_keys, voxel_heads, voxel_next, np.array([used, count], dtype=np.int64)
+
+
+@njit(cache=True, nogil=True)
+def add_to_voxels(voxels, xyz, aabb_min, inv_voxel_size):
+    """
+    Index the point following the points already indexed in xyz, and return voxels,
+    reallocated if they were full.
+    """
+    voxel_keys, voxel_heads, voxel_next, sizes = voxels
+    count = sizes[1]
+    if 2 * (sizes[0] + 1) > voxel_keys.shape[0]:
+        # keep the table half empty, the probe sequences stay short
+        return make_voxels(xyz, count + 1, aabb_min, inv_voxel_size)
+    if voxel_next.shape[0] < xyz.shape[0]:
+        # xyz has been reallocated
+        new_next = np.empty(xyz.shape[0], dtype=np.int64)
+        new_next[:count] = voxel_next[:count]
+        voxel_next = new_next
+
+    if _add_to_table(voxel_keys, voxel_heads, voxel_next, xyz, count, aabb_min, inv_voxel_size):
+        sizes[0] += 1
+    sizes[1] += 1
+    return voxel_keys, voxel_heads, voxel_next, sizes
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def is_point_far_enough_from_voxels(voxels, xyz, tested_point, aabb_min, inv_voxel_size, squared_min_distance):
+    """
+    Same as is_point_far_enough, for the points of xyz indexed in voxels (see make_voxels).
+
+    The voxels are twice as large as the min distance, so the points closer than the min distance
+    are in the 2x2x2 voxels around the voxel corner nearest to tested_point.
+    """
+    voxel_keys, voxel_heads, voxel_next, sizes = voxels
+    first_x = _first_neighbour((tested_point[0] - aabb_min[0]) * inv_voxel_size)
+    first_y = _first_neighbour((tested_point[1] - aabb_min[1]) * inv_voxel_size)
+    first_z = _first_neighbour((tested_point[2] - aabb_min[2]) * inv_voxel_size)
+
+    for dx in range(2):
+        x = _voxel_coordinate(first_x + dx)
+        for dy in range(2):
+            y = _voxel_coordinate(first_y + dy)
+            for dz in range(2):
+                z = _voxel_coordinate(first_z + dz)
+                slot, key = _find_slot(voxel_keys, x, y, z)
+                i = voxel_heads[slot] if voxel_keys[slot] == key else -1
+                while i >= 0:
+                    if (tested_point[0] - xyz[i][0]) ** 2 + \
+                       (tested_point[1] - xyz[i][1]) ** 2 + \
+                       (tested_point[2] - xyz[i][2]) ** 2 < squared_min_distance:
+                        return False
+                    i = voxel_next[i]
+    return True
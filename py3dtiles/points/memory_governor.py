@@ -0,0 +1,63 @@
+import time
+
+import psutil
+
+from py3dtiles.points.shared_points import shared_memory_usage
+
+# new portions are read only below this share of the budget
+READ_THRESHOLD = 0.8
+# above this share of the budget, the manager frees memory
+RELEASE_THRESHOLD = 0.9
+
+
+def _rss(process):
+    usage = 0
+    for p in [process] + process.children(recursive=True):
+        try:
+            usage += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return usage
+
+
+class MemoryGovernor:
+    """
+    Measures the memory used by a conversion, to keep it under a budget.
+
+    The usage is the RSS of the manager and of its local workers, plus the shared memory
+    segments of the conversion, named with segment_prefix (they're not part of any RSS
+    once the process that created them has unmapped them).
+    """
+
+    def __init__(self, max_memory_MB, segment_prefix=None, interval=0.5):
+        self.max_memory = max_memory_MB * 1024 * 1024
+        self.segment_prefix = segment_prefix
+        self.interval = interval
+        self.process = psutil.Process()
+        self.last_measure = 0
+        self.usage = 0
+
+    def measure(self):
+        """
+        Returns the memory used in bytes, measured at most every interval seconds
+        """
+        now = time.time()
+        if now - self.last_measure < self.interval:
+            return self.usage
+
+        usage = _rss(self.process)
+        if self.segment_prefix is not None:
+            usage += shared_memory_usage(self.segment_prefix)
+
+        self.usage = usage
+        self.last_measure = now
+        return usage
+
+    def can_read(self):
+        return self.measure() < READ_THRESHOLD * self.max_memory
+
+    def excess(self):
+        """
+        Returns the number of bytes to free to get back under the release threshold
+        """
+        return max(0, self.measure() - RELEASE_THRESHOLD * self.max_memory)
@@ -1,6 +1,7 @@
 import json
 import os
-import pickle
+import struct
+from collections import namedtuple
 
 import numpy as np
 
@@ -8,13 +9,79 @@ from py3dtiles import TileContentReader
 from py3dtiles.constants import MIN_POINT_SIZE
 from py3dtiles.feature_table import SemanticPoint
 from py3dtiles.points.distance import xyz_to_child_index
+from py3dtiles.points.point_attributes import read_point_attributes
 from py3dtiles.points.points_grid import Grid
-from py3dtiles.points.task.pnts_writer import points_to_pnts
+from py3dtiles.points.shared_points import dumps_points
+from py3dtiles.points.task.pnts_writer import MIN_TILE_POINT_COUNT, points_to_pnts
 from py3dtiles.points.utils import name_to_filename, node_from_name, SubdivisionType, aabb_size_to_subdivision_type
 
 
-def node_to_tileset(args):
-    return Node.to_tileset(None, args[0], args[1], args[2], args[3], args[4])
+# kind, children (their last digit), cell count, number of cells, number of points
+NODE_HEADER = struct.Struct('<I8s3iII')
+LEAF_NODE = 0
+INNER_NODE = 1
+
+# A subtree of the tileset is written in an external tileset if its json is larger than max_bytes,
+# or if it has more than max_depth levels or max_tiles tiles (if they're not None).
+TilesetSplitPolicy = namedtuple('TilesetSplitPolicy', ['max_bytes', 'max_depth', 'max_tiles'])
+DEFAULT_SPLIT_POLICY = TilesetSplitPolicy(100000, None, None)
+
+
+def pack_node(kind, children, cell_count, cell_points, xyz, rgb):
+    """
+    Serialize a node: a fixed size header, followed by the point count of each cell (int64)
+    then the positions (float32) and the attributes (uint8, the colors first) of the points.
+    """
+    return b''.join([
+        NODE_HEADER.pack(kind, children, *cell_count, len(cell_points), len(xyz)),
+        np.ascontiguousarray(cell_points, dtype=np.int64).data,
+        np.ascontiguousarray(xyz, dtype=np.float32).data,
+        np.ascontiguousarray(rgb, dtype=np.uint8).data,
+    ])
+
+
+def unpack_node(data):
+    """
+    Read a node serialized by pack_node.
+    The arrays are read-only views on data.
+
+    Returns a tuple (kind, children, cell_count, cell_points, xyz, rgb)
+    """
+    kind, children, cx, cy, cz, cell_number, point_count = NODE_HEADER.unpack_from(data)
+    offset = NODE_HEADER.size
+    cell_points = np.frombuffer(data, dtype=np.int64, count=cell_number, offset=offset)
+    offset += cell_points.nbytes
+    xyz = np.frombuffer(data, dtype=np.float32, count=3 * point_count, offset=offset).reshape((point_count, 3))
+    offset += xyz.nbytes
+    # the attributes of the points fill the end of data
+    width = (len(data) - offset) // point_count if point_count else 3
+    rgb = np.frombuffer(data, dtype=np.uint8, count=width * point_count, offset=offset).reshape((point_count, width))
+    return kind, children.rstrip(b'\0'), np.array([cx, cy, cz], dtype=np.int32), cell_points, xyz, rgb
+
+
+def _merge_tiles(name, children, folder, tile_index):
+    """
+    Merge the tiles of children in the tile name, and update tile_index
+    """
+    names = [name] + children
+    tiles = [TileContentReader.read_file(name_to_filename(folder, n, '.pnts')) for n in names]
+    include_rgb = tiles[0].body.feature_table.header.colors != SemanticPoint.NONE
+    quantize = tiles[0].body.feature_table.header.positions == SemanticPoint.POSITION_QUANTIZED
+    draco = tiles[0].body.feature_table.header.draco is not None
+    xyz = np.concatenate([tile.body.feature_table.get_positions() for tile in tiles]).view(np.uint8).ravel()
+    attributes = [read_point_attributes(tile) for tile in tiles]
+    point_dtype = attributes[0][0]
+    points = np.concatenate([xyz] + [rows.ravel() for _, rows in attributes])
+
+    for n in names:
+        os.remove(name_to_filename(folder, n, '.pnts'))
+    count, _ = points_to_pnts(name, points, folder, include_rgb, quantize, draco, point_dtype)
+
+    aabbs = [tile_index.pop(n)[1] for n in children]
+    aabb = tile_index[name][1]
+    tile_index[name] = (count, np.array([
+        np.amin([aabb[0]] + [a[0] for a in aabbs], axis=0),
+        np.amax([aabb[1]] + [a[1] for a in aabbs], axis=0)]))
 
 
 class Node(object):
@@ -41,23 +108,30 @@ class Node(object):
         self.dirty = False
 
     def save_to_bytes(self):
-        sub_pickle = {}
         if self.children is not None:
-            sub_pickle['children'] = self.children
-            sub_pickle['grid'] = self.grid
+            grid = self.grid
+            return pack_node(
+                INNER_NODE,
+                b''.join(child[-1:] for child in self.children),
+                grid.cell_count,
+                grid.cell_points,
+                grid.xyz[:grid.count],
+                grid.rgb[:grid.count])
+        elif self.points:
+            xyz = np.concatenate([xyz for xyz, rgb in self.points])
+            rgb = np.concatenate([rgb for xyz, rgb in self.points])
         else:
-            sub_pickle['points'] = self.points
-
-        d = pickle.dumps(sub_pickle)
-        return d
+            xyz = np.zeros((0, 3), dtype=np.float32)
+            rgb = np.zeros((0, 3), dtype=np.uint8)
+        return pack_node(LEAF_NODE, b'', (0, 0, 0), np.zeros(0, dtype=np.int64), xyz, rgb)
 
     def load_from_bytes(self, byt):
-        sub_pickle = pickle.loads(byt)
-        if 'children' in sub_pickle:
-            self.children = sub_pickle['children']
-            self.grid = sub_pickle['grid']
-        else:
-            self.points = sub_pickle['points']
+        kind, children, cell_count, cell_points, xyz, rgb = unpack_node(byt)
+        if kind == INNER_NODE:
+            self.children = [self.name + children[i:i + 1] for i in range(len(children))]
+            self.grid.load(cell_count, cell_points, xyz, rgb)
+        elif len(xyz):
+            self.points = [(xyz, rgb)]
 
     def insert(self, node_catalog, scale, xyz, rgb, make_empty_node=False):
         if make_empty_node:
@@ -102,9 +176,9 @@ class Node(object):
         self.pending_xyz = []
         self.pending_rgb = []
 
-    def dump_pending_points(self):
+    def dump_pending_points(self, use_shared_memory=False):
         result = [
-            (name, pickle.dumps({'xyz': xyz, 'rgb': rgb}), len(xyz))
+            (name, dumps_points(xyz, rgb, use_shared_memory), len(xyz))
             for name, xyz, rgb in self._get_pending_points()
         ]
 
@@ -172,96 +246,75 @@ class Node(object):
     def get_points(data, include_rgb):
         if data.children is None:
             points = data.points
-            xyz = np.concatenate(tuple([xyz for xyz, rgb in points])).view(np.uint8).ravel()
-            rgb = np.concatenate(tuple([rgb for xyz, rgb in points])).ravel()
-            count = sum([xyz.shape[0] for xyz, rgb in points])
+            xyz = np.concatenate(tuple([xyz for xyz, rgb in points]))
+            rgb = np.concatenate(tuple([rgb for xyz, rgb in points]))
+            count = xyz.shape[0]
 
             if include_rgb:
-                result = np.concatenate((xyz, rgb))
-                assert len(result) == count * (3 * 4 + 3)
+                result = np.concatenate((xyz.view(np.uint8).ravel(), rgb.ravel()))
+                assert len(result) == count * (3 * 4 + rgb.shape[1])
                 return result
             else:
-                return xyz
+                return xyz.view(np.uint8).ravel()
         else:
             return data.grid.get_points(include_rgb)
 
     @staticmethod
-    def to_tileset(executor, name, parent_aabb, parent_spacing, folder, scale):
+    def to_tileset(name, parent_aabb, parent_spacing, folder, scale, tile_index, split_policy=DEFAULT_SPLIT_POLICY,
+                   extensions=()):
+        """
+        Build the tileset of the node and its descendants from tile_index, that records the point count
+        and the real aabb of each written tile (name -> (point count, aabb)). The tiles aren't read,
+        unless small children are merged in their parent tile.
+
+        The subtrees are written in external tilesets according to split_policy, they declare the extensions
+        used and required by the tiles.
+        """
+        return Node._to_tileset(name, parent_aabb, parent_spacing, folder, scale, tile_index, split_policy,
+                                extensions)[0]
+
+    @staticmethod
+    def _to_tileset(name, parent_aabb, parent_spacing, folder, scale, tile_index, split_policy, extensions=()):
+        """
+        Returns the tileset, with the length of its json, its tile count and its depth
+        """
         node = node_from_name(name, parent_aabb, parent_spacing)
         aabb = node.aabb
         ondisk_tile = name_to_filename(folder, name, '.pnts')
-        xyz, rgb = None, None
-
-        # Read tile's pnts file, if existing, we'll need it for:
-        #   - computing the real AABB (instead of the one based on the octree)
-        #   - merging this tile's small (<100 points) children
-        if os.path.exists(ondisk_tile):
-            tile = TileContentReader.read_file(ondisk_tile)
-            fth = tile.body.feature_table.header
-            xyz = tile.body.feature_table.body.positions_arr
-            if fth.colors != SemanticPoint.NONE:
-                rgb = tile.body.feature_table.body.colors_arr
-            xyz_float = xyz.view(np.float32).reshape((fth.points_length, 3))
-            # update aabb based on real values
-            aabb = np.array([
-                np.amin(xyz_float, axis=0),
-                np.amax(xyz_float, axis=0)])
+
+        # use the real AABB (instead of the one based on the octree)
+        if name in tile_index:
+            aabb = np.copy(tile_index[name][1])
 
         # geometricError is in meters, so we divide it by the scale
         tileset = {'geometricError': 10 * node.spacing / scale[0]}
 
         children = []
-        tile_needs_rewrite = False
-        if os.path.exists(ondisk_tile):
+        # the json length, tile count and depth of the children
+        children_sizes = []
+        small_children = []
+        if name in tile_index:
             tileset['content'] = {'uri': os.path.relpath(ondisk_tile, folder)}
         for child in ['0', '1', '2', '3', '4', '5', '6', '7']:
             child_name = '{}{}'.format(
                 name.decode('ascii'),
                 child).encode('ascii')
-            child_ondisk_tile = name_to_filename(folder, child_name, '.pnts')
-
-            if os.path.exists(child_ondisk_tile):
-                # See if we should merge this child in tile
-                if xyz is not None:
-                    # Read pnts content
-                    tile = TileContentReader.read_file(child_ondisk_tile)
-                    fth = tile.body.feature_table.header
-
-                    # If this child is small enough, merge in the current tile
-                    if fth.points_length < 100:
-                        xyz = np.concatenate(
-                            (xyz,
-                             tile.body.feature_table.body.positions_arr))
-
-                        if fth.colors != SemanticPoint.NONE:
-                            rgb = np.concatenate(
-                                (rgb,
-                                 tile.body.feature_table.body.colors_arr))
-
-                        # update aabb
-                        xyz_float = tile.body.feature_table.body.positions_arr.view(
-                            np.float32).reshape((fth.points_length, 3))
-
-                        aabb[0] = np.amin(
-                            [aabb[0], np.min(xyz_float, axis=0)], axis=0)
-                        aabb[1] = np.amax(
-                            [aabb[1], np.max(xyz_float, axis=0)], axis=0)
-
-                        tile_needs_rewrite = True
-                        os.remove(child_ondisk_tile)
-                        continue
-
-                # Add child to the to-be-processed list if it hasn't been merged
-                if executor is not None:
-                    children += [(child_name, node.aabb, node.spacing, folder, scale)]
-                else:
-                    children += [Node.to_tileset(None, child_name, node.aabb, node.spacing, folder, scale)]
-
-        # If we merged at least one child tile in the current tile
-        # the pnts file needs to be rewritten.
-        if tile_needs_rewrite:
-            os.remove(ondisk_tile)
-            count, filename = points_to_pnts(name, np.concatenate((xyz, rgb)), folder, rgb is not None)
+
+            if child_name in tile_index:
+                # If this child is small enough, merge it in the current tile
+                if name in tile_index and tile_index[child_name][0] < MIN_TILE_POINT_COUNT:
+                    small_children.append(child_name)
+                    continue
+
+                child_tileset, size, tile_count, depth = Node._to_tileset(
+                    child_name, node.aabb, node.spacing, folder, scale, tile_index, split_policy, extensions)
+                children += [child_tileset]
+                children_sizes += [(size, tile_count, depth)]
+
+        # The small children are usually merged by the writer, unless they're written by another job
+        if small_children:
+            _merge_tiles(name, small_children, folder, tile_index)
+            aabb = np.copy(tile_index[name][1])
 
         center = ((aabb[0] + aabb[1]) * 0.5).tolist()
         half_size = ((aabb[1] - aabb[0]) * 0.5).tolist()
@@ -273,16 +326,21 @@ class Node(object):
                 0, 0, half_size[2]]
         }
 
-        if executor is not None:
-            children = [t for t in executor.map(node_to_tileset, children)]
-
         if children is not None:
             tileset['children'] = children
         else:
             tileset['geometricError'] = 0.0
 
+        # the json of the tileset, without serializing the children again
+        size = (len(json.dumps(dict(tileset, children=[])))
+                + sum([s for s, _, _ in children_sizes]) + 2 * max(0, len(children) - 1))
+        tile_count = 1 + sum([t for _, t, _ in children_sizes])
+        depth = 1 + max([d for _, _, d in children_sizes], default=0)
+
         if len(name) > 0 and children:
-            if len(json.dumps(tileset)) > 100000:
+            if ((split_policy.max_bytes is not None and size > split_policy.max_bytes)
+                    or (split_policy.max_depth is not None and depth > split_policy.max_depth)
+                    or (split_policy.max_tiles is not None and tile_count > split_policy.max_tiles)):
                 tile_root = {
                     'asset': {
                         'version': '1.0',
@@ -291,10 +349,14 @@ class Node(object):
                     'geometricError': tileset['geometricError'],
                     'root': tileset
                 }
+                if extensions:
+                    tile_root['extensionsUsed'] = tile_root['extensionsRequired'] = list(extensions)
                 tileset_name = 'tileset.{}.json'.format(name.decode('ascii'))
                 with open('{}/{}'.format(folder, tileset_name), 'w') as f:
                     f.write(json.dumps(tile_root))
                 tileset['content'] = {'uri': tileset_name}
                 tileset['children'] = []
+                size = len(json.dumps(tileset))
+                tile_count = depth = 1
 
-        return tileset
+        return tileset, size, tile_count, depth
@@ -1,10 +1,9 @@
 import math
-import pickle
 
 import lz4.frame as gzip
 
 from py3dtiles.points.node import Node
-from py3dtiles.points.utils import split_aabb
+from py3dtiles.points.utils import dumps_node_bytes, loads_node_bytes, split_aabb
 
 
 class NodeCatalog:
@@ -45,11 +44,11 @@ class NodeCatalog:
             for n in node.children:
                 self.dump(n, max_depth - 1)
 
-        return pickle.dumps(self.node_bytes)
+        return dumps_node_bytes(self.node_bytes)
 
     def _load_from_store(self, name, data):
         if len(data) > 0:
-            out = pickle.loads(gzip.decompress(data))
+            out = loads_node_bytes(gzip.decompress(data))
             for n in out:
                 spacing = self.root_spacing / math.pow(2, len(n))
                 aabb = self.root_aabb
@@ -0,0 +1,67 @@
+import numpy as np
+
+from py3dtiles.constants import MIN_POINT_SIZE
+from py3dtiles.points.utils import split_aabb
+
+# number of cells of the grid along each axis
+GRID_SIZE = 32
+# the regions are enlarged by this share of a cell, for the rounding errors of the transformed points
+MARGIN = 0.01
+
+
+class PendingRegions:
+    """
+    The regions of the octree where new points may still arrive: the bounds of the portions not
+    read yet, and of the points sent to the root node and not processed yet.
+
+    The regions are counted on a coarse grid over the root aabb. Once no region overlaps the cells
+    of a node, and none of its ancestors has points to process, the node won't change anymore.
+    """
+
+    def __init__(self, root_aabb):
+        self.root_min = root_aabb[0]
+        self.root_aabb = root_aabb
+        self.inv_cell_size = GRID_SIZE / np.maximum(MIN_POINT_SIZE, root_aabb[1] - root_aabb[0])
+        self.counts = np.zeros((GRID_SIZE, GRID_SIZE, GRID_SIZE), dtype=np.int32)
+        # name -> cells overlapped by the node
+        self.node_cells = {}
+
+    def _cells(self, aabb, margin=MARGIN):
+        if aabb is None:
+            # unknown bounds, the region may cover everything
+            return (slice(0, GRID_SIZE),) * 3
+        low = np.floor((aabb[0] - self.root_min) * self.inv_cell_size - margin)
+        # a node ending on the border of a cell doesn't overlap the next one
+        high = np.ceil((aabb[1] - self.root_min) * self.inv_cell_size + margin) - 1
+        low = np.clip(low, 0, GRID_SIZE - 1).astype(int)
+        high = np.clip(high, 0, GRID_SIZE - 1).astype(int)
+        return tuple(slice(low[i], high[i] + 1) for i in range(3))
+
+    def add(self, aabb):
+        self.counts[self._cells(aabb)] += 1
+
+    def remove(self, aabb):
+        """
+        Returns True if no region overlaps some cells of aabb anymore
+        """
+        cells = self._cells(aabb)
+        self.counts[cells] -= 1
+        return not self.counts[cells].all()
+
+    def is_empty(self):
+        return not self.counts.any()
+
+    def is_node_settled(self, name):
+        """
+        Returns True if no region overlaps the node
+        """
+        cells = self.node_cells.get(name)
+        if cells is None:
+            aabb = self.root_aabb
+            for digit in name:
+                aabb = split_aabb(aabb, digit - ord('0'))
+            cells = self.node_cells[name] = self._cells(aabb, 0)
+        return not self.counts[cells].any()
+
+    def forget(self, name):
+        self.node_cells.pop(name, None)
@@ -0,0 +1,76 @@
+import numpy as np
+
+from py3dtiles.feature_table import oct_encode, SemanticPoint
+
+# the values of the points that can be exported in the batch table, and their type
+EXTRA_ATTRIBUTES = {
+    'intensity': np.uint16,
+    'classification': np.uint8,
+    'return_number': np.uint8,
+    'gps_time': np.float64,
+}
+
+# the normal of the points without one
+DEFAULT_NORMAL = (0, 0, 1)
+
+
+def make_point_dtype(normals=False, extra_attributes=()):
+    """
+    Returns the layout of the attributes of a point: its color, its oct-encoded normal if normals is True,
+    then the values of extra_attributes, in the order of EXTRA_ATTRIBUTES.
+
+    The points carry their attributes in a (n, itemsize) uint8 array, whose 3 first columns are the colors.
+    """
+    fields = [('rgb', np.uint8, 3)]
+    if normals:
+        fields.append(('normal', np.uint8, 2))
+    fields += [(name, EXTRA_ATTRIBUTES[name]) for name in EXTRA_ATTRIBUTES if name in extra_attributes]
+    return np.dtype(fields)
+
+
+def pack_point_attributes(point_dtype, colors, values):
+    """
+    Returns the attributes of the points in a (n, point_dtype.itemsize) uint8 array.
+    values gives the normals (oct-encoded) and the extra attributes of the points, the missing values are 0
+    and the missing normals DEFAULT_NORMAL. Without normal nor extra attributes, it's the colors array.
+    """
+    if point_dtype is None or point_dtype.names == ('rgb',):
+        return colors
+    attributes = np.zeros(len(colors), dtype=point_dtype)
+    attributes['rgb'] = colors
+    if 'normal' in point_dtype.names:
+        attributes['normal'] = oct_encode(DEFAULT_NORMAL)
+    for name, value in values.items():
+        if name in point_dtype.names:
+            attributes[name] = value
+    return attributes.view(np.uint8).reshape((len(colors), point_dtype.itemsize))
+
+
+def read_point_attributes(tile):
+    """
+    Read the attributes of the points of a pnts tile written by py3dtiles.
+
+    Returns a tuple (point_dtype, attributes) with attributes as returned by pack_point_attributes
+    """
+    feature_table = tile.body.feature_table
+    batch_table = tile.body.batch_table
+    count = feature_table.npoints()
+
+    if feature_table.header.colors != SemanticPoint.NONE:
+        colors = feature_table.body.colors_arr.reshape((count, 3))
+    else:
+        colors = np.zeros((count, 3), dtype=np.uint8)
+
+    values = {}
+    if feature_table.header.normal == SemanticPoint.NORMAL_OCT16P:
+        values['normal'] = feature_table.body.normal_arr.reshape((count, 2))
+    elif feature_table.header.normal == SemanticPoint.NORMAL:
+        # the normals of the tiles compressed with draco
+        values['normal'] = oct_encode(feature_table.get_normals())
+    if batch_table is not None:
+        for name in EXTRA_ATTRIBUTES:
+            if name in batch_table.header:
+                values[name] = batch_table.get_binary_property(name, count)
+
+    point_dtype = make_point_dtype('normal' in values, values)
+    return point_dtype, pack_point_attributes(point_dtype, colors, values)
@@ -1,89 +1,119 @@
 import numpy as np
 from numba import njit
-from numba.typed import List
 
 from py3dtiles.points.utils import SubdivisionType, aabb_size_to_subdivision_type
-from py3dtiles.points.distance import is_point_far_enough, xyz_to_key
+from py3dtiles.points.distance import add_to_voxels, is_point_far_enough_from_voxels, make_voxels, xyz_to_key
 
 
 @njit(fastmath=True, cache=True)
-def _insert(cells_xyz, cells_rgb, aabmin, inv_aabb_size, cell_count, xyz, rgb, spacing, shift, force=False):
+def _insert(xyz_arena, rgb_arena, count, cell_points, aabmin, inv_aabb_size, cell_count, xyz, rgb, spacing, shift,
+            voxels, inv_voxel_size):
     keys = xyz_to_key(xyz, cell_count, aabmin, inv_aabb_size, shift)
 
-    if force:
-        # allocate this one once and for all
-        for k in np.unique(keys):
-            idx = np.where(keys - k == 0)
-            cells_xyz[k] = np.concatenate((cells_xyz[k], xyz[idx]))
-            cells_rgb[k] = np.concatenate((cells_rgb[k], rgb[idx]))
-    else:
-        notinserted = np.full(len(xyz), False)
-        needs_balance = False
-
-        for i in range(len(xyz)):
+    notinserted = np.full(len(xyz), False)
+    needs_balance = False
+
+    for i in range(len(xyz)):
+        if is_point_far_enough_from_voxels(voxels, xyz_arena, xyz[i], aabmin, inv_voxel_size, spacing):
+            if count == xyz_arena.shape[0]:
+                # double the capacity, so the insertion is amortized O(1)
+                xyz_arena, rgb_arena = _grow(xyz_arena, rgb_arena, count, 2 * count)
+            xyz_arena[count] = xyz[i]
+            rgb_arena[count] = rgb[i]
+            voxels = add_to_voxels(voxels, xyz_arena, aabmin, inv_voxel_size)
+            count += 1
+
             k = keys[i]
-            if cells_xyz[k].shape[0] == 0 or is_point_far_enough(cells_xyz[k], xyz[i], spacing):
-                cells_xyz[k] = np.concatenate((cells_xyz[k], xyz[i].reshape(1, 3)))
-                cells_rgb[k] = np.concatenate((cells_rgb[k], rgb[i].reshape(1, 3)))
-                if cell_count[0] < 8:
-                    needs_balance = needs_balance or cells_xyz[k].shape[0] > 200000
-            else:
-                notinserted[i] = True
+            cell_points[k] += 1
+            if cell_count[0] < 8:
+                needs_balance = needs_balance or cell_points[k] > 200000
+        else:
+            notinserted[i] = True
+
+    return xyz[notinserted], rgb[notinserted], needs_balance, xyz_arena, rgb_arena, count, voxels
 
-        return xyz[notinserted], rgb[notinserted], needs_balance
+
+@njit(cache=True)
+def _grow(xyz_arena, rgb_arena, count, capacity):
+    new_xyz = np.empty((max(16, capacity), 3), dtype=np.float32)
+    new_xyz[:count] = xyz_arena[:count]
+    new_rgb = np.empty((max(16, capacity), rgb_arena.shape[1]), dtype=np.uint8)
+    new_rgb[:count] = rgb_arena[:count]
+    return new_xyz, new_rgb
 
 
 class Grid(object):
-    """docstring for Grid"""
+    """
+    The points kept by a node, with at least the node spacing between them.
+
+    The points are stored in insertion order in growable arrays (xyz and rgb, the count first
+    rows are used). The rows of rgb are the colors of the points, followed by their other attributes
+    (see py3dtiles.points.point_attributes). The node aabb is divided in cells, whose point counts decide when to subdivide
+    the node, and the points are indexed in a hash of voxels to test the spacing of new points.
+    """
 
-    __slots__ = ('cell_count', 'cells_xyz', 'cells_rgb', 'spacing')
+    __slots__ = ('cell_count', 'cell_points', 'xyz', 'rgb', 'count', 'spacing', 'inv_voxel_size', 'voxels')
 
     def __init__(self, node, initial_count=3):
         super(Grid, self).__init__()
         self.cell_count = np.array([initial_count, initial_count, initial_count], dtype=np.int32)
         self.spacing = node.spacing * node.spacing
-
-        self.cells_xyz = List()
-        self.cells_rgb = List()
-        for _ in range(self.max_key_value):
-            self.cells_xyz.append(np.zeros((0, 3), dtype=np.float32))
-            self.cells_rgb.append(np.zeros((0, 3), dtype=np.uint8))
-
-    def __getstate__(self):
-        return {
-            "cell_count": self.cell_count,
-            "spacing": self.spacing,
-            "cells_xyz": list(self.cells_xyz),
-            "cells_rgb": list(self.cells_rgb),
-        }
-
-    def __setstate__(self, state):
-        self.cell_count = state['cell_count']
-        self.spacing = state['spacing']
-        self.cells_xyz = List(state['cells_xyz'])
-        self.cells_rgb = List(state['cells_rgb'])
+        # the points are also indexed in a hash of voxels twice as large as the spacing,
+        # to test the distance to the nearest points only
+        self.inv_voxel_size = np.float32(0.5 / node.spacing)
+        self.voxels = None
+
+        self.cell_points = np.zeros(self.max_key_value, dtype=np.int64)
+        self.xyz = np.zeros((0, 3), dtype=np.float32)
+        self.rgb = np.zeros((0, 3), dtype=np.uint8)
+        self.count = 0
+
+    def load(self, cell_count, cell_points, xyz, rgb):
+        """
+        Restore the points of a serialized grid. xyz and rgb may be read-only, they're copied on the next insertion.
+        """
+        self.cell_count = cell_count
+        self.cell_points = np.array(cell_points)
+        self.xyz = xyz
+        self.rgb = rgb
+        self.count = len(xyz)
+        self.voxels = None
 
     @property
     def max_key_value(self):
         return 1 << (2 * int(self.cell_count[0]).bit_length() + int(self.cell_count[2]).bit_length())
 
-    def insert(self, aabmin, inv_aabb_size, xyz, rgb, force=False):
-        return _insert(
-            self.cells_xyz,
-            self.cells_rgb,
+    def insert(self, aabmin, inv_aabb_size, xyz, rgb):
+        if self.rgb.shape[1] != rgb.shape[1] and self.count == 0:
+            # the attributes of the points are only known once they're inserted
+            self.rgb = np.zeros((0, rgb.shape[1]), dtype=np.uint8)
+        if not self.xyz.flags.writeable:
+            self.xyz, self.rgb = _grow(self.xyz, self.rgb, self.count, self.count + len(xyz))
+        if not xyz.flags.writeable or not rgb.flags.writeable:
+            # the points of a deserialized leaf node, or of a memory-mapped tile
+            xyz, rgb = np.array(xyz), np.array(rgb)
+        if self.voxels is None:
+            self.voxels = make_voxels(self.xyz, self.count, aabmin, self.inv_voxel_size)
+
+        reminder_xyz, reminder_rgb, needs_balance, self.xyz, self.rgb, self.count, self.voxels = _insert(
+            self.xyz,
+            self.rgb,
+            self.count,
+            self.cell_points,
             aabmin,
             inv_aabb_size,
             self.cell_count,
             xyz,
             rgb,
             self.spacing,
-            int(self.cell_count[0] - 1).bit_length(), force)
+            int(self.cell_count[0] - 1).bit_length(),
+            self.voxels,
+            self.inv_voxel_size)
+        return reminder_xyz, reminder_rgb, needs_balance
 
     def needs_balance(self):
         if self.cell_count[0] < 8:
-            for cell in self.cells_xyz:
-                if cell.shape[0] > 100000:
-                    return True
+            return self.cell_points.max() > 100000
         return False
 
     def balance(self, aabb_size, aabmin, inv_aabb_size):
@@ -94,29 +124,17 @@ class Grid(object):
             self.cell_count[2] += 1
         assert self.cell_count[0] < 9
 
-        old_cells_xyz = self.cells_xyz
-        old_cells_rgb = self.cells_rgb
-        self.cells_xyz = List()
-        self.cells_rgb = List()
-        for _ in range(self.max_key_value):
-            self.cells_xyz.append(np.zeros((0, 3), dtype=np.float32))
-            self.cells_rgb.append(np.zeros((0, 3), dtype=np.uint8))
+        # the points don't move, only the cells are counted again
+        keys = xyz_to_key(
+            self.xyz[:self.count], self.cell_count, aabmin, inv_aabb_size, int(self.cell_count[0] - 1).bit_length())
+        self.cell_points = np.bincount(keys, minlength=self.max_key_value).astype(np.int64)
 
-        for cellxyz, cellrgb in zip(old_cells_xyz, old_cells_rgb):
-            self.insert(aabmin, inv_aabb_size, cellxyz, cellrgb, True)
+    def get_point_count(self):
+        return self.count
 
     def get_points(self, include_rgb):
-        xyz = ()
-        rgb = ()
-        pt = 0
-        for i in range(len(self.cells_xyz)):
-            xyz += ((self.cells_xyz[i]).view(np.uint8).ravel(),)
-            rgb += (self.cells_rgb[i].ravel(),)
-            pt += self.cells_xyz[i].shape[0]
-
+        xyz = self.xyz[:self.count].view(np.uint8).ravel()
         if include_rgb:
-            res = np.concatenate((np.concatenate(xyz), np.concatenate(rgb)))
-            assert len(res) == pt * (3 * 4 + 3)
-            return res
+            return np.concatenate((xyz, self.rgb[:self.count].ravel()))
         else:
-            return np.concatenate(xyz)
+            return xyz
@@ -0,0 +1,118 @@
+import heapq
+
+# a job should keep a worker busy for about this many seconds
+TARGET_JOB_DURATION = 1.0
+# point count of a job, before the cost of a point is measured
+DEFAULT_BATCH_POINTS = 100_000
+MIN_BATCH_POINTS = 10_000
+MAX_BATCH_POINTS = 1_000_000
+# weight of the last job in the estimation of the cost of a point
+COST_SMOOTHING = 0.2
+
+
+class Scheduler:
+    """
+    Decides which nodes to process next and how many points to send in each job.
+
+    The nodes waiting to be processed are kept in a heap, ordered by depth (the shallowest first,
+    so their points move down the tree as early as possible), then by backlog (the largest first,
+    rounded to a power of 2) and by age (the first node to receive a task first).
+    The heap entries aren't updated in place: a node is pushed again when its backlog changes
+    of power of 2, and the outdated entries are skipped when they're popped.
+    """
+
+    def __init__(self):
+        self.heap = []
+        # name -> [depth, -backlog magnitude, sequence number, name], the current heap entry of the node
+        self.entries = {}
+        # name -> number of points waiting to be processed
+        self.backlogs = {}
+        # entries popped while their node was processed, pushed back when it's done
+        self.deferred = {}
+        self.sequence = 0
+        self.point_count = 0
+        # processing duration of a point, measured by the workers
+        self.seconds_per_point = None
+
+    def __len__(self):
+        return len(self.backlogs)
+
+    def push(self, name, point_count):
+        """
+        Add point_count points to the backlog of the node name
+        """
+        backlog = self.backlogs.get(name, 0) + point_count
+        self.backlogs[name] = backlog
+        self.point_count += point_count
+
+        entry = self.entries.get(name)
+        if entry is None:
+            entry = self.deferred.get(name)
+        if entry is not None and -entry[1] == backlog.bit_length():
+            return
+        # keep the age of the node when its backlog grows
+        sequence = entry[2] if entry is not None else self.sequence
+        self.sequence += 1
+        entry = [len(name), -backlog.bit_length(), sequence, name]
+        if name in self.deferred:
+            self.deferred[name] = entry
+        else:
+            self.entries[name] = entry
+            heapq.heappush(self.heap, entry)
+
+    def pop(self, busy_nodes):
+        """
+        Remove the node with the highest priority that isn't in busy_nodes and return its name,
+        or None if there's no such node. release must be called when a busy node is done.
+        """
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            name = entry[3]
+            if self.entries.get(name) is not entry:
+                continue
+            del self.entries[name]
+            if name in busy_nodes:
+                self.deferred[name] = entry
+                continue
+            self.point_count -= self.backlogs.pop(name)
+            return name
+        return None
+
+    def release(self, name):
+        """
+        Make the node schedulable again, once its processing is done
+        """
+        entry = self.deferred.pop(name, None)
+        if entry is not None:
+            self.entries[name] = entry
+            heapq.heappush(self.heap, entry)
+
+    def record(self, point_count, duration):
+        """
+        Update the cost of a point with the duration of a job
+        """
+        if point_count <= 0:
+            return
+        cost = duration / point_count
+        if self.seconds_per_point is None:
+            self.seconds_per_point = cost
+        else:
+            self.seconds_per_point += COST_SMOOTHING * (cost - self.seconds_per_point)
+
+    def batch_size(self, worker_count, reading_finished, memory_is_tight=False):
+        """
+        Returns the number of points to send in the next job.
+
+        The jobs last about TARGET_JOB_DURATION. Once the reading is finished, the remaining points
+        are spread between the workers, so they all stay busy until the end. If the memory is tight,
+        the jobs are shorter so the workers are available sooner to write the processed nodes.
+        """
+        if self.seconds_per_point:
+            size = int(TARGET_JOB_DURATION / self.seconds_per_point)
+        else:
+            size = DEFAULT_BATCH_POINTS
+        if reading_finished:
+            size = min(size, -(-self.point_count // max(1, worker_count)))
+        if memory_is_tight:
+            size //= 4
+        return max(MIN_BATCH_POINTS, min(MAX_BATCH_POINTS, size))
@@ -1,16 +1,35 @@
 import os
-import time
+import shutil
 import gc
-import lz4.frame as gzip
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from sys import getsizeof
+
+import lz4.frame as gzip
 from py3dtiles.points.utils import name_to_filename
 
+# approximate memory used by each entry of the cache, besides the data
+ENTRY_OVERHEAD = getsizeof(b'') + 100
+
 
 class SharedNodeStore:
-    def __init__(self, folder):
-        self.metadata = {}
-        self.data = []
+    def __init__(self, folder, generation=0, on_disk=None):
+        # name -> compressed data, from the least to the most recently used
+        self.data = OrderedDict()
         self.folder = folder
+        # Nodes evicted from the cache are written in a sub folder named after the current generation.
+        # A new generation starts after each checkpoint, so the files referenced by the last
+        # checkpoint are never overwritten nor deleted before the next checkpoint is saved.
+        self.generation = generation
+        # name -> generation of the on-disk copy of the node
+        self.on_disk = {} if on_disk is None else on_disk
+        # the cached nodes that differ from their on-disk copy (or don't have one)
+        self.dirty = set()
+        # files of previous generations that aren't needed anymore once the next checkpoint is saved
+        self.obsolete_files = []
+        # evicted nodes are written by a background thread, name -> (data, future) until they're written
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.writing = {}
         self.stats = {
             'hit': 0,
             'miss': 0,
@@ -18,7 +37,8 @@ class SharedNodeStore:
         }
         self.memory_size = {
             'content': 0,
-            'container': getsizeof(self.data) + getsizeof(self.metadata),
+            'container': getsizeof(self.data),
+            'writing': 0,
         }
 
     def control_memory_usage(self, max_size_MB, verbose):
@@ -28,6 +48,11 @@ class SharedNodeStore:
         if verbose >= 3:
             self.print_statistics()
 
+        self._collect_writes()
+        if self.memory_size['writing'] * bytes_to_mb > max_size_MB:
+            # the disk can't keep up
+            self.flush()
+
         # guess cache size
         cache_size = (self.memory_size['container'] + self.memory_size['content']) * bytes_to_mb
 
@@ -44,62 +69,120 @@ class SharedNodeStore:
             print('<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< CACHE CLEANING')
 
     def get(self, name, stat_inc=1):
-        metadata = self.metadata.get(name, None)
-        data = b''
-        if metadata is not None:
-            data = self.data[metadata[1]]
+        data = self.data.get(name, None)
+        if data is not None:
+            self.data.move_to_end(name)
+            self.stats['hit'] += stat_inc
+        elif name in self.writing:
+            # evicted, but not written yet
+            data = self.writing[name][0]
             self.stats['hit'] += stat_inc
+        elif name in self.on_disk:
+            self.stats['miss'] += stat_inc
+            with open(self._filename(name, self.on_disk[name]), 'rb') as f:
+                data = f.read()
         else:
-            filename = name_to_filename(self.folder, name)
-            if os.path.exists(filename):
-                self.stats['miss'] += stat_inc
-                with open(filename, 'rb') as f:
-                    data = f.read()
-            else:
-                self.stats['new'] += stat_inc
-            #  should we cache this node?
+            data = b''
+            self.stats['new'] += stat_inc
+            #  should we cache this node?
 
         return data
 
     def remove(self, name):
-        meta = self.metadata.pop(name, None)
+        data = self.data.pop(name, None)
+        self.dirty.discard(name)
+        self._wait_write(name)
+        generation = self.on_disk.pop(name, None)
 
-        filename = name_to_filename(self.folder, name)
-        if meta is None:
-            assert os.path.exists(filename), '{} should exist'.format(filename)
+        if data is None:
+            assert generation is not None, '{} should exist'.format(name)
         else:
-            self.memory_size['content'] -= getsizeof(meta)
-            self.memory_size['content'] -= len(self.data[meta[1]])
-            self.memory_size['container'] = getsizeof(self.data) + getsizeof(self.metadata)
-            self.data[meta[1]] = None
+            self.memory_size['content'] -= len(data) + ENTRY_OVERHEAD
+            self.memory_size['container'] = getsizeof(self.data)
 
-        if os.path.exists(filename):
-            os.remove(filename)
+        if generation is not None:
+            self._discard_file(name, generation)
 
     def put(self, name, data):
         compressed_data = gzip.compress(data)
 
-        metadata = self.metadata.get(name, None)
-        if metadata is None:
-            metadata = (time.time(), len(self.data))
-            self.data.append(compressed_data)
-        else:
-            metadata = (time.time(), metadata[1])
-            self.data[metadata[1]] = compressed_data
-        self.metadata.update([(name, metadata)])
+        previous = self.data.pop(name, None)
+        if previous is not None:
+            self.memory_size['content'] -= len(previous) + ENTRY_OVERHEAD
+        self.data[name] = compressed_data
+        self.dirty.add(name)
 
-        self.memory_size['content'] += len(compressed_data) + getsizeof((name, metadata))
-        self.memory_size['container'] = getsizeof(self.data) + getsizeof(self.metadata)
+        self.memory_size['content'] += len(compressed_data) + ENTRY_OVERHEAD
+        self.memory_size['container'] = getsizeof(self.data)
 
     def remove_oldest_nodes(self, percent):
-        count = _remove_all(self)
-
-        self.memory_size['content'] = 0
-        self.memory_size['container'] = getsizeof(self.data) + getsizeof(self.metadata)
+        """
+        Evict the least recently used nodes, until percent of the cache size is freed.
+        The evicted nodes are written on disk in the background, unless their on-disk copy is up to date.
+
+        Returns a tuple (count of nodes evicted, bytes written)
+        """
+        to_free = percent * (self.memory_size['content'] + self.memory_size['container'])
+        count = 0
+        bytes_written = 0
+        while self.data and (to_free > 0 or percent >= 1):
+            name, data = self.data.popitem(last=False)
+            self.memory_size['content'] -= len(data) + ENTRY_OVERHEAD
+            to_free -= len(data) + ENTRY_OVERHEAD
+            count += 1
+            if name in self.dirty:
+                self.dirty.remove(name)
+                self._write(name, data)
+                self.memory_size['writing'] += len(data)
+                bytes_written += len(data)
+
+        self.memory_size['container'] = getsizeof(self.data)
+        return count, bytes_written
+
+    def flush(self):
+        """
+        Wait until the evicted nodes are written on disk
+        """
+        for name in list(self.writing):
+            self._wait_write(name)
+
+    def close(self):
+        self.flush()
+        self.writer.shutdown()
+
+    def checkpoint(self):
+        """
+        Write the cached nodes that changed since they were last written on disk, and return the metadata
+        needed to reload the store. The nodes stay in the cache.
+
+        commit_checkpoint must be called once the returned value has been safely persisted.
+        """
+        for name in self.dirty:
+            self._write(name, self.data[name])
+            self.memory_size['writing'] += len(self.data[name])
+        self.dirty = set()
+        self.flush()
+        return {
+            'generation': self.generation,
+            'on_disk': dict(self.on_disk),
+        }
 
-        assert(len(self.metadata) == 0)
-        assert(len(self.data) == 0)
-        return count
+    def commit_checkpoint(self):
+        for filename in self.obsolete_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.obsolete_files = []
+        self.generation += 1
+
+    @staticmethod
+    def from_checkpoint(folder, checkpoint):
+        """
+        Reload a store saved with checkpoint and drop the files written after it.
+        """
+        for entry in os.listdir(folder):
+            if entry.isdigit() and int(entry) > checkpoint['generation']:
+                shutil.rmtree(os.path.join(folder, entry))
+        return SharedNodeStore(folder, checkpoint['generation'] + 1, dict(checkpoint['on_disk']))
 
     def print_statistics(self):
         print('Stats: Hits = {}, Miss = {}, New = {}'.format(
@@ -107,18 +190,37 @@ class SharedNodeStore:
             self.stats['miss'],
             self.stats['new']))
 
+    def _filename(self, name, generation):
+        return name_to_filename(os.path.join(self.folder, str(generation)), name)
 
-def _remove_all(store):
-    # delete the entries
-    count = len(store.metadata)
-    bytes_written = 0
-    for name, meta in store.metadata.items():
-        data = store.data[meta[1]]
-        filename = name_to_filename(store.folder, name)
-        with open(filename, 'wb') as f:
-            bytes_written += f.write(data)
-
-    store.metadata = {}
-    store.data = []
-
-    return (count, bytes_written)
+    def _discard_file(self, name, generation):
+        filename = self._filename(name, generation)
+        if generation == self.generation:
+            os.remove(filename)
+        else:
+            # the last checkpoint may still reference this file
+            self.obsolete_files.append(filename)
+
+    def _write(self, name, data):
+        self._wait_write(name)
+        generation = self.on_disk.get(name, None)
+        if generation is not None and generation != self.generation:
+            self._discard_file(name, generation)
+        self.on_disk[name] = self.generation
+        self.writing[name] = (data, self.writer.submit(_write_file, self._filename(name, self.generation), data))
+
+    def _wait_write(self, name):
+        if name in self.writing:
+            data, future = self.writing.pop(name)
+            # raise the exception of the write if any
+            future.result()
+            self.memory_size['writing'] -= len(data)
+
+    def _collect_writes(self):
+        for name in [name for name, (data, future) in self.writing.items() if future.done()]:
+            self._wait_write(name)
+
+
+def _write_file(filename, data):
+    with open(filename, 'wb') as f:
+        f.write(data)
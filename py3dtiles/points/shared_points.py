@@ -0,0 +1,175 @@
+"""
+Transport of point batches between the processes of a conversion.
+
+A batch is serialized as a small pickled dict. Big batches are copied into a
+shared memory segment and only the segment name travels through zmq and waits
+in the manager queues. The segment is destroyed by the process that loads it.
+"""
+import os
+import pickle
+import secrets
+import shutil
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # python < 3.8
+    resource_tracker = shared_memory = None
+
+# below this size, pickling the arrays is cheaper than creating a segment
+SHARED_MEMORY_MIN_POINTS = 1000
+SHARED_MEMORY_FOLDER = '/dev/shm'
+
+# the names of the segments created by this process start with this prefix (see set_segment_prefix)
+_segment_prefix = None
+
+XYZ_DTYPE = np.dtype(np.float32)
+RGB_DTYPE = np.dtype(np.uint8)
+
+
+def point_size(point_dtype):
+    """
+    Returns the bytes used by a point in a batch, with the attributes of point_dtype
+    (see py3dtiles.points.point_attributes)
+    """
+    return 3 * XYZ_DTYPE.itemsize + point_dtype.itemsize
+
+
+def _has_room_for(size):
+    # writing in a segment larger than the free space of the tmpfs kills the process with a SIGBUS
+    try:
+        return shutil.disk_usage(SHARED_MEMORY_FOLDER).free > 2 * size
+    except OSError:
+        return True
+
+
+def make_segment_prefix():
+    """
+    Returns a new prefix for the names of the segments of a conversion.
+    It's short because macOS limits the names to 31 characters.
+    """
+    return 'p3d{}_'.format(secrets.token_hex(4))
+
+
+def set_segment_prefix(prefix):
+    """
+    Name the segments created by this process with prefix, so the conversion can measure them
+    with shared_memory_usage
+    """
+    global _segment_prefix
+    _segment_prefix = prefix
+
+
+def shared_memory_usage(prefix):
+    """
+    Returns the bytes used by the segments whose name starts with prefix, i.e. the ones
+    created and not freed yet by the processes of a conversion.
+    """
+    usage = 0
+    try:
+        with os.scandir(SHARED_MEMORY_FOLDER) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix):
+                    try:
+                        usage += entry.stat().st_size
+                    except FileNotFoundError:
+                        # freed meanwhile
+                        pass
+    except OSError:
+        pass
+    return usage
+
+
+def _views(buffer, count, width):
+    xyz = np.ndarray((count, 3), dtype=XYZ_DTYPE, buffer=buffer)
+    rgb = np.ndarray((count, width), dtype=RGB_DTYPE, buffer=buffer, offset=xyz.nbytes)
+    return xyz, rgb
+
+
+def _descriptor(data):
+    # descriptors are tiny, don't unpickle big batches just to know they aren't one
+    if len(data) > 1024:
+        return None
+    points = pickle.loads(data)
+    return points if 'shm' in points else None
+
+
+def start_resource_tracker():
+    """
+    Start the resource tracker before the workers, so they all share it. Otherwise a segment
+    created by a worker and freed by another one is reported as leaked.
+    """
+    if resource_tracker is not None:
+        resource_tracker.ensure_running()
+
+
+def dumps_points(xyz, rgb, use_shared_memory):
+    """
+    Serialize a batch of points, in a shared memory segment if use_shared_memory is True
+    and the batch is big enough.
+    """
+    count = len(xyz)
+    width = rgb.shape[1]
+    size = count * (3 * XYZ_DTYPE.itemsize + width * RGB_DTYPE.itemsize)
+    if (use_shared_memory and shared_memory is not None
+            and count >= SHARED_MEMORY_MIN_POINTS and _has_room_for(size)):
+        try:
+            name = None if _segment_prefix is None else _segment_prefix + secrets.token_hex(4)
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except OSError:
+            pass
+        else:
+            shared_xyz, shared_rgb = _views(segment.buf, count, width)
+            shared_xyz[:] = xyz
+            shared_rgb[:] = rgb
+            del shared_xyz, shared_rgb
+            segment.close()
+            return pickle.dumps({'shm': segment.name, 'count': count, 'width': width, 'size': size})
+
+    return pickle.dumps({'xyz': xyz, 'rgb': rgb})
+
+
+def loads_points(data):
+    """
+    Deserialize a batch serialized by dumps_points, and free its shared memory segment.
+
+    Returns a tuple (xyz, rgb)
+    """
+    points = pickle.loads(data)
+    if 'shm' not in points:
+        return points['xyz'], points['rgb']
+
+    segment = shared_memory.SharedMemory(name=points['shm'])
+    shared_xyz, shared_rgb = _views(segment.buf, points['count'], points['width'])
+    xyz, rgb = shared_xyz.copy(), shared_rgb.copy()
+    del shared_xyz, shared_rgb
+    segment.close()
+    segment.unlink()
+    return xyz, rgb
+
+
+def inline_points(data):
+    """
+    Return a serialized batch that doesn't depend on a shared memory segment,
+    without freeing the segment. Used to persist a batch outside of the running conversion.
+    """
+    points = _descriptor(data)
+    if points is None:
+        return data
+
+    segment = shared_memory.SharedMemory(name=points['shm'])
+    shared_xyz, shared_rgb = _views(segment.buf, points['count'], points['width'])
+    data = pickle.dumps({'xyz': shared_xyz.copy(), 'rgb': shared_rgb.copy()})
+    del shared_xyz, shared_rgb
+    segment.close()
+    return data
+
+
+def detach_points(data):
+    """
+    Same as inline_points, but also free the shared memory segment.
+    """
+    if _descriptor(data) is None:
+        return data
+    return dumps_points(*loads_points(data), use_shared_memory=False)
@@ -1,6 +1,5 @@
 import json
 import math
-import pickle
 import struct
 import subprocess
 import traceback
@@ -8,20 +7,73 @@ import traceback
 import laspy
 import numpy as np
 
+from py3dtiles.feature_table import oct_encode
+from py3dtiles.points.point_attributes import pack_point_attributes
+from py3dtiles.points.shared_points import dumps_points
 from py3dtiles.points.utils import ResponseType
 from py3dtiles.utils import SrsInMissingException
 
+# number of points of the portions read by each job
+PORTION_SIZE = 1_000_000
+LAZ_VARIABLE_CHUNK_SIZE = 0xFFFFFFFF
+# the usual names of the extra bytes of the normals, in lower case
+NORMAL_DIMENSIONS = [('normal_x', 'normal_y', 'normal_z'), ('normalx', 'normaly', 'normalz'), ('nx', 'ny', 'nz')]
+# the distance along the normals of the points transformed to get the transformed normals, in the input srs units
+NORMAL_STEP = 0.01
+
+# A worker keeps the last file it read open, so it can read the next portion
+# without opening the file again, and without seeking if the portion follows the previous one.
+_opened_file = None
+
+
+def _laz_chunk_size(header):
+    """
+    Returns the number of points of each chunk of a laz file,
+    None if the file isn't compressed or if its chunks have variable sizes.
+    """
+    try:
+        laszip_vlr = header.vlrs.get('LasZipVlr')[0]
+    except IndexError:
+        return None
+    # compressor (u16), coder (u16), version (u8, u8, u16), options (u32), chunk size (u32)
+    chunk_size = struct.unpack_from('<I', laszip_vlr.record_data, 12)[0]
+    return None if chunk_size == LAZ_VARIABLE_CHUNK_SIZE else chunk_size
+
+
+def _open(filename):
+    global _opened_file
+    if _opened_file is not None and _opened_file[0] != filename:
+        close()
+    if _opened_file is None:
+        _opened_file = (filename, laspy.open(filename))
+    return _opened_file[1]
+
+
+def close():
+    """
+    Close the file kept open by run
+    """
+    global _opened_file
+    if _opened_file is not None:
+        _opened_file[1].close()
+        _opened_file = None
+
 
 def init(files, color_scale=None, srs_in=None, srs_out=None, fraction=100):
     aabb = None
     total_point_count = 0
     pointcloud_file_portions = []
+    # bounds of the points of each portion, the ones of its file
+    portion_aabbs = []
     avg_min = np.array([0., 0., 0.])
     color_scale_by_file = {}
 
     for filename in files:
         try:
             with laspy.open(filename) as f:
+                # must be read before the points, laspy removes the vlr when it starts decompressing
+                chunk_size = _laz_chunk_size(f.header)
+
                 avg_min += (np.array(f.header.mins) / len(files))
 
                 if aabb is None:
@@ -45,11 +97,17 @@ def init(files, color_scale=None, srs_in=None, srs_out=None, fraction=100):
                     # the intensity is then used as color
                     color_scale_by_file[filename] = 1.0 / 255
 
-                _1M = min(count, 1_000_000)
-                steps = math.ceil(count / _1M)
-                portions = [(i * _1M, min(count, (i + 1) * _1M)) for i in range(steps)]
+                portion_size = PORTION_SIZE
+                if chunk_size:
+                    # align the portions on the laz chunks, so a reader seeking
+                    # to a portion doesn't decompress the points before it
+                    portion_size = max(1, round(PORTION_SIZE / chunk_size)) * chunk_size
+                portion_size = min(count, portion_size)
+                steps = math.ceil(count / portion_size)
+                portions = [(i * portion_size, min(count, (i + 1) * portion_size)) for i in range(steps)]
                 for p in portions:
                     pointcloud_file_portions += [(filename, p)]
+                    portion_aabbs.append(np.array([f.header.mins, f.header.maxs]))
 
                 if srs_out and not srs_in:
                     output = subprocess.check_output(['pdal', 'info', '--summary', filename])
@@ -65,6 +123,7 @@ def init(files, color_scale=None, srs_in=None, srs_out=None, fraction=100):
 
     return {
         'portions': pointcloud_file_portions,
+        'portion_aabbs': portion_aabbs,
         'aabb': aabb,
         'color_scale': color_scale_by_file,
         'srs_in': srs_in,
@@ -73,80 +132,121 @@ def init(files, color_scale=None, srs_in=None, srs_out=None, fraction=100):
     }
 
 
-def run(filename, offset_scale, portion, queue, transformer, verbose):
+def _normal_dimensions(dimension_names):
     """
-    Reads points from a las file
+    Returns the names of the dimensions of the normals (extra bytes), or None if the points have no normals
     """
-    try:
-        with laspy.open(filename) as f:
-
-            point_count = portion[1] - portion[0]
-
-            step = min(point_count, max(point_count // 10, 100_000))
+    names = {name.lower().replace(' ', '_'): name for name in dimension_names}
+    for candidate in NORMAL_DIMENSIONS:
+        if all(name in names for name in candidate):
+            return [names[name] for name in candidate]
+    return None
 
-            indices = [i for i in range(math.ceil(point_count / step))]
 
-            color_scale = offset_scale[3]
-
-            for index in indices:
-                start_offset = portion[0] + index * step
-                num = min(step, portion[1] - start_offset)
-
-                # read scaled values and apply offset
-                f.seek(start_offset)
-                points = next(f.chunk_iterator(num))
-
-                x, y, z = points.x, points.y, points.z
-                if transformer:
-                    x, y, z = transformer.transform(x, y, z)
-
-                x = (x + offset_scale[0][0]) * offset_scale[1][0]
-                y = (y + offset_scale[0][1]) * offset_scale[1][1]
-                z = (z + offset_scale[0][2]) * offset_scale[1][2]
-
-                coords = np.vstack((x, y, z)).transpose()
-
-                if offset_scale[2] is not None:
-                    # Apply transformation matrix (because the tile's transform will contain
-                    # the inverse of this matrix)
-                    coords = np.dot(coords, offset_scale[2])
-
-                coords = np.ascontiguousarray(coords.astype(np.float32))
-
-                # Read colors
-
-                # todo: attributes
-                if 'red' in f.header.point_format.dimension_names:
-                    red = points['red']
-                    green = points['green']
-                    blue = points['blue']
-                else:
-                    red = points['intensity']
-                    green = points['intensity']
-                    blue = points['intensity']
-
-                if not color_scale:
-                    red = red.astype(np.uint8)
-                    green = green.astype(np.uint8)
-                    blue = blue.astype(np.uint8)
-                else:
-                    red = (red * color_scale).astype(np.uint8)
-                    green = (green * color_scale).astype(np.uint8)
-                    blue = (blue * color_scale).astype(np.uint8)
-
-                colors = np.vstack((red, green, blue)).transpose()
+def _transform_normals(transformer, x, y, z, transformed, normals):
+    """
+    Returns the normals of the points x, y, z in the output srs of transformer: the direction from the
+    transformed points to the transformed points moved along their normal
+    """
+    moved = transformer.transform(*(np.array([x, y, z]) + NORMAL_STEP * normals.T))
+    normals = np.column_stack(moved) - np.column_stack(transformed)
+    return normals / np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, np.newaxis]
 
-                queue.send_multipart(
-                    [
-                        ResponseType.NEW_TASK.value,
-                        ''.encode('ascii'),
-                        pickle.dumps({'xyz': coords, 'rgb': colors}),
-                        struct.pack('>I', len(coords))
-                    ], copy=False)
 
-            queue.send_multipart([ResponseType.READ.value])
+def run(filename, offset_scale, portion, queue, transformer, verbose, use_shared_memory=False, point_dtype=None):
+    """
+    Reads points from a las file, with the attributes of point_dtype
+    """
+    try:
+        f = _open(filename)
+        dimension_names = list(f.header.point_format.dimension_names)
+        normal_dimensions = _normal_dimensions(dimension_names)
+
+        point_count = portion[1] - portion[0]
+
+        step = min(point_count, max(point_count // 10, 100_000))
+
+        indices = [i for i in range(math.ceil(point_count / step))]
+
+        color_scale = offset_scale[3]
+
+        # the portions of a file are usually read in order, so there's often nothing to seek
+        if f.points_read != portion[0]:
+            f.seek(portion[0])
+
+        for index in indices:
+            start_offset = portion[0] + index * step
+            num = min(step, portion[1] - start_offset)
+
+            # read scaled values and apply offset
+            points = f.read_points(num)
+
+            x, y, z = points.x, points.y, points.z
+            normals = None
+            if point_dtype is not None and 'normal' in point_dtype.names and normal_dimensions:
+                normals = np.vstack([points[name] for name in normal_dimensions]).transpose()
+            if transformer:
+                transformed = transformer.transform(x, y, z)
+                if normals is not None:
+                    normals = _transform_normals(transformer, x, y, z, transformed, normals)
+                x, y, z = transformed
+
+            x = (x + offset_scale[0][0]) * offset_scale[1][0]
+            y = (y + offset_scale[0][1]) * offset_scale[1][1]
+            z = (z + offset_scale[0][2]) * offset_scale[1][2]
+
+            coords = np.vstack((x, y, z)).transpose()
+
+            if offset_scale[2] is not None:
+                # Apply transformation matrix (because the tile's transform will contain
+                # the inverse of this matrix)
+                coords = np.dot(coords, offset_scale[2])
+
+            coords = np.ascontiguousarray(coords.astype(np.float32))
+
+            # Read colors
+
+            if 'red' in dimension_names:
+                red = points['red']
+                green = points['green']
+                blue = points['blue']
+            else:
+                red = points['intensity']
+                green = points['intensity']
+                blue = points['intensity']
+
+            if not color_scale:
+                red = red.astype(np.uint8)
+                green = green.astype(np.uint8)
+                blue = blue.astype(np.uint8)
+            else:
+                red = (red * color_scale).astype(np.uint8)
+                green = (green * color_scale).astype(np.uint8)
+                blue = (blue * color_scale).astype(np.uint8)
+
+            colors = np.vstack((red, green, blue)).transpose()
+
+            values = {}
+            if point_dtype is not None:
+                values = {name: points[name] for name in point_dtype.names if name in dimension_names}
+                if normals is not None:
+                    if offset_scale[2] is not None:
+                        normals = np.dot(normals, offset_scale[2])
+                    values['normal'] = oct_encode(normals)
+            colors = pack_point_attributes(point_dtype, colors, values)
+
+            queue.send_multipart(
+                [
+                    ResponseType.NEW_TASK.value,
+                    ''.encode('ascii'),
+                    dumps_points(coords, colors, use_shared_memory),
+                    struct.pack('>I', len(coords))
+                ], copy=False)
+
+        queue.send_multipart([ResponseType.READ.value, struct.pack('>I', point_count)])
 
     except Exception as e:
+        close()
         print('Exception while reading points from las file')
         print(e)
         traceback.print_exc()
@@ -5,13 +5,14 @@ import time
 import traceback
 
 from py3dtiles.points.node_catalog import NodeCatalog
+from py3dtiles.points.shared_points import loads_points
 from py3dtiles.points.utils import ResponseType
 
 
-def _forward_unassigned_points(node, queue, log_file):
+def _forward_unassigned_points(node, queue, use_shared_memory, log_file):
     total = 0
 
-    result = node.dump_pending_points()
+    result = node.dump_pending_points(use_shared_memory)
 
     for r in result:
         if len(r) > 0:
@@ -27,11 +28,11 @@ def _forward_unassigned_points(node, queue, log_file):
     return total
 
 
-def _flush(node_catalog, scale, node, queue, max_depth=1, force_forward=False, log_file=None, depth=0):
+def _flush(node_catalog, scale, node, queue, max_depth=1, force_forward=False, use_shared_memory=False, log_file=None, depth=0):
     if depth >= max_depth:
         threshold = 0 if force_forward else 10_000
         if node.get_pending_points_count() > threshold:
-            return _forward_unassigned_points(node, queue, log_file)
+            return _forward_unassigned_points(node, queue, use_shared_memory, log_file)
         else:
             return 0
 
@@ -44,7 +45,9 @@ def _flush(node_catalog, scale, node, queue, max_depth=1, force_forward=False, l
         # release node
         del node
         for name in children:
-            total += _flush(node_catalog, scale, node_catalog.get_node(name), queue, max_depth, force_forward, log_file, depth + 1)
+            total += _flush(
+                node_catalog, scale, node_catalog.get_node(name), queue,
+                max_depth, force_forward, use_shared_memory, log_file, depth + 1)
 
     return total
 
@@ -70,7 +73,7 @@ def _balance(node_catalog, node, max_depth=1, depth=0):
                 depth + 1)
 
 
-def _process(nodes, octree_metadata, name, raw_datas, queue, begin, log_file):
+def _process(nodes, octree_metadata, name, raw_datas, queue, begin, use_shared_memory, log_file):
     node_catalog = NodeCatalog(nodes, name, octree_metadata)
 
     log_enabled = log_file is not None
@@ -99,9 +102,9 @@ def _process(nodes, octree_metadata, name, raw_datas, queue, begin, log_file):
         if log_enabled:
             print('  -> read source [{}]'.format(time.time() - begin), file=log_file, flush=True)
 
-        data = pickle.loads(raw_data)
+        xyz, rgb = loads_points(raw_data)
 
-        point_count = len(data['xyz'])
+        point_count = len(xyz)
 
         if log_enabled:
             print('  -> insert {} [{} points]/ {} files [{}]'.format(
@@ -109,7 +112,7 @@ def _process(nodes, octree_metadata, name, raw_datas, queue, begin, log_file):
                 len(raw_datas), time.time() - begin), file=log_file, flush=True)
 
         # insert points in node (no children handling here)
-        node.insert(node_catalog, octree_metadata.scale, data['xyz'], data['rgb'], halt_at_depth == 0)
+        node.insert(node_catalog, octree_metadata.scale, xyz, rgb, halt_at_depth == 0)
 
         total += point_count
 
@@ -117,7 +120,9 @@ def _process(nodes, octree_metadata, name, raw_datas, queue, begin, log_file):
             print('  -> _flush [{}]'.format(time.time() - begin), file=log_file, flush=True)
         # _flush push pending points (= call insert) from level N to level N + 1
         # (_flush is recursive)
-        written = _flush(node_catalog, octree_metadata.scale, node, queue, halt_at_depth - 1, index == len(raw_datas) - 1, log_file)
+        written = _flush(
+            node_catalog, octree_metadata.scale, node, queue,
+            halt_at_depth - 1, index == len(raw_datas) - 1, use_shared_memory, log_file)
         total -= written
 
         index += 1
@@ -139,7 +144,7 @@ def _process(nodes, octree_metadata, name, raw_datas, queue, begin, log_file):
     return total, data
 
 
-def run(work, octree_metadata, queue, verbose):
+def run(work, octree_metadata, queue, verbose, use_shared_memory=False):
     try:
         begin = time.time()
         log_enabled = verbose >= 2
@@ -158,13 +163,15 @@ def run(work, octree_metadata, queue, verbose):
             count = struct.unpack('>I', work[i + 2])[0]
             filenames = work[i + 3:i + 3 + count]
             i += 3 + count
-            result, data = _process(node, octree_metadata, name, filenames, queue, begin, log_file)
+            node_begin = time.time()
+            result, data = _process(node, octree_metadata, name, filenames, queue, begin, use_shared_memory, log_file)
             total += result
 
             queue.send_multipart([ResponseType.PROCESSED.value, pickle.dumps({
                 'name': name,
                 'total': result,
                 'save': data,
+                'duration': time.time() - node_begin,
             })], copy=False)
 
         if log_enabled:
@@ -6,35 +6,113 @@ import lz4.frame as gzip
 import numpy as np
 
 import py3dtiles
-from py3dtiles.points.utils import ResponseType, name_to_filename
+from py3dtiles.feature_table import QUANTIZED_MAX
+from py3dtiles.points.point_attributes import EXTRA_ATTRIBUTES, make_point_dtype
+from py3dtiles.points.utils import ResponseType, loads_node_bytes, name_to_filename
+
+# the tiles with less points are merged in their parent tile
+MIN_TILE_POINT_COUNT = 100
 
 
 class _DummyNode:
     def __init__(self, _bytes):
-        if 'children' in _bytes:
-            self.children = _bytes['children']
-            self.grid = _bytes['grid']
-        else:
-            self.children = None
-            self.points = _bytes['points']
-
-
-def points_to_pnts(name, points, out_folder, include_rgb):
-    count = int(len(points) / (3 * 4 + (3 if include_rgb else 0)))
+        # only the points are needed
+        kind, children, cell_count, cell_points, xyz, rgb = py3dtiles.points.node.unpack_node(_bytes)
+        self.children = None
+        self.points = [(xyz, rgb)]
+
+    def point_count(self):
+        return sum([len(xyz) for xyz, rgb in self.points])
+
+    def aabb(self):
+        xyz = np.concatenate([xyz for xyz, rgb in self.points])
+        return np.array([np.amin(xyz, axis=0), np.amax(xyz, axis=0)])
+
+
+def _merge_small_children(nodes):
+    """
+    Merge the small nodes in their parent, if it's in nodes too, from the top of the tree.
+    The children of the merged nodes are still written but they're not part of the tileset.
+    """
+    for name in sorted(nodes, key=len):
+        node = nodes.get(name)
+        if node is None or not node.point_count():
+            continue
+        for child in b'01234567':
+            child_name = name + bytes([child])
+            child_node = nodes.get(child_name)
+            if child_node is not None and 0 < child_node.point_count() < MIN_TILE_POINT_COUNT:
+                node.points += child_node.points
+                del nodes[child_name]
+
+
+def quantize_positions(xyz):
+    """
+    Quantize the positions on 16 bits in their bounding box.
+
+    Returns the quantized positions, the offset and the scale of the box
+    """
+    xyz = xyz.astype(np.float64)
+    offset = np.amin(xyz, axis=0)
+    scale = np.amax(xyz, axis=0) - offset
+    # the positions along a flat axis are all 0
+    factor = np.divide(QUANTIZED_MAX, scale, out=np.zeros(3), where=scale > 0)
+    return np.round((xyz - offset) * factor).astype(np.uint16), offset, scale
+
+
+def points_to_pnts(name, points, out_folder, include_rgb, quantize=False, draco=False, point_dtype=None):
+    """
+    Write the points in a pnts file. points holds the positions (float32) of the points, then their attributes:
+    a row of point_dtype per point (see py3dtiles.points.point_attributes), or their colors if point_dtype
+    is None and include_rgb is True. The normals are written in the feature table, the extra attributes in
+    the batch table. With draco, they're all compressed in the draco buffer.
+    """
+    if point_dtype is None:
+        point_dtype = make_point_dtype() if include_rgb else np.dtype([])
+    count = int(len(points) / (3 * 4 + point_dtype.itemsize))
 
     if count == 0:
         return 0, None
 
     pdt = np.dtype([('X', '<f4'), ('Y', '<f4'), ('Z', '<f4')])
     cdt = np.dtype([('Red', 'u1'), ('Green', 'u1'), ('Blue', 'u1')]) if include_rgb else None
+    ndt = None
+
+    positions = points[:count * pdt.itemsize]
+    attributes = points[count * pdt.itemsize:].view(point_dtype) if point_dtype.itemsize else None
+    arrays = [positions]
+    if include_rgb:
+        arrays.append(attributes['rgb'].ravel())
+    if 'normal' in point_dtype.names:
+        ndt = np.dtype([('X', 'u1'), ('Y', 'u1')])
+        arrays.append(attributes['normal'].ravel())
+
+    # draco quantizes the positions itself
+    if quantize and not draco:
+        quantized, offset, scale = quantize_positions(positions.view(np.float32).reshape((count, 3)))
+        arrays[0] = quantized.view(np.uint8).ravel()
+        pdt = np.dtype([('X', '<u2'), ('Y', '<u2'), ('Z', '<u2')])
 
     ft = py3dtiles.feature_table.FeatureTable()
-    ft.header = py3dtiles.feature_table.FeatureTableHeader.from_dtype(pdt, cdt, count)
-    ft.body = py3dtiles.feature_table.FeatureTableBody.from_array(ft.header, points)
+    ft.header = py3dtiles.feature_table.FeatureTableHeader.from_dtype(pdt, cdt, count, ndt)
+    if quantize and not draco:
+        ft.header.quantized_volume_offset = offset.tolist()
+        ft.header.quantized_volume_scale = scale.tolist()
+    ft.body = py3dtiles.feature_table.FeatureTableBody.from_array(ft.header, np.concatenate(arrays))
 
     body = py3dtiles.pnts.PntsBody()
     body.feature_table = ft
 
+    extra_attributes = [name for name in point_dtype.names if name in EXTRA_ATTRIBUTES]
+    if extra_attributes:
+        body.batch_table = py3dtiles.batch_table.BatchTable()
+        for attribute in extra_attributes:
+            body.batch_table.add_binary_property_from_array(attribute, attributes[attribute])
+
+    if draco:
+        # the attributes of the batch table are compressed with the points, that draco reorders
+        ft.compress(batch_table=body.batch_table)
+
     tile = py3dtiles.tile_content.TileContent()
     tile.body = body
     tile.header = py3dtiles.pnts.PntsHeader()
@@ -50,19 +128,33 @@ def points_to_pnts(name, points, out_folder, include_rgb):
     return count, filename
 
 
-def node_to_pnts(name, node, out_folder, include_rgb):
-    points = py3dtiles.points.node.Node.get_points(node, include_rgb)
-    return points_to_pnts(name, points, out_folder, include_rgb)
+def node_to_pnts(name, node, out_folder, include_rgb, quantize=False, draco=False, point_dtype=None):
+    # the colors are also needed to get the other attributes
+    include_attributes = include_rgb or (point_dtype is not None and point_dtype.names != ('rgb',))
+    points = py3dtiles.points.node.Node.get_points(node, include_attributes)
+    return points_to_pnts(name, points, out_folder, include_rgb, quantize, draco,
+                          point_dtype if include_attributes else None)
 
 
-def run(sender, data, node_name, folder, write_rgb):
+def run(sender, data, node_name, folder, write_rgb, quantize=False, draco=False, point_dtype=None):
     # we can safely write the .pnts file
     if len(data):
-        root = pickle.loads(gzip.decompress(data))
+        root = loads_node_bytes(gzip.decompress(data))
         # print('write ', node_name.decode('ascii'))
-        total = 0
-        for name in root:
-            node = _DummyNode(pickle.loads(root[name]))
-            total += node_to_pnts(name, node, folder, write_rgb)[0]
+        nodes = {name: _DummyNode(root[name]) for name in root}
+        _merge_small_children(nodes)
 
-        sender.send_multipart([ResponseType.PNTS_WRITTEN.value, struct.pack('>I', total), node_name])
+        total = 0
+        # name -> (point count, aabb of the points), used to build the tileset without reading the tiles
+        written_tiles = {}
+        for name, node in nodes.items():
+            count = node_to_pnts(name, node, folder, write_rgb, quantize, draco, point_dtype)[0]
+            if count > 0:
+                written_tiles[name] = (count, node.aabb())
+            total += count
+
+        sender.send_multipart([
+            ResponseType.PNTS_WRITTEN.value,
+            struct.pack('>I', total),
+            node_name,
+            pickle.dumps(written_tiles)])
@@ -1,70 +1,202 @@
 import numpy as np
-import math
+import os
 import traceback
 import struct
-import pickle
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 
+from py3dtiles.points.point_attributes import pack_point_attributes
+from py3dtiles.points.shared_points import dumps_points
 from py3dtiles.points.utils import ResponseType
 
+# number of points of the portions read by each job
+PORTION_SIZE = 1_000_000
+# size of the blocks of text parsed at once
+BLOCK_SIZE = 8 * 1024 * 1024
+SAMPLE_SIZE = 1024 * 1024
+
+# x, y and z are mandatory, i is the intensity, r, g and b the colors and _ an ignored column
+COLUMN_NAMES = 'xyzirgb_'
+# layouts used when the columns aren't specified, by number of columns (see run)
+DEFAULT_COLUMNS = {
+    3: 'xyz',
+    4: 'xyzi',
+    6: 'xyzrgb',
+    7: 'xyzirgb',
+}
+
+
+def _invalid_line(lines, columns, delimiter):
+    for line in lines:
+        if not line.strip():
+            continue
+        fields = line.split(delimiter.encode() if delimiter else None)
+        try:
+            [float(field) for field in fields]
+        except ValueError:
+            return line
+        if len(fields) != len(columns):
+            return line
+    return None
 
-def init(files, color_scale=None, srs_in=None, srs_out=None, fraction=100):
-    aabb = None
-    total_point_count = 0
-    pointcloud_file_portions = []
 
-    for filename in files:
+def _parse(data, columns, delimiter):
+    """
+    Parse a block of complete lines into a (point count, len(columns)) array.
+    Raises a ValueError if a value isn't a number, or if the value count doesn't match the lines.
+    """
+    text = data.replace(delimiter.encode(), b' ') if delimiter else data
+    with warnings.catch_warnings():
+        # fromstring stops, with only a warning, at the first value that isn't a number
+        warnings.simplefilter('error', DeprecationWarning)
         try:
-            f = open(filename)
-        except Exception as e:
-            print(f"Error opening {filename}. Skipping.")
-            print(e)
-            continue
+            values = np.fromstring(text, dtype=np.float64, sep=' ')
+        except DeprecationWarning:
+            values = None
+
+    line_count = data.count(b'\n') + (not data.endswith(b'\n'))
+    if (values is None or values.size != line_count * len(columns)
+            or (delimiter and data.count(delimiter.encode()) != line_count * (len(columns) - 1))):
+        # slower check, only if there are blank lines or invalid lines
+        lines = data.split(b'\n')
+        line = _invalid_line(lines, columns, delimiter)
+        if line is not None or values is None or values.size != sum(1 for line in lines if line.strip()) * len(columns):
+            line = (line or data[:100]).decode(errors='replace').strip()
+            raise ValueError(f"Cannot read the line '{line}' with the columns '{columns}'")
+    return values.reshape((-1, len(columns)))
+
+
+def _read_points(f, start, end, columns, delimiter):
+    """
+    Yields the points of the lines between the offsets start and end, in blocks of BLOCK_SIZE bytes.
+    start and end must be at the beginning of a line.
+    """
+    f.seek(start)
+    remaining = end - start
+    leftover = b''
+    while remaining > 0:
+        data = f.read(min(BLOCK_SIZE, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        data = leftover + data
+        if remaining > 0:
+            # only parse complete lines, the last one is completed by the next block
+            cut = data.rfind(b'\n') + 1
+            data, leftover = data[:cut], data[cut:]
+        points = _parse(data, columns, delimiter)
+        if len(points):
+            yield points
+
+
+def _layout(filename, delimiter, columns):
+    """
+    Read the first lines of a file to find where the points begin and how they are written.
 
-        count = 0
-        seek_values = []
-        while True:
-            batch = 10_000
-            points = np.zeros((batch, 3))
+    Returns a tuple (offset of the first point, bytes per line, columns, delimiter)
+    """
+    with open(filename, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+
+    lines = sample.split(b'\n')
+    data_start = 0
+    first_line = lines[0].decode().strip()
+    if delimiter is None:
+        # csv-like files, otherwise the values are separated by whitespaces
+        delimiter = next((d for d in ',;' if d in first_line), None)
 
+    fields = first_line.split(delimiter)
+    try:
+        [float(field) for field in fields]
+    except ValueError:
+        # a header line with the column names
+        data_start = len(lines[0]) + 1
+        fields = lines[1].decode().strip().split(delimiter)
+
+    if columns is None:
+        if len(fields) not in DEFAULT_COLUMNS:
+            raise ValueError(
+                f"Cannot guess the columns of '{filename}' ({len(fields)} values per line), "
+                "please use the --columns option to declare them.")
+        columns = DEFAULT_COLUMNS[len(fields)]
+    elif any(c not in COLUMN_NAMES for c in columns) or any(c not in columns for c in 'xyz'):
+        raise ValueError(f"Invalid columns '{columns}': use x, y, z (mandatory), i, r, g, b, or _ to ignore a column")
+    elif len(columns) != len(fields):
+        raise ValueError(f"'{filename}' has {len(fields)} values per line but the columns are '{columns}'")
+
+    line_count = max(1, sample.count(b'\n', data_start))
+    bytes_per_line = (len(sample) - data_start) / line_count
+
+    return data_start, bytes_per_line, columns, delimiter
+
+
+def _split(filename, start, range_size):
+    """
+    Split the file from start in ranges of about range_size bytes, ending at line breaks.
+    """
+    file_size = os.path.getsize(filename)
+    offsets = [start]
+    with open(filename, 'rb') as f:
+        offset = start + range_size
+        while offset < file_size:
+            f.seek(offset)
+            f.readline()
             offset = f.tell()
-            for i in range(batch):
-                line = f.readline()
-                if not line:
-                    points = np.resize(points, (i, 3))
-                    break
-                points[i] = [float(s) for s in line.split(" ")][:3]
-
-            if points.shape[0] == 0:
+            if offset >= file_size:
                 break
+            offsets.append(offset)
+            offset += range_size
+    return list(zip(offsets, offsets[1:] + [file_size]))
 
-            if not count % 1_000_000:
-                seek_values += [offset]
-
-            count += points.shape[0]
-            batch_aabb = np.array([
-                np.min(points, axis=0), np.max(points, axis=0)
-            ])
 
-            # Update aabb
+def _scan(filename, start, end, columns, delimiter):
+    """
+    Returns the point count and the aabb of the lines between start and end
+    """
+    count = 0
+    aabb = None
+    xyz_indices = [columns.index(c) for c in 'xyz']
+    with open(filename, 'rb') as f:
+        for points in _read_points(f, start, end, columns, delimiter):
+            xyz = points[:, xyz_indices]
+            count += len(xyz)
+            batch_aabb = np.array([np.min(xyz, axis=0), np.max(xyz, axis=0)])
             if aabb is None:
                 aabb = batch_aabb
             else:
                 aabb[0] = np.minimum(aabb[0], batch_aabb[0])
                 aabb[1] = np.maximum(aabb[1], batch_aabb[1])
+    return count, aabb
 
-        # We need an exact point count
-        total_point_count += count * fraction / 100
 
-        _1M = min(count, 1_000_000)
-        steps = math.ceil(count / _1M)
-        if steps != len(seek_values):
-            raise ValueError("the size of seek_values should be equal to steps,"
-                             f"currently steps = {steps} and len(seek_values) = {len(seek_values)}")
-        portions = [
-            (i * _1M, min(count, (i + 1) * _1M), seek_values[i]) for i in range(steps)
-        ]
-        for p in portions:
-            pointcloud_file_portions += [(filename, p)]
+def init(files, color_scale=None, srs_in=None, srs_out=None, fraction=100, jobs=1, delimiter=None, columns=None,
+         aabb=None):
+    """
+    Computes the portions, the point count and the aabb of text files.
+
+    The files are split in byte ranges that are scanned in parallel by jobs processes.
+    If the aabb is given, the files aren't scanned and the point counts are
+    estimated from the size of the ranges: the readers report the exact counts.
+    """
+    if aabb is not None:
+        aabb = np.array(aabb, dtype=np.float64).reshape((2, 3))
+        scan_aabb = False
+    else:
+        scan_aabb = True
+    total_point_count = 0
+    pointcloud_file_portions = []
+    # bounds of the points of each portion, unknown if the files aren't scanned
+    portion_aabbs = []
+
+    ranges = []
+    estimated_counts = []
+    for filename in files:
+        try:
+            data_start, bytes_per_line, file_columns, file_delimiter = _layout(filename, delimiter, columns)
+        except OSError as e:
+            print(f"Error opening {filename}. Skipping.")
+            print(e)
+            continue
 
         if srs_out and not srs_in:
             raise Exception(
@@ -72,21 +204,59 @@ def init(files, color_scale=None, srs_in=None, srs_out=None, fraction=100):
                 "Please use the --srs_in option to declare it."
             )
 
+        range_size = max(1, int(PORTION_SIZE * bytes_per_line))
+        for start, end in _split(filename, data_start, range_size):
+            ranges.append((filename, start, end, file_columns, file_delimiter))
+            if not scan_aabb:
+                # a short range still holds a line, only the scanned ranges are known to be empty
+                estimated_counts.append(max(1, round((end - start) / bytes_per_line)))
+
+    if not scan_aabb:
+        scans = [(count, None) for count in estimated_counts]
+    elif jobs > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            scans = list(executor.map(_scan, *zip(*ranges)))
+    else:
+        scans = [_scan(*r) for r in ranges]
+
+    file_point_count = {}
+    for (filename, start, end, file_columns, file_delimiter), (count, range_aabb) in zip(ranges, scans):
+        if not count:
+            continue
+        first = file_point_count.get(filename, 0)
+        file_point_count[filename] = first + count
+        pointcloud_file_portions.append(
+            (filename, (first, first + count, start, end, file_columns, file_delimiter)))
+        portion_aabbs.append(range_aabb)
+
+        if not scan_aabb:
+            continue
+        if aabb is None:
+            aabb = np.copy(range_aabb)
+        else:
+            aabb[0] = np.minimum(aabb[0], range_aabb[0])
+            aabb[1] = np.maximum(aabb[1], range_aabb[1])
+
+    total_point_count = sum(file_point_count.values()) * fraction / 100
+
     return {
         "portions": pointcloud_file_portions,
+        "portion_aabbs": portion_aabbs,
         "aabb": aabb,
-        "color_scale": color_scale,
+        "color_scale": {filename: color_scale for filename in files},
         "srs_in": srs_in,
         "point_count": total_point_count,
         "avg_min": aabb[0],
     }
 
 
-def run(filename, offset_scale, portion, queue, transformer, verbose):
+def run(filename, offset_scale, portion, queue, transformer, verbose, use_shared_memory=False, point_dtype=None):
     """
-    Reads points from a xyz file
+    Reads points from a xyz file, with the attributes of point_dtype (only the intensity can be read)
 
-    Consider XYZIRGB format following FME documentation(*). If the number of
+    The portion is a tuple (first point, last point, start offset, end offset, columns, delimiter)
+    where columns describes the values of a line, see COLUMN_NAMES. Without the --columns option,
+    the XYZIRGB format of the FME documentation(*) is assumed, and if the number of
     features does not correspond (i.e. does not equal to 7), we do the
     following hypothesis:
     - 3 features mean XYZ
@@ -96,67 +266,59 @@ def run(filename, offset_scale, portion, queue, transformer, verbose):
     (*) See: https://docs.safe.com/fme/html/FME_Desktop_Documentation/FME_ReadersWriters/pointcloudxyz/pointcloudxyz.htm
     """
     try:
-        f = open(filename, "r")
-
-        point_count = portion[1] - portion[0]
-
-        step = min(point_count, max((point_count) // 10, 100000))
-
-        f.seek(portion[2])
-
-        feature_nb = 7
-
-        for i in range(0, point_count, step):
-            points = np.zeros((step, feature_nb), dtype=np.float32)
-
-            for j in range(0, step):
-                line = f.readline()
-                if not line:
-                    points = np.resize(points, (j, feature_nb))
-                    break
-                line_features = [float(s) for s in line.split(" ")]
-                if len(line_features) == 3:
-                    line_features += [None] * 4  # Insert intensity and RGB
-                elif len(line_features) == 4:
-                    line_features += [None] * 3  # Insert RGB
-                elif len(line_features) == 6:
-                    line_features.insert(3, None)  # Insert intensity
-                points[j] = line_features
-
-            x, y, z = [points[:, c] for c in [0, 1, 2]]
-
-            if transformer:
-                x, y, z = transformer.transform(x, y, z)
-
-            x = (x + offset_scale[0][0]) * offset_scale[1][0]
-            y = (y + offset_scale[0][1]) * offset_scale[1][1]
-            z = (z + offset_scale[0][2]) * offset_scale[1][2]
-
-            coords = np.vstack((x, y, z)).transpose()
-
-            if offset_scale[2] is not None:
-                # Apply transformation matrix (because the tile's transform will contain
-                # the inverse of this matrix)
-                coords = np.dot(coords, offset_scale[2])
-
-            coords = np.ascontiguousarray(coords.astype(np.float32))
-
-            # Read colors: 3 last columns of the point cloud
-            colors = points[:, -3:].astype(np.uint8)
-
-            queue.send_multipart(
-                [
-                    ResponseType.NEW_TASK.value,
-                    "".encode("ascii"),
-                    pickle.dumps({"xyz": coords, "rgb": colors}),
-                    struct.pack(">I", len(coords)),
-                ],
-                copy=False,
-            )
-
-        queue.send_multipart([ResponseType.READ.value])
+        point_count = 0
+        start, end, columns, delimiter = portion[2:]
+        color_scale = offset_scale[3]
+        xyz_indices = [columns.index(c) for c in 'xyz']
+        rgb_indices = [columns.index(c) for c in 'rgb' if c in columns]
+
+        with open(filename, 'rb') as f:
+            for points in _read_points(f, start, end, columns, delimiter):
+                x, y, z = [points[:, c] for c in xyz_indices]
+
+                if transformer:
+                    x, y, z = transformer.transform(x, y, z)
+
+                x = (x + offset_scale[0][0]) * offset_scale[1][0]
+                y = (y + offset_scale[0][1]) * offset_scale[1][1]
+                z = (z + offset_scale[0][2]) * offset_scale[1][2]
+
+                coords = np.vstack((x, y, z)).transpose()
+
+                if offset_scale[2] is not None:
+                    # Apply transformation matrix (because the tile's transform will contain
+                    # the inverse of this matrix)
+                    coords = np.dot(coords, offset_scale[2])
+
+                coords = np.ascontiguousarray(coords.astype(np.float32))
+                point_count += len(coords)
+
+                # Read colors
+                if len(rgb_indices) == 3:
+                    colors = points[:, rgb_indices]
+                    if color_scale:
+                        colors = colors * color_scale
+                    colors = colors.astype(np.uint8)
+                else:
+                    colors = np.zeros((len(points), 3), dtype=np.uint8)
+
+                values = {}
+                if 'i' in columns:
+                    values['intensity'] = points[:, columns.index('i')]
+                colors = pack_point_attributes(point_dtype, colors, values)
+
+                queue.send_multipart(
+                    [
+                        ResponseType.NEW_TASK.value,
+                        "".encode("ascii"),
+                        dumps_points(coords, colors, use_shared_memory),
+                        struct.pack(">I", len(coords)),
+                    ],
+                    copy=False,
+                )
+
+        queue.send_multipart([ResponseType.READ.value, struct.pack('>I', point_count)])
 
-        f.close()
     except Exception as e:
         print("Exception while reading points from xyz file")
         print(e)
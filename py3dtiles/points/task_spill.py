@@ -0,0 +1,76 @@
+import os
+
+from py3dtiles.points.shared_points import detach_points
+from py3dtiles.points.utils import name_to_filename
+
+
+class TaskSpill:
+    """
+    Pending tasks written on disk, to bound the memory used by the tasks waiting in the manager.
+
+    The tasks of a node are appended to a segment file, and an in-memory index records their
+    position. They're read back, and the segment deleted, when the node is processed.
+
+    The segments are recorded relative to folder, so a checkpointed TaskSpill still works once the
+    output folder has moved: only folder has to be updated.
+    """
+
+    def __init__(self, folder, keep_consumed_segments=False):
+        self.folder = folder
+        # name -> (segment filename relative to folder, [(offset, length)], point count)
+        self.index = {}
+        # segments are never reused, so a checkpoint can keep referencing a consumed segment
+        self.segment_count = 0
+        # if True, the consumed segments are only deleted by commit_checkpoint
+        self.keep_consumed_segments = keep_consumed_segments
+        self.consumed_segments = []
+
+    def spill(self, name, tasks, point_count):
+        """
+        Append tasks (serialized points, see shared_points) of the node name to its segment
+        """
+        if name in self.index:
+            filename, positions, spilled_points = self.index[name]
+        else:
+            filename = os.path.relpath(name_to_filename(self.folder, name, f'.{self.segment_count}.tasks'), self.folder)
+            positions, spilled_points = [], 0
+            self.segment_count += 1
+
+        with open(os.path.join(self.folder, filename), 'ab') as f:
+            offset = f.tell()
+            for task in tasks:
+                data = detach_points(task)
+                f.write(data)
+                positions.append((offset, len(data)))
+                offset += len(data)
+
+        self.index[name] = (filename, positions, spilled_points + point_count)
+
+    def point_count(self, name):
+        return self.index[name][2] if name in self.index else 0
+
+    def task_count(self, name):
+        return len(self.index[name][1]) if name in self.index else 0
+
+    def load(self, name):
+        """
+        Returns the tasks spilled for the node name, and forget them
+        """
+        if name not in self.index:
+            return []
+
+        filename, positions, _ = self.index.pop(name)
+        with open(os.path.join(self.folder, filename), 'rb') as f:
+            data = f.read()
+        if self.keep_consumed_segments:
+            self.consumed_segments.append(filename)
+        else:
+            os.remove(os.path.join(self.folder, filename))
+        return [data[offset:offset + length] for offset, length in positions]
+
+    def commit_checkpoint(self):
+        for filename in self.consumed_segments:
+            filename = os.path.join(self.folder, filename)
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.consumed_segments = []
@@ -1,6 +1,7 @@
 from enum import Enum
 from io import StringIO
 from pathlib import Path, PurePath
+import struct
 
 import numpy as np
 
@@ -9,10 +10,12 @@ class CommandType(Enum):
     READ_FILE = b'read_file'
     WRITE_PNTS = b'write_pnts'
     PROCESS_JOBS = b'process_jobs'
+    CONFIGURE = b'configure'
     SHUTDOWN = b'shutdown'
 
 
 class ResponseType(Enum):
+    REGISTER = b'register'
     IDLE = b'idle'
     HALTED = b'halted'
     READ = b'read'
@@ -101,9 +104,67 @@ def make_aabb_cubic(aabb):
     return aabb
 
 
+# name length, data length
+NODE_FRAME = struct.Struct('<HI')
+# the node data are aligned, so their arrays can be used without copy
+NODE_ALIGNMENT = 8
+
+
+def dumps_node_bytes(node_bytes):
+    """
+    Serialize a dict node name -> serialized node in a single buffer
+    """
+    parts = []
+    offset = 0
+    for name, data in node_bytes.items():
+        offset += NODE_FRAME.size + len(name)
+        padding = -offset % NODE_ALIGNMENT
+        parts += [NODE_FRAME.pack(len(name), len(data)), name, bytes(padding), data]
+        offset += padding + len(data)
+    return b''.join(parts)
+
+
+def loads_node_bytes(data):
+    """
+    Return the dict node name -> serialized node of a buffer written by dumps_node_bytes.
+    The serialized nodes are views on data.
+    """
+    view = memoryview(data)
+    node_bytes = {}
+    offset = 0
+    while offset < len(view):
+        name_length, data_length = NODE_FRAME.unpack_from(view, offset)
+        offset += NODE_FRAME.size
+        name = bytes(view[offset:offset + name_length])
+        offset += name_length
+        offset += -offset % NODE_ALIGNMENT
+        node_bytes[name] = view[offset:offset + data_length]
+        offset += data_length
+    return node_bytes
+
+
 def node_from_name(name, parent_aabb, parent_spacing):
     from .node import Node
     spacing = parent_spacing * 0.5
     aabb = split_aabb(parent_aabb, int(name[-1])) if len(name) > 0 else parent_aabb
     #  let's build a new Node
     return Node(name, aabb, spacing)
+
+
+def point_to_node_name(point, root_aabb, depth):
+    """
+    Returns the name of the node of depth `depth` whose aabb contains the point.
+    Sorting points by these names orders them along the octree, like a Morton curve.
+    """
+    aabb = root_aabb
+    name = ''
+    # the aabb of a flat point cloud is flat too
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(depth):
+            center = (aabb[0] + aabb[1]) * 0.5
+            index = 4 * int(point[0] >= center[0]) + 2 * int(point[1] >= center[1])
+            if aabb_size_to_subdivision_type((aabb[1] - aabb[0]) * 0.5) == SubdivisionType.OCTREE:
+                index += int(point[2] >= center[2])
+            name += str(index)
+            aabb = split_aabb(aabb, index)
+    return name.encode('ascii')
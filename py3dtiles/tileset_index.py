@@ -0,0 +1,96 @@
+import json
+import os
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from py3dtiles import TileContentReader
+from py3dtiles.feature_table import FeatureTableHeader
+
+# the sidecar index, written in the folder of the tileset
+INDEX_FILENAME = 'tileset_index.json'
+
+# magic, version, byte length, then the json and binary byte lengths of the feature and batch tables
+TILE_HEADER = struct.Struct('<4s6I')
+
+TileMetadata = namedtuple('TileMetadata', ['point_count', 'byte_length', 'aabb'])
+
+
+def read_tile_metadata(filename, bounds=False):
+    """
+    Read the point count and the byte length of a pnts tile from its header and its feature table json.
+    The points are only read (memory-mapped) to compute their real aabb if bounds is True, otherwise aabb is None.
+    """
+    with open(filename, 'rb') as f:
+        magic, _, byte_length, ft_json_byte_length = TILE_HEADER.unpack(f.read(TILE_HEADER.size))[:4]
+        if magic != b'pnts':
+            raise RuntimeError('Unsupported format {}'.format(magic.decode('ascii', 'replace')))
+        fth = FeatureTableHeader.from_array(np.frombuffer(f.read(ft_json_byte_length), dtype=np.uint8))
+
+    aabb = None
+    if bounds and fth.points_length:
+        xyz = TileContentReader.read_file(filename, mmap=True).body.feature_table.get_positions()
+        aabb = np.array([np.amin(xyz, axis=0), np.amax(xyz, axis=0)], dtype=np.float64)
+        if fth.rtc is not None:
+            aabb += fth.rtc
+    return TileMetadata(fth.points_length, byte_length, aabb)
+
+
+def _tile_filenames(folder):
+    for root, _, files in os.walk(folder):
+        for f in files:
+            if f.endswith('.pnts'):
+                yield os.path.relpath(os.path.join(root, f), folder).replace(os.sep, '/')
+
+
+def _is_up_to_date(entry, stat, bounds):
+    return (entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+            and (not bounds or not entry['point_count'] or entry['aabb'] is not None))
+
+
+def load_tileset_index(folder, bounds=False, jobs=None, save=True):
+    """
+    Returns the metadata of the pnts tiles of a tileset folder (relative filename -> TileMetadata).
+
+    The metadata are cached in the INDEX_FILENAME file of the folder: only the new or modified tiles
+    (according to their size and modification time) are read, in parallel with jobs threads, and the
+    index is updated if save is True. The real aabb of the tiles are computed if bounds is True.
+    """
+    index_filename = os.path.join(folder, INDEX_FILENAME)
+    index = {}
+    if os.path.exists(index_filename):
+        with open(index_filename, 'r') as f:
+            index = json.load(f)
+
+    stats = {filename: os.stat(os.path.join(folder, filename)) for filename in _tile_filenames(folder)}
+    to_read = [
+        filename for filename, stat in stats.items()
+        if filename not in index or not _is_up_to_date(index[filename], stat, bounds)]
+    changed = bool(to_read) or len(index) != len(stats) or not index.keys() <= stats.keys()
+
+    if to_read:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            metadata = executor.map(
+                lambda filename: read_tile_metadata(os.path.join(folder, filename), bounds), to_read)
+            for filename, tile_metadata in zip(to_read, metadata):
+                index[filename] = {
+                    'size': stats[filename].st_size,
+                    'mtime': stats[filename].st_mtime_ns,
+                    'point_count': tile_metadata.point_count,
+                    'byte_length': tile_metadata.byte_length,
+                    'aabb': None if tile_metadata.aabb is None else tile_metadata.aabb.tolist(),
+                }
+
+    if changed and save:
+        index = {filename: index[filename] for filename in sorted(stats)}
+        with open(index_filename, 'w') as f:
+            json.dump(index, f)
+
+    return {
+        filename: TileMetadata(
+            index[filename]['point_count'],
+            index[filename]['byte_length'],
+            None if index[filename]['aabb'] is None else np.array(index[filename]['aabb']))
+        for filename in stats}
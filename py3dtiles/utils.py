@@ -20,7 +20,13 @@ def convert_to_ecef(x, y, z, epsg_input):
 class TileContentReader(object):
 
     @staticmethod
-    def read_file(filename):
+    def read_file(filename, mmap=False):
+        """
+        Read a tile file. With mmap, the file is memory-mapped instead of being read: only the headers
+        are parsed, and the arrays of the tables are views on the file, loaded when they're accessed.
+        """
+        if mmap:
+            return TileContentReader.read_array(np.memmap(filename, dtype=np.uint8, mode='r'))
         with open(filename, 'rb') as f:
             data = f.read()
             arr = np.frombuffer(data, dtype=np.uint8)
@@ -0,0 +1,27 @@
+import multiprocessing
+
+from py3dtiles.convert import remote_zmq_process
+
+
+def init_parser(subparser, str2bool):
+    parser = subparser.add_parser(
+        'worker',
+        help='Join a conversion started with "py3dtiles convert --zmq_uri tcp://..." from another host')
+    parser.add_argument(
+        '--connect',
+        required=True,
+        help='The zmq endpoint of the conversion, e.g. tcp://manager-host:5555')
+    parser.add_argument(
+        '--jobs',
+        help='The number of parallel jobs to start. Default to the number of cpu.',
+        default=multiprocessing.cpu_count(),
+        type=int)
+
+
+def main(args):
+    processes = [
+        multiprocessing.Process(target=remote_zmq_process, args=(args.connect,))
+        for _ in range(args.jobs)
+    ]
+    [p.start() for p in processes]
+    [p.join() for p in processes]
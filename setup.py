@@ -23,7 +23,13 @@ dev_requirements = (
     'pytest',
     'pytest-cov',
     'pytest-benchmark',
-    'line_profiler'
+    'line_profiler',
+    # to test the laz files
+    'lazrs',
+)
+
+draco_requirements = (
+    'DracoPy',
 )
 
 doc_requirements = (
@@ -75,7 +81,8 @@ setup(
     test_suite="tests",
     extras_require={
         'dev': dev_requirements,
-        'doc': doc_requirements
+        'doc': doc_requirements,
+        'draco': draco_requirements,
     },
     entry_points={
         'console_scripts': ['py3dtiles=py3dtiles.command_line:main'],
@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
+import glob
+import json
 import os
+import pickle
+import pytest
 from pytest import approx, raises, fixture
 import shutil
+import struct
 
-from py3dtiles import convert_to_ecef
-from py3dtiles.convert import convert, SrsInMissingException
+import laspy
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from py3dtiles import convert_to_ecef, TileContentReader
+from py3dtiles.feature_table import SemanticPoint
+from py3dtiles.convert import convert, sort_portions, SrsInMissingException, State
+from py3dtiles.points.point_attributes import make_point_dtype
+from py3dtiles.points.shared_points import dumps_points, loads_points, point_size
+from py3dtiles.points.task import las_reader, xyz_reader
+from py3dtiles.points.task_spill import TaskSpill
+from py3dtiles.points.utils import ResponseType
 
 
 fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
@@ -34,6 +49,108 @@ def test_convert(tmp_dir):
     assert os.path.exists(os.path.join(tmp_dir, 'r0.pnts'))
 
 
+def test_convert_quantized(tmp_dir):
+    convert(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ripple.las'), outfolder=tmp_dir, quantize=True)
+
+    with open(os.path.join(tmp_dir, 'tileset.json')) as f:
+        assert 'extensionsUsed' not in json.load(f)
+    for name in ['r.pnts', 'r0.pnts']:
+        feature_table = TileContentReader.read_file(os.path.join(tmp_dir, name)).body.feature_table
+        assert feature_table.header.positions == SemanticPoint.POSITION_QUANTIZED
+        xyz = feature_table.get_positions()
+        offset = np.array(feature_table.header.quantized_volume_offset)
+        assert np.all(xyz >= offset - 1e-3)
+        assert np.all(xyz <= offset + feature_table.header.quantized_volume_scale + 1e-3)
+
+
+def test_convert_with_extra_attributes(tmp_dir):
+    os.makedirs(tmp_dir)
+    las = laspy.create(point_format=3)
+    las.add_extra_dims([laspy.ExtraBytesParams(name, np.float32) for name in ('NormalX', 'NormalY', 'NormalZ')])
+    count = 5000
+    las.x, las.y, las.z = np.random.random((3, count)) * 10
+    las.classification = np.arange(count) % 7
+    las.NormalX = np.ones(count, dtype=np.float32)
+    las.write(os.path.join(tmp_dir, 'input.las'))
+
+    convert(os.path.join(tmp_dir, 'input.las'), outfolder=os.path.join(tmp_dir, 'out'), normals=True,
+            extra_attributes=['classification', 'gps_time'], jobs=2)
+
+    tile = TileContentReader.read_file(os.path.join(tmp_dir, 'out', 'r.pnts'))
+    point_count = tile.body.feature_table.npoints()
+    assert tile.body.feature_table.get_normals() == approx(np.tile([1, 0, 0], (point_count, 1)), abs=0.01)
+    classification = tile.body.batch_table.get_binary_property('classification', point_count)
+    assert set(classification) == set(range(7))
+    assert_array_equal(tile.body.batch_table.get_binary_property('gps_time', point_count), 0)
+
+
+def test_convert_draco(tmp_dir):
+    pytest.importorskip('DracoPy')
+    os.makedirs(tmp_dir)
+    las = laspy.create(point_format=3)
+    las.header.scales = [0.001, 0.001, 0.001]
+    las.add_extra_dims([laspy.ExtraBytesParams(name, np.float32) for name in ('NormalX', 'NormalY', 'NormalZ')])
+    count = 5000
+    # the attributes of a point are derived from its id, given by x
+    ids = np.random.permutation(count)
+    las.x = ids * 0.01
+    las.y, las.z = np.random.random((2, count)) * 10
+    las.classification = ids % 7
+    las.intensity = ids
+    angles = ids * 0.37
+    las.NormalX, las.NormalZ = np.cos(angles), np.sin(angles)
+    las.write(os.path.join(tmp_dir, 'input.las'))
+
+    with raises(ValueError):
+        convert(os.path.join(tmp_dir, 'input.las'), outfolder=os.path.join(tmp_dir, 'out'), draco=True,
+                extra_attributes=['gps_time'])
+
+    convert(os.path.join(tmp_dir, 'input.las'), outfolder=os.path.join(tmp_dir, 'out'), draco=True, normals=True,
+            extra_attributes=['classification', 'intensity'], jobs=2)
+
+    with open(os.path.join(tmp_dir, 'out', 'tileset.json')) as f:
+        tileset = json.load(f)
+    # the viewers must decode the tiles
+    assert tileset['extensionsUsed'] == ['3DTILES_draco_point_compression']
+    assert tileset['extensionsRequired'] == ['3DTILES_draco_point_compression']
+    transform = np.array(tileset['root']['transform']).reshape((4, 4)).T
+    filenames = glob.glob(os.path.join(tmp_dir, 'out', '**', '*.pnts'), recursive=True)
+    assert len(filenames) > 1
+    for filename in filenames:
+        tile = TileContentReader.read_file(filename)
+        feature_table = tile.body.feature_table
+        assert feature_table.header.draco is not None
+        point_count = feature_table.npoints()
+        xyz = feature_table.get_positions()
+        x = np.dot(np.column_stack((xyz, np.ones(point_count))), transform.T)[:, 0]
+        tile_ids = np.round(x / 0.01).astype(int)
+        assert_array_equal(tile.body.batch_table.get_binary_property('classification', point_count), tile_ids % 7)
+        assert_array_equal(tile.body.batch_table.get_binary_property('intensity', point_count), tile_ids)
+        expected_normals = np.column_stack((np.cos(tile_ids * 0.37), np.zeros(point_count), np.sin(tile_ids * 0.37)))
+        assert feature_table.get_normals() == approx(expected_normals, abs=0.02)
+
+
+def test_convert_normals_with_srs(tmp_dir):
+    os.makedirs(tmp_dir)
+    las = laspy.create(point_format=3)
+    las.add_extra_dims([laspy.ExtraBytesParams(name, np.float32) for name in ('NormalX', 'NormalY', 'NormalZ')])
+    count = 5000
+    # a horizontal patch in web mercator, around 2°E 45°N
+    las.x = 222638 + np.random.random(count) * 10
+    las.y = 5621521 + np.random.random(count) * 10
+    las.z = np.random.random(count)
+    las.NormalZ = np.ones(count, dtype=np.float32)
+    las.write(os.path.join(tmp_dir, 'input.las'))
+
+    convert(os.path.join(tmp_dir, 'input.las'), outfolder=os.path.join(tmp_dir, 'out'), normals=True,
+            srs_in='3857', srs_out='4978')
+
+    # the tiles are in a local frame whose z axis is the vertical of the points
+    tile = TileContentReader.read_file(os.path.join(tmp_dir, 'out', 'r.pnts'))
+    point_count = tile.body.feature_table.npoints()
+    assert tile.body.feature_table.get_normals() == approx(np.tile([0, 0, 1], (point_count, 1)), abs=0.02)
+
+
 def test_convert_without_srs(tmp_dir):
     with raises(SrsInMissingException):
         convert(os.path.join(fixtures_dir, 'without_srs.las'),
@@ -51,6 +168,64 @@ def test_convert_without_srs(tmp_dir):
     assert os.path.exists(os.path.join(tmp_dir, 'r.pnts'))
 
 
+class _Queue:
+    def __init__(self):
+        self.messages = []
+
+    def send_multipart(self, message, copy=True):
+        self.messages.append(message)
+
+
+def test_read_laz_portions(tmp_path, monkeypatch):
+    if not laspy.LazBackend.detect_available():
+        pytest.skip('no laz backend')
+    count = 120_000
+    las = laspy.create(point_format=3)
+    las.header.scales = [0.01, 0.01, 0.01]
+    # the id of each point is its x
+    las.x = np.arange(count)
+    las.y = las.z = np.zeros(count)
+    filename = str(tmp_path / 'input.laz')
+    las.write(filename)
+
+    monkeypatch.setattr(las_reader, 'PORTION_SIZE', 40_000)
+    infos = las_reader.init([filename])
+    with laspy.open(filename) as f:
+        chunk_size = las_reader._laz_chunk_size(f.header)
+    # the portions are aligned on the chunks of the file
+    assert chunk_size == 50_000
+    assert [portion for _, portion in infos['portions']] == [(0, 50_000), (50_000, 100_000), (100_000, count)]
+    assert infos['point_count'] == count
+
+    # the worker keeps the file open, and only seeks to the portions that don't follow the previous one
+    seeks = []
+    opened = las_reader._open(filename)
+    seek = opened.seek
+    monkeypatch.setattr(opened, 'seek', lambda index: seeks.append(index) or seek(index))
+    offset_scale = (-np.array(infos['avg_min']), np.ones(3), None, infos['color_scale'].get(filename))
+    ids = []
+    queue = _Queue()
+    try:
+        for _, portion in [infos['portions'][i] for i in (2, 0, 1)]:
+            las_reader.run(filename, offset_scale, portion, queue, None, 0)
+            assert las_reader._opened_file[1] is opened
+            read = queue.messages.pop()
+            assert read[0] == ResponseType.READ.value
+            assert struct.unpack('>I', read[1])[0] == portion[1] - portion[0]
+            for message in queue.messages:
+                assert message[0] == ResponseType.NEW_TASK.value
+                xyz, _ = loads_points(message[2])
+                assert struct.unpack('>I', message[3])[0] == len(xyz)
+                ids.append(np.round(xyz[:, 0]).astype(int))
+            queue.messages = []
+    finally:
+        las_reader.close()
+
+    assert seeks == [100_000, 0]
+    # every point is read once
+    assert_array_equal(np.sort(np.concatenate(ids)), np.arange(count))
+
+
 def test_convert_with_srs(tmp_dir):
     convert(os.path.join(fixtures_dir, 'with_srs.las'),
             outfolder=tmp_dir,
@@ -68,3 +243,352 @@ def test_convert_simple_xyz(tmp_dir):
             jobs=1)
     assert os.path.exists(os.path.join(tmp_dir, 'tileset.json'))
     assert os.path.exists(os.path.join(tmp_dir, 'r.pnts'))
+
+
+def test_convert_csv(tmp_dir, monkeypatch):
+    os.makedirs(tmp_dir)
+    filename = os.path.join(tmp_dir, 'points.csv')
+    np.random.seed(0)
+    points = np.random.random((1000, 3)) * 100
+    with open(filename, 'w') as f:
+        print('id;x;y;z;red;green;blue', file=f)
+        for i, (x, y, z) in enumerate(points):
+            print(f'{i};{x};{y};{z};255;0;{i % 256}', file=f)
+
+    # several portions, scanned in parallel
+    monkeypatch.setattr(xyz_reader, 'PORTION_SIZE', 100)
+    infos = xyz_reader.init([filename], jobs=2, delimiter=';', columns='_xyzrgb')
+    assert infos['point_count'] == 1000
+    assert len(infos['portions']) > 1
+    assert infos['aabb'] == approx(np.array([points.min(axis=0), points.max(axis=0)]))
+
+    with raises(ValueError):
+        xyz_reader.init([filename], delimiter=';', columns='xyzrgb')
+
+    convert(filename,
+            outfolder=os.path.join(tmp_dir, 'out'),
+            delimiter=';',
+            columns='_xyzrgb',
+            jobs=2)
+    assert os.path.exists(os.path.join(tmp_dir, 'out', 'tileset.json'))
+
+    # without scanning the file, the point count is an estimation
+    aabb = [0, 0, 0, 100, 100, 100]
+    infos = xyz_reader.init([filename], delimiter=';', columns='_xyzrgb', aabb=aabb)
+    assert infos['point_count'] == approx(1000, rel=0.1)
+    assert infos['aabb'] == approx(np.array([[0, 0, 0], [100, 100, 100]]))
+
+    convert(filename,
+            outfolder=os.path.join(tmp_dir, 'out_aabb'),
+            delimiter=';',
+            columns='_xyzrgb',
+            aabb=aabb,
+            jobs=2)
+    assert os.path.exists(os.path.join(tmp_dir, 'out_aabb', 'tileset.json'))
+
+
+def test_read_invalid_xyz(tmp_dir):
+    os.makedirs(tmp_dir)
+    filename = os.path.join(tmp_dir, 'points.xyz')
+    with open(filename, 'w') as f:
+        for i in range(100):
+            print(f'{i} {i} {i}', file=f)
+        print('100 100 1e', file=f)
+        print('101 101 101', file=f)
+
+    # the lines after an invalid value aren't silently dropped
+    with raises(ValueError, match="'100 100 1e'"):
+        xyz_reader.init([filename])
+
+    with open(filename, 'w') as f:
+        print('1;2;3', file=f)
+        print('4;5;6;7', file=f)
+    with raises(ValueError, match="'4;5;6;7'"):
+        xyz_reader.init([filename])
+
+
+def test_convert_with_aabb_short_range(tmp_dir, monkeypatch):
+    os.makedirs(tmp_dir)
+    filename = os.path.join(tmp_dir, 'points.xyz')
+    np.random.seed(0)
+    points = np.random.random((200, 3)) * 100
+    with open(filename, 'w') as f:
+        for x, y, z in points:
+            print(f'{x:09.5f} {y:09.5f} {z:09.5f}', file=f)
+        # shorter than the other lines
+        print('1 2 3', file=f)
+    points = np.concatenate((np.round(points, 5), [[1, 2, 3]]))
+
+    # the last range only holds the last line
+    monkeypatch.setattr(xyz_reader, 'PORTION_SIZE', 100)
+    aabb = [0, 0, 0, 100, 100, 100]
+    infos = xyz_reader.init([filename], aabb=aabb)
+    assert infos['portions'][-1][1][2:4] == (6000, 6006)
+
+    convert(filename, outfolder=os.path.join(tmp_dir, 'out'), aabb=aabb)
+
+    # every point is written
+    with open(os.path.join(tmp_dir, 'out', 'tileset.json')) as f:
+        transform = np.array(json.load(f)['root']['transform']).reshape((4, 4)).T
+    written = []
+    for tile_filename in glob.glob(os.path.join(tmp_dir, 'out', '**', '*.pnts'), recursive=True):
+        xyz = TileContentReader.read_file(tile_filename).body.feature_table.get_positions()
+        written.append(np.dot(np.column_stack((xyz, np.ones(len(xyz)))), transform.T)[:, :3])
+    written = np.unique(np.round(np.concatenate(written), 2), axis=0)
+    assert_array_equal(written, np.unique(np.round(points, 2), axis=0))
+
+
+def test_convert_with_checkpoints(tmp_dir):
+    convert(os.path.join(os.path.dirname(os.path.abspath(__file__)), './ripple.las'),
+            outfolder=tmp_dir,
+            checkpoint_interval=1e-6)
+    assert os.path.exists(os.path.join(tmp_dir, 'tileset.json'))
+    assert not os.path.exists(os.path.join(tmp_dir, 'tmp'))
+
+
+def test_convert_resume(tmp_dir, monkeypatch):
+    import py3dtiles.convert
+    from py3dtiles.points.checkpoint import save_checkpoint
+
+    ripple = os.path.join(os.path.dirname(os.path.abspath(__file__)), './ripple.las')
+    full_dir = os.path.join(tmp_dir, 'full')
+    interrupted_dir = os.path.join(tmp_dir, 'interrupted')
+    os.makedirs(tmp_dir)
+    calls = []
+
+    def save_and_snapshot(working_dir, checkpoint):
+        # snapshot the output folder as if the conversion was killed just before the 3rd checkpoint
+        calls.append(working_dir)
+        if len(calls) == 3:
+            shutil.copytree(os.path.dirname(working_dir), interrupted_dir)
+        save_checkpoint(working_dir, checkpoint)
+
+    monkeypatch.setattr(py3dtiles.convert, 'save_checkpoint', save_and_snapshot)
+    convert(ripple, outfolder=full_dir, checkpoint_interval=1e-6)
+    assert len(calls) >= 3
+    monkeypatch.undo()
+
+    with raises(ValueError):
+        convert(ripple, outfolder=interrupted_dir, resume=True, rgb=False)
+
+    # convert checks the number of points written, so the resumed conversion must not lose or duplicate points
+    convert(ripple, outfolder=interrupted_dir, resume=True)
+    assert os.path.exists(os.path.join(interrupted_dir, 'tileset.json'))
+    assert not os.path.exists(os.path.join(interrupted_dir, 'tmp'))
+
+
+def test_convert_distributed(tmp_dir):
+    import multiprocessing
+    import socket
+    from py3dtiles.convert import remote_zmq_process
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    # the workers may start before the manager binds the endpoint
+    workers = [
+        multiprocessing.Process(target=remote_zmq_process, args=(f'tcp://127.0.0.1:{port}',))
+        for _ in range(2)
+    ]
+    [w.start() for w in workers]
+
+    convert(os.path.join(os.path.dirname(os.path.abspath(__file__)), './ripple.las'),
+            outfolder=tmp_dir,
+            jobs=0,
+            zmq_uri=f'tcp://*:{port}')
+
+    for w in workers:
+        w.join(timeout=10)
+        assert w.exitcode == 0
+    assert os.path.exists(os.path.join(tmp_dir, 'tileset.json'))
+
+
+def test_convert_concurrently(tmp_dir):
+    import multiprocessing
+
+    ripple = os.path.join(os.path.dirname(os.path.abspath(__file__)), './ripple.las')
+    outfolders = [os.path.join(tmp_dir, str(i)) for i in range(2)]
+    os.makedirs(tmp_dir)
+    conversions = [
+        multiprocessing.Process(target=convert, args=(ripple,), kwargs={'outfolder': outfolder, 'jobs': 2})
+        for outfolder in outfolders
+    ]
+    [c.start() for c in conversions]
+
+    for conversion, outfolder in zip(conversions, outfolders):
+        conversion.join()
+        assert conversion.exitcode == 0
+        assert os.path.exists(os.path.join(outfolder, 'tileset.json'))
+
+
+def test_convert_failure_cleanup(tmp_dir, monkeypatch):
+    import multiprocessing
+    import time
+    from py3dtiles.convert import make_ipc_uri
+    from py3dtiles.points.shared_node_store import SharedNodeStore
+
+    def fail(*args):
+        raise RuntimeError('conversion failure')
+    monkeypatch.setattr(SharedNodeStore, 'control_memory_usage', fail)
+
+    zmq_uri = make_ipc_uri()
+    with raises(RuntimeError, match='conversion failure'):
+        convert(os.path.join(os.path.dirname(os.path.abspath(__file__)), './ripple.las'),
+                outfolder=tmp_dir, jobs=2, zmq_uri=zmq_uri)
+
+    # the workers are terminated and the ipc endpoint is removed
+    assert not os.path.exists(zmq_uri[len('ipc://'):])
+    deadline = time.time() + 10
+    while multiprocessing.active_children() and time.time() < deadline:
+        time.sleep(0.1)
+    assert not multiprocessing.active_children()
+
+
+def test_convert_with_max_memory(tmp_dir):
+    # a budget too small to read anything in parallel, the conversion must still finish
+    convert(os.path.join(os.path.dirname(os.path.abspath(__file__)), './ripple.las'),
+            outfolder=tmp_dir,
+            max_memory=1,
+            jobs=2)
+    assert os.path.exists(os.path.join(tmp_dir, 'tileset.json'))
+
+
+def test_spill_tasks(tmp_path):
+    state = State([], 1)
+    state.task_spill = TaskSpill(str(tmp_path))
+    xyz = np.random.random((2000, 3)).astype(np.float32)
+    rgb = np.zeros((2000, 3), dtype=np.uint8)
+    tasks = [dumps_points(xyz[:1500], rgb[:1500], True), dumps_points(xyz[1500:], rgb[1500:], False)]
+    state.add_tasks_to_process(b'1', tasks[0], 1500)
+    state.add_tasks_to_process(b'2', tasks[1], 500)
+
+    state.spill_tasks(1000)
+    assert state.points_in_memory == 500
+    assert state.node_to_process[b'1'] == ([], 1500)
+    state.add_tasks_to_process(b'1', tasks[1], 500)
+
+    tasks, point_count = state.pop_tasks_to_process(b'1')
+    assert point_count == 2000
+    assert state.points_in_memory == 500
+    assert_array_equal(np.concatenate([loads_points(task)[0] for task in tasks]), np.concatenate((xyz[:1500], xyz[1500:])))
+    assert not os.listdir(tmp_path)
+
+
+def test_spill_tasks_moved_folder(tmp_path):
+    # a checkpointed TaskSpill records its segments relative to its folder
+    task_spill = TaskSpill(str(tmp_path / 'spill'), keep_consumed_segments=True)
+    xyz = np.random.random((10, 3)).astype(np.float32)
+    rgb = np.zeros((10, 3), dtype=np.uint8)
+    task_spill.spill(b'1', [dumps_points(xyz, rgb, False)], 10)
+    task_spill.spill(b'123456789', [dumps_points(xyz, rgb, False)], 10)
+    task_spill.load(b'1')
+    task_spill = pickle.loads(pickle.dumps(task_spill))
+
+    shutil.move(str(tmp_path / 'spill'), str(tmp_path / 'moved'))
+    task_spill.folder = str(tmp_path / 'moved')
+    assert_array_equal(loads_points(task_spill.load(b'123456789')[0])[0], xyz)
+    task_spill.commit_checkpoint()
+    assert not [files for _, _, files in os.walk(tmp_path / 'moved') if files]
+
+
+def test_point_size():
+    # the xyz and the colors
+    assert point_size(make_point_dtype()) == 15
+    # then the oct-encoded normal, the classification and the gps time
+    assert point_size(make_point_dtype(True, ['classification', 'gps_time'])) == 15 + 2 + 1 + 8
+
+
+def test_pop_writable_nodes():
+    state = State([], 1)
+    for name in [b'1', b'12', b'123', b'13', b'21']:
+        state.add_waiting_writing_node(name)
+    state.add_tasks_to_process(b'12', b'', 10)
+    state.start_processing(b'2', 1, 10, 0)
+
+    # 12 and its descendants wait for 12 to be processed
+    assert state.pop_writable_nodes(b'1') == [b'1', b'13']
+    assert state.waiting_writing_nodes == [b'12', b'123', b'21']
+
+    state.pop_tasks_to_process(b'12')
+    state.start_processing(b'12', 1, 10, 0)
+    assert state.waiting_writing_nodes == [b'123', b'21']
+    state.end_processing(b'12')
+    assert state.pop_writable_nodes(b'12') == [b'123']
+    assert state.pop_writable_nodes(b'21') == []
+    state.end_processing(b'2')
+    assert state.pop_writable_nodes(b'2') == [b'21']
+
+
+def test_pop_settled_nodes():
+    state = State([('a.las', (0, 10)), ('a.las', (10, 20))], 1)
+    # the portions are on each side of the plane x = 4
+    state.track_regions(np.array([[0, 0, 0], [8, 8, 8]]), [
+        np.array([[0, 0, 0], [3.9, 8, 8]]),
+        np.array([[4.1, 0, 0], [8, 8, 8]])])
+    state.add_waiting_writing_node(b'0')
+    state.add_waiting_writing_node(b'4')
+
+    state.start_reading(b'client', 'a.las', (0, 10))
+    state.add_tasks_to_process(b'', b'', 10)
+    state.add_root_region(b'client')
+    state.end_reading(b'client')
+    # the points of the first portion are still in the root node
+    assert not state.regions_released
+    assert state.pop_writable_nodes(b'') == []
+
+    state.pop_tasks_to_process(b'')
+    state.start_processing(b'', 1, 10, 0)
+    state.end_processing(b'')
+    assert state.regions_released
+    assert state.pop_writable_nodes(b'') == [b'0']
+    assert state.waiting_writing_nodes == [b'4']
+
+
+def test_convert_while_reading(tmp_dir, monkeypatch):
+    os.makedirs(tmp_dir)
+    filename = os.path.join(tmp_dir, 'points.xyz')
+    np.random.seed(0)
+    points = np.random.random((40000, 3)) * 100
+    # sorted points, so the portions don't overlap
+    np.savetxt(filename, points[np.argsort(points[:, 0])])
+
+    settled_while_reading = []
+    pop_writable_nodes = State.pop_writable_nodes
+
+    def spy(state, finished_node):
+        nodes = pop_writable_nodes(state, finished_node)
+        if nodes and not state.is_reading_finish():
+            settled_while_reading.extend(nodes)
+        return nodes
+
+    monkeypatch.setattr(xyz_reader, 'PORTION_SIZE', 2000)
+    monkeypatch.setattr(State, 'pop_writable_nodes', spy)
+    convert(filename, outfolder=os.path.join(tmp_dir, 'out'), jobs=2)
+    assert os.path.exists(os.path.join(tmp_dir, 'out', 'tileset.json'))
+    assert settled_while_reading
+
+
+def test_sort_portions():
+    # 2x2 tiles, listed row by row, and a portion of unknown bounds
+    tiles = {
+        'a.las': [[0, 0, 0], [5, 5, 1]],
+        'b.las': [[5, 0, 0], [10, 5, 1]],
+        'c.las': [[0, 5, 0], [5, 10, 1]],
+        'd.las': [[5, 5, 0], [10, 10, 1]],
+    }
+    portions = [(filename, (i, i + 1)) for filename in tiles for i in range(2)] + [('e.xyz', (0, 1))]
+    portion_aabbs = [np.array(tiles[filename], dtype=np.float64) for filename, _ in portions[:-1]] + [None]
+
+    portions, portion_aabbs = sort_portions(portions, portion_aabbs, np.array([[0, 0, 0], [10, 10, 1]]))
+    assert [filename for filename, _ in portions] == ['a.las', 'a.las', 'c.las', 'c.las', 'b.las', 'b.las',
+                                                      'd.las', 'd.las', 'e.xyz']
+    assert [portion for _, portion in portions[:2]] == [(0, 1), (1, 2)]
+    assert portion_aabbs[-1] is None
+
+
+def test_convert_with_task_spill(tmp_dir):
+    convert(os.path.join(os.path.dirname(os.path.abspath(__file__)), './ripple.las'),
+            outfolder=tmp_dir,
+            spill_threshold=0.01)
+    assert os.path.exists(os.path.join(tmp_dir, 'tileset.json'))
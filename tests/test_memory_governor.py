@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from py3dtiles.points import memory_governor
+from py3dtiles.points.memory_governor import MemoryGovernor
+from py3dtiles.points.shared_points import dumps_points, loads_points, make_segment_prefix, set_segment_prefix, \
+    shared_memory, shared_memory_usage
+
+MB = 1024 * 1024
+
+
+def test_can_read_and_excess(monkeypatch):
+    usage = {'rss': 0, 'shared_memory': 0}
+    prefixes = []
+    monkeypatch.setattr(memory_governor, '_rss', lambda process: usage['rss'])
+
+    def fake_shared_memory_usage(prefix):
+        prefixes.append(prefix)
+        return usage['shared_memory']
+    monkeypatch.setattr(memory_governor, 'shared_memory_usage', fake_shared_memory_usage)
+
+    governor = MemoryGovernor(100, 'p3dtest_', interval=0)
+    usage['rss'] = 50 * MB
+    assert governor.can_read()
+    assert governor.excess() == 0
+
+    # the segments of the conversion count in the budget
+    usage['shared_memory'] = 30 * MB
+    assert not governor.can_read()
+    assert governor.excess() == 0
+    assert prefixes[-1] == 'p3dtest_'
+
+    usage['shared_memory'] = 50 * MB
+    assert governor.excess() == 10 * MB
+
+    # without shared memory, only the rss counts
+    governor = MemoryGovernor(100, interval=0)
+    assert governor.can_read()
+    assert governor.excess() == 0
+
+
+def test_measure_interval(monkeypatch):
+    usage = {'rss': 10 * MB}
+    monkeypatch.setattr(memory_governor, '_rss', lambda process: usage['rss'])
+    governor = MemoryGovernor(100, interval=3600)
+    assert governor.can_read()
+    # the last measure is used until the interval is over
+    usage['rss'] = 95 * MB
+    assert governor.can_read()
+    assert governor.excess() == 0
+
+
+@pytest.mark.skipif(shared_memory is None, reason='requires python >= 3.8')
+def test_shared_memory_usage():
+    prefix = make_segment_prefix()
+    xyz = np.random.random((2000, 3)).astype(np.float32)
+    rgb = np.zeros((2000, 3), dtype=np.uint8)
+
+    # the segments of other conversions aren't counted
+    data = dumps_points(xyz, rgb, True)
+    assert shared_memory_usage(prefix) == 0
+    loads_points(data)
+
+    set_segment_prefix(prefix)
+    try:
+        data = [dumps_points(xyz, rgb, True), dumps_points(xyz, rgb, True)]
+    finally:
+        set_segment_prefix(None)
+    size = xyz.nbytes + rgb.nbytes
+    assert shared_memory_usage(prefix) == 2 * size
+    loads_points(data[0])
+    assert shared_memory_usage(prefix) == size
+    loads_points(data[1])
+    assert shared_memory_usage(prefix) == 0
@@ -24,6 +24,16 @@ class TestTileContentReader(unittest.TestCase):
         dcol_res = {'Red': 44, 'Blue': 209, 'Green': 243}
         self.assertDictEqual(dcol_res, feature.colors)
 
+    def test_read_mmap(self):
+        tile = TileContentReader().read_file('tests/pointCloudRGB.pnts', mmap=True)
+        ref = TileContentReader().read_file('tests/pointCloudRGB.pnts')
+
+        self.assertEqual(tile.header.tile_byte_length, 15176)
+        # the arrays are views on the file
+        self.assertIsInstance(tile.body.feature_table.body.positions_arr, np.memmap)
+        np.testing.assert_array_equal(tile.body.feature_table.get_positions(), ref.body.feature_table.get_positions())
+        self.assertDictEqual(tile.body.feature_table.feature(0).colors, ref.body.feature_table.feature(0).colors)
+
 
 class TestTileBuilder(unittest.TestCase):
 
@@ -109,3 +119,40 @@ class TestTileBuilder(unittest.TestCase):
         self.assertDictEqual(dcol_res, feature.colors)
 
         # t2.save_as("/tmp/py3dtiles_test_build_1.pnts")
+
+    def test_build_from_numpy(self):
+        tread = TileContentReader().read_file('tests/pointCloudRGB.pnts')
+        positions = tread.body.feature_table.get_positions()
+        colors = tread.body.feature_table.body.colors_arr.reshape((-1, 3))
+        rtc = [1215012.8828876738, -4736313.051199594, 4081605.22126042]
+
+        t = Pnts.from_numpy(positions, colors, rtc=rtc)
+        t2 = Pnts.from_array(t.to_array())
+        self.assertEqual(t2.header.tile_byte_length, 15176)
+        self.assertEqual(t2.header.ft_json_byte_length, 148)
+        self.assertEqual(t2.header.ft_bin_byte_length, 15000)
+        self.assertEqual(t2.body.feature_table.header.rtc, rtc)
+        np.testing.assert_array_equal(t2.body.feature_table.get_positions(), positions)
+        dcol_res = {'Red': 44, 'Blue': 209, 'Green': 243}
+        self.assertDictEqual(dcol_res, t2.body.feature_table.feature(0).colors)
+
+        # structured arrays, and float64 positions
+        pdt = np.dtype([('X', '<f8'), ('Y', '<f8'), ('Z', '<f8')])
+        structured = np.zeros(len(positions), dtype=pdt)
+        for i, name in enumerate('XYZ'):
+            structured[name] = positions[:, i]
+        normals = np.zeros((len(positions), 3), dtype=np.float32)
+        normals[:, 2] = 1
+        t3 = Pnts.from_array(Pnts.from_numpy(structured, normals=normals).to_array())
+        feature_table = t3.body.feature_table
+        self.assertEqual(feature_table.header.colors_dtype, None)
+        np.testing.assert_array_equal(feature_table.get_positions(), positions)
+        np.testing.assert_array_equal(feature_table.get_normals(), normals)
+
+        # the features are built at once
+        features = [Feature.from_values(*p) for p in positions[:10]]
+        t4 = Pnts.from_features(np.dtype([('X', '<f4'), ('Y', '<f4'), ('Z', '<f4')]), None, features)
+        np.testing.assert_array_equal(t4.body.feature_table.get_positions(), positions[:10])
+
+        with self.assertRaises(ValueError):
+            Pnts.from_numpy(positions, colors[:10])
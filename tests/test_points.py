@@ -1,11 +1,22 @@
+import json
+import os
+import pickle
+import struct
+
+import lz4.frame as gzip
 import pytest
 import numpy as np
 from numpy.testing import assert_array_equal
 
+from py3dtiles import TileContentReader
+from py3dtiles.feature_table import oct_encode, SemanticPoint
+from py3dtiles.points.point_attributes import make_point_dtype, pack_point_attributes, read_point_attributes
 from py3dtiles.points.points_grid import Grid
-from py3dtiles.points.node import Node
-from py3dtiles.points.utils import compute_spacing, name_to_filename
-from py3dtiles.points.distance import is_point_far_enough
+from py3dtiles.points.node import Node, TilesetSplitPolicy
+from py3dtiles.points.task import pnts_writer
+from py3dtiles.points.utils import compute_spacing, dumps_node_bytes, loads_node_bytes, name_to_filename, \
+    point_to_node_name, split_aabb
+from py3dtiles.points.distance import is_point_far_enough, is_point_far_enough_from_voxels, make_voxels
 
 # test point
 xyz = np.array([0.25, 0.25, 0.25], dtype=np.float32)
@@ -60,6 +71,17 @@ def test_grid_get_point_count(grid, node):
     assert len(grid.get_points(False)) == 1 * (3 * 4)
 
 
+def test_grid_balance(grid, node):
+    points = np.random.random((1000, 3)).astype(np.float32) * 2
+    grid.insert(node.aabb[0], node.inv_aabb_size, points, np.zeros((1000, 3), dtype=np.uint8))
+    count = grid.get_point_count()
+    assert grid.cell_points.sum() == count
+    grid.balance(node.aabb_size, node.aabb[0], node.inv_aabb_size)
+    assert len(grid.cell_points) == grid.max_key_value
+    assert grid.cell_points.sum() == count
+    assert len(grid.get_points(True)) == count * (3 * 4 + 3)
+
+
 def test_is_point_far_enough():
     points = np.array(
         [
@@ -71,6 +93,226 @@ def test_is_point_far_enough():
     assert is_point_far_enough(points, xyz2, 0.25 ** 2)
 
 
+def test_is_point_far_enough_from_voxels():
+    points = np.array(
+        [
+            [1, 1, 1],
+            [0.2, 0.2, 0.2],
+            [0.4, 0.4, 0.4],
+        ], dtype=np.float32)
+    aabb_min = np.zeros(3, dtype=np.float32)
+    voxels = make_voxels(points, len(points), aabb_min, np.float32(0.5 / 0.25))
+    assert not is_point_far_enough_from_voxels(voxels, points, xyz, aabb_min, np.float32(0.5 / 0.25), 0.25 ** 2)
+    assert is_point_far_enough_from_voxels(voxels, points, xyz2, aabb_min, np.float32(0.5 / 0.25), 0.25 ** 2)
+
+
+def test_node_save_load(node):
+    node.children = [b'noeud0', b'noeud5']
+    node.grid.insert(node.aabb[0], node.inv_aabb_size, sample_points, np.zeros((30, 3), dtype=np.uint8))
+
+    data = loads_node_bytes(dumps_node_bytes({b'noeud': node.save_to_bytes()}))[b'noeud']
+    loaded = Node(b'noeud', np.array([[0, 0, 0], [2, 2, 2]]), node.spacing)
+    loaded.load_from_bytes(data)
+    assert loaded.children == node.children
+    assert_array_equal(loaded.grid.cell_points, node.grid.cell_points)
+    assert_array_equal(loaded.grid.get_points(True), node.grid.get_points(True))
+
+    # the voxels aren't serialized, they must be rebuilt
+    assert loaded.grid.insert(node.aabb[0], node.inv_aabb_size, sample_points[3:4], rgb)[0].shape[0] == 1
+
+
+def test_leaf_node_save_load(node):
+    node.points = [(to_insert, rgb), (sample_points, np.zeros((30, 3), dtype=np.uint8))]
+
+    loaded = Node(b'noeud', np.array([[0, 0, 0], [2, 2, 2]]), node.spacing)
+    loaded.load_from_bytes(node.save_to_bytes())
+    assert loaded.children is None
+    assert_array_equal(Node.get_points(loaded, True), Node.get_points(node, True))
+
+    # the loaded points are read-only views of the serialized node
+    xyz, rgb_ = loaded.points[0]
+    assert not xyz.flags.writeable
+    grid = Grid(loaded)
+    assert len(grid.insert(loaded.aabb[0], loaded.inv_aabb_size, xyz, rgb_)[0]) == 0
+    assert grid.get_point_count() == 31
+
+
+def test_point_to_node_name():
+    aabb = np.array([[0, 0, 0], [8, 8, 1]], dtype=np.float64)
+    point = np.array([7, 1, 0.9])
+    name = point_to_node_name(point, aabb, 3)
+    assert name == b'447'
+    for digit in name:
+        aabb = split_aabb(aabb, digit - ord('0'))
+    assert np.all(aabb[0] <= point) and np.all(point <= aabb[1])
+
+
+class _Sender:
+    def send_multipart(self, message):
+        self.message = message
+
+
+def test_write_merges_small_children(tmp_path):
+    nodes = {}
+    for name, count in [(b'1', 200), (b'12', 50), (b'13', 150)]:
+        leaf = Node(name, np.array([[0, 0, 0], [2, 2, 2]]), 1)
+        leaf.points = [(np.random.random((count, 3)).astype(np.float32), np.zeros((count, 3), dtype=np.uint8))]
+        nodes[name] = leaf.save_to_bytes()
+
+    sender = _Sender()
+    pnts_writer.run(sender, gzip.compress(dumps_node_bytes(nodes)), b'1', str(tmp_path), True)
+    assert struct.unpack('>I', sender.message[1])[0] == 400
+
+    # 12 is merged in 1
+    written_tiles = pickle.loads(sender.message[3])
+    assert {name: count for name, (count, aabb) in written_tiles.items()} == {b'1': 250, b'13': 150}
+    assert sorted(os.listdir(tmp_path)) == ['r1.pnts', 'r13.pnts']
+    assert np.all(written_tiles[b'1'][1][0] >= 0) and np.all(written_tiles[b'1'][1][1] <= 1)
+
+
+def test_points_to_pnts_quantized(tmp_path):
+    xyz = np.array([[0, 0, 5], [10, 1, 5], [2.5, 0.5, 5]], dtype=np.float32)
+    rgb = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]], dtype=np.uint8)
+    points = np.concatenate((xyz.view(np.uint8).ravel(), rgb.ravel()))
+    count, filename = pnts_writer.points_to_pnts(b'1', points, str(tmp_path), True, quantize=True)
+    assert count == 3
+
+    feature_table = TileContentReader.read_file(filename).body.feature_table
+    assert feature_table.header.positions == SemanticPoint.POSITION_QUANTIZED
+    assert feature_table.header.quantized_volume_offset == [0, 0, 5]
+    assert feature_table.header.quantized_volume_scale == [10, 1, 0]
+    assert feature_table.body.positions_arr.nbytes == 3 * 6
+    assert feature_table.get_positions() == pytest.approx(xyz, abs=1e-4)
+    assert_array_equal(feature_table.body.colors_arr.reshape((3, 3)), rgb)
+
+
+def test_points_to_pnts_draco(tmp_path):
+    pytest.importorskip('DracoPy')
+    xyz = np.random.random((1000, 3)).astype(np.float32)
+    # distinct x, to match the points
+    xyz[:, 0] = np.random.permutation(1000) / 1000
+    rgb = np.random.randint(0, 256, (1000, 3), dtype=np.uint8)
+    points = np.concatenate((xyz.view(np.uint8).ravel(), rgb.ravel()))
+    count, filename = pnts_writer.points_to_pnts(b'1', points, str(tmp_path), True, draco=True)
+    assert count == 1000
+    assert os.path.getsize(filename) < len(points)
+
+    feature_table = TileContentReader.read_file(filename).body.feature_table
+    assert feature_table.header.draco['properties'] == {'POSITION': 0, 'RGB': 1}
+    # the points may be reordered
+    positions = feature_table.get_positions()
+    order = np.argsort(positions[:, 0])
+    expected_order = np.argsort(xyz[:, 0])
+    assert positions[order] == pytest.approx(xyz[expected_order], abs=1e-4)
+    assert_array_equal(feature_table.body.colors_arr.reshape((1000, 3))[order], rgb[expected_order])
+
+
+def test_points_to_pnts_extra_attributes(tmp_path):
+    point_dtype = make_point_dtype(normals=True, extra_attributes=['gps_time', 'intensity'])
+    xyz = np.random.random((10, 3)).astype(np.float32)
+    normals = np.array([[0, 0, 1], [0, 0, -1], [1, 0, 0], [0, -1, 0], [0.6, 0, -0.8]] * 2)
+    values = {'normal': oct_encode(normals), 'intensity': np.arange(10) * 1000, 'gps_time': np.arange(10) * 0.5}
+    attributes = pack_point_attributes(point_dtype, np.zeros((10, 3), dtype=np.uint8), values)
+    points = np.concatenate((xyz.view(np.uint8).ravel(), attributes.ravel()))
+    count, filename = pnts_writer.points_to_pnts(b'1', points, str(tmp_path), False, point_dtype=point_dtype)
+    assert count == 10
+
+    tile = TileContentReader.read_file(filename)
+    assert tile.body.feature_table.header.colors == SemanticPoint.NONE
+    assert tile.body.feature_table.get_normals() == pytest.approx(normals, abs=0.01)
+    # the binary body of the batch table is aligned on 8 bytes
+    assert (28 + tile.header.ft_json_byte_length + tile.header.ft_bin_byte_length
+            + tile.header.bt_json_byte_length) % 8 == 0
+    batch_table = tile.body.batch_table
+    assert batch_table.header['intensity']['componentType'] == 'UNSIGNED_SHORT'
+    assert_array_equal(batch_table.get_binary_property('intensity', 10), values['intensity'])
+    assert_array_equal(batch_table.get_binary_property('gps_time', 10), values['gps_time'])
+
+    loaded_dtype, loaded_attributes = read_point_attributes(tile)
+    assert loaded_dtype == point_dtype
+    assert_array_equal(loaded_attributes, attributes)
+
+
+def test_points_to_pnts_draco_extra_attributes(tmp_path):
+    pytest.importorskip('DracoPy')
+    count = 2000
+    point_dtype = make_point_dtype(normals=True, extra_attributes=['classification', 'intensity'])
+    xyz = np.random.random((count, 3)).astype(np.float32)
+    xyz[:, 0] = np.random.permutation(count) / count
+    # the attributes are derived from the positions, to check they stay on their points
+    normals = np.column_stack((xyz[:, 0], np.zeros(count), np.ones(count)))
+    normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+    values = {
+        'normal': oct_encode(normals),
+        'classification': (xyz[:, 0] * 100).astype(np.uint8),
+        'intensity': (xyz[:, 0] * 60000).astype(np.uint16),
+    }
+    attributes = pack_point_attributes(point_dtype, np.zeros((count, 3), dtype=np.uint8), values)
+    points = np.concatenate((xyz.view(np.uint8).ravel(), attributes.ravel()))
+    pnts_writer.points_to_pnts(b'1', points, str(tmp_path), True, draco=True, point_dtype=point_dtype)
+
+    tile = TileContentReader.read_file(os.path.join(str(tmp_path), 'r1.pnts'))
+    feature_table = tile.body.feature_table
+    assert feature_table.header.normal == SemanticPoint.NORMAL
+    assert feature_table.header.draco['properties'] == {'NORMAL': 0, 'POSITION': 3, 'RGB': 4}
+    batch_table = tile.body.batch_table
+    assert batch_table.header['extensions']['3DTILES_draco_point_compression'] == {
+        'properties': {'intensity': 1, 'classification': 2}}
+    assert tile.header.bt_bin_byte_length == 0
+
+    x = feature_table.get_positions()[:, 0]
+    order = np.argsort(x)
+    expected_order = np.argsort(xyz[:, 0])
+    assert feature_table.get_normals()[order] == pytest.approx(normals[expected_order], abs=0.01)
+    assert_array_equal(batch_table.get_binary_property('classification', count)[order],
+                       values['classification'][expected_order])
+    assert_array_equal(batch_table.get_binary_property('intensity', count)[order],
+                       values['intensity'][expected_order])
+
+    # the points read back keep their attributes, with the normals oct-encoded again
+    loaded_dtype, loaded_attributes = read_point_attributes(tile)
+    assert loaded_dtype == point_dtype
+    assert_array_equal(loaded_attributes.view(point_dtype).ravel()['classification'][order],
+                       values['classification'][expected_order])
+    assert np.abs(loaded_attributes.view(point_dtype).ravel()['normal'][order].astype(int)
+                  - values['normal'][expected_order]).max() <= 1
+
+    # draco would store gps_time as float32
+    point_dtype = make_point_dtype(extra_attributes=['gps_time'])
+    attributes = pack_point_attributes(point_dtype, np.zeros((count, 3), dtype=np.uint8), {'gps_time': xyz[:, 0]})
+    with pytest.raises(ValueError):
+        pnts_writer.points_to_pnts(b'2', np.concatenate((xyz.view(np.uint8).ravel(), attributes.ravel())),
+                                   str(tmp_path), True, draco=True, point_dtype=point_dtype)
+
+
+def test_tileset_split(tmp_path):
+    aabb = np.array([[0, 0, 0], [8, 8, 8]], dtype=np.float32)
+    tile_index = {name: (1000, aabb) for name in [b'', b'0', b'00', b'000', b'01', b'1']}
+
+    policy = TilesetSplitPolicy(None, None, None)
+    tileset, size, tile_count, depth = Node._to_tileset(b'', aabb, 1, str(tmp_path), [1], tile_index, policy)
+    assert size == len(json.dumps(tileset))
+    assert (tile_count, depth) == (6, 4)
+
+    tileset = Node.to_tileset(b'', aabb, 1, str(tmp_path), [1], tile_index, TilesetSplitPolicy(None, 2, None))
+    assert sorted(os.listdir(tmp_path)) == ['tileset.0.json']
+    assert tileset['children'][0]['content'] == {'uri': 'tileset.0.json'}
+    with open(tmp_path / 'tileset.0.json') as f:
+        external_tileset = json.load(f)
+    assert len(external_tileset['root']['children']) == 2
+    assert 'extensionsUsed' not in external_tileset
+
+    os.mkdir(tmp_path / 'tiles')
+    Node.to_tileset(b'', aabb, 1, str(tmp_path / 'tiles'), [1], tile_index, TilesetSplitPolicy(None, None, 2),
+                    ['3DTILES_draco_point_compression'])
+    assert sorted(os.listdir(tmp_path / 'tiles')) == ['tileset.0.json']
+    with open(tmp_path / 'tiles' / 'tileset.0.json') as f:
+        external_tileset = json.load(f)
+    # the external tilesets also declare the extensions of the tiles
+    assert external_tileset['extensionsUsed'] == ['3DTILES_draco_point_compression']
+    assert external_tileset['extensionsRequired'] == ['3DTILES_draco_point_compression']
+
+
 def test_is_point_far_enough_perf(benchmark):
     benchmark(is_point_far_enough, sample_points, xyz, 0.25 ** 2)
 
@@ -0,0 +1,42 @@
+from py3dtiles.points.scheduler import MAX_BATCH_POINTS, MIN_BATCH_POINTS, Scheduler
+
+
+def test_priority():
+    scheduler = Scheduler()
+    scheduler.push(b'12', 10)
+    scheduler.push(b'3', 10)
+    scheduler.push(b'4', 10)
+    scheduler.push(b'5', 1000)
+    # the backlog of 4 grows: it's pushed again, and its old entry is ignored
+    scheduler.push(b'4', 5000)
+
+    assert scheduler.point_count == 6030
+    assert [scheduler.pop(set()) for _ in range(5)] == [b'4', b'5', b'3', b'12', None]
+    assert scheduler.point_count == 0
+    assert not scheduler
+
+
+def test_busy_node():
+    scheduler = Scheduler()
+    scheduler.push(b'1', 10)
+    scheduler.push(b'2', 10)
+    assert scheduler.pop({b'1'}) == b'2'
+    assert scheduler.pop({b'1'}) is None
+
+    scheduler.push(b'1', 100)
+    assert scheduler.pop({b'1'}) is None
+    scheduler.release(b'1')
+    assert scheduler.pop(set()) == b'1'
+    assert scheduler.point_count == 0
+
+
+def test_batch_size():
+    scheduler = Scheduler()
+    scheduler.push(b'1', 100_000)
+    assert scheduler.batch_size(4, False) == 100_000
+
+    scheduler.record(1000, 0.0001)
+    assert scheduler.batch_size(4, False) == MAX_BATCH_POINTS
+    # the remaining points are spread between the workers
+    assert scheduler.batch_size(4, True) == 25_000
+    assert scheduler.batch_size(8, True, memory_is_tight=True) == MIN_BATCH_POINTS
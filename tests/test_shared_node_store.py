@@ -0,0 +1,64 @@
+import os
+
+import lz4.frame as gzip
+from pytest import fixture
+
+from py3dtiles.points.shared_node_store import SharedNodeStore
+
+
+@fixture()
+def store(tmp_path):
+    store = SharedNodeStore(str(tmp_path))
+    yield store
+    store.close()
+
+
+def test_remove_oldest_nodes(store):
+    for name in [b'1', b'2', b'3', b'4']:
+        store.put(name, os.urandom(1000))
+    # 1 is now the most recently used node
+    store.get(b'1')
+
+    count, bytes_written = store.remove_oldest_nodes(0.3)
+    assert count == 2
+    assert list(store.data) == [b'4', b'1']
+    assert set(store.on_disk) == {b'2', b'3'}
+
+    # evicted nodes are still readable, while and after they're written
+    data = gzip.decompress(store.get(b'2'))
+    store.flush()
+    assert gzip.decompress(store.get(b'2')) == data
+    assert os.path.exists(store._filename(b'2', store.generation))
+    assert store.stats['miss'] == 1
+
+
+def test_remove_evicted_node(store):
+    store.put(b'1', b'data')
+    store.remove_oldest_nodes(1)
+    assert not store.data
+
+    store.remove(b'1')
+    assert not store.on_disk
+    assert not os.path.exists(store._filename(b'1', store.generation))
+    assert store.get(b'1') == b''
+
+
+def test_checkpoint(store):
+    store.put(b'1', b'data')
+    store.put(b'2', b'data')
+    checkpoint = store.checkpoint()
+    assert not store.writing
+    assert checkpoint['on_disk'] == {b'1': 0, b'2': 0}
+    # the nodes stay in the cache
+    assert list(store.data) == [b'1', b'2']
+    assert gzip.decompress(store.get(b'1')) == b'data'
+    assert store.stats['miss'] == 0
+
+    # the nodes unchanged since the checkpoint aren't written again
+    store.commit_checkpoint()
+    store.put(b'2', b'new data')
+    assert store.remove_oldest_nodes(1) == (2, len(gzip.compress(b'new data')))
+    store.flush()
+    assert store.on_disk == {b'1': 0, b'2': 1}
+    assert gzip.decompress(store.get(b'1')) == b'data'
+    assert gzip.decompress(store.get(b'2')) == b'new data'
@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from py3dtiles.points.task.pnts_writer import points_to_pnts
+from py3dtiles.tileset_index import INDEX_FILENAME, load_tileset_index, read_tile_metadata
+
+
+def _write_tile(folder, name, xyz):
+    rgb = np.zeros((len(xyz), 3), dtype=np.uint8)
+    points = np.concatenate((xyz.astype(np.float32).view(np.uint8).ravel(), rgb.ravel()))
+    return points_to_pnts(name, points, folder, True)[1]
+
+
+def test_read_tile_metadata(tmp_path):
+    xyz = np.array([[0, 0, 5], [10, 1, 5], [2.5, 0.5, 6]])
+    filename = _write_tile(str(tmp_path), b'1', xyz)
+
+    metadata = read_tile_metadata(filename)
+    assert metadata.point_count == 3
+    assert metadata.byte_length == os.path.getsize(filename)
+    assert metadata.aabb is None
+
+    metadata = read_tile_metadata(filename, bounds=True)
+    assert metadata.aabb.tolist() == [[0, 0, 5], [10, 1, 6]]
+
+    with pytest.raises(RuntimeError):
+        read_tile_metadata(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dragon_low.b3dm'))
+
+
+def test_load_tileset_index(tmp_path):
+    folder = str(tmp_path)
+    _write_tile(folder, b'', np.random.random((10, 3)))
+    _write_tile(folder, b'0', np.random.random((20, 3)))
+    # the tiles with long names are written in sub-folders
+    _write_tile(folder, b'0123456701', np.random.random((30, 3)))
+
+    index = load_tileset_index(folder, jobs=2)
+    assert sorted(index) == ['01234567/r01.pnts', 'r.pnts', 'r0.pnts']
+    assert [index[f].point_count for f in sorted(index)] == [30, 10, 20]
+    assert os.path.exists(os.path.join(folder, INDEX_FILENAME))
+
+    # the unchanged tiles are read from the index
+    with open(os.path.join(folder, INDEX_FILENAME)) as f:
+        cached = json.load(f)
+    cached['r.pnts']['point_count'] = 42
+    with open(os.path.join(folder, INDEX_FILENAME), 'w') as f:
+        json.dump(cached, f)
+    assert load_tileset_index(folder)['r.pnts'].point_count == 42
+
+    # the modified and deleted tiles are updated
+    os.remove(os.path.join(folder, 'r.pnts'))
+    _write_tile(folder, b'', np.array([[1, 2, 3], [4, 5, 6]]))
+    os.remove(os.path.join(folder, 'r0.pnts'))
+    index = load_tileset_index(folder, bounds=True)
+    assert sorted(index) == ['01234567/r01.pnts', 'r.pnts']
+    assert index['r.pnts'].point_count == 2
+    assert index['r.pnts'].aabb.tolist() == [[1, 2, 3], [4, 5, 6]]
+    with open(os.path.join(folder, INDEX_FILENAME)) as f:
+        assert sorted(json.load(f)) == ['01234567/r01.pnts', 'r.pnts']